@@ -1,8 +1,16 @@
-import logging, sys, hashlib
-from flask import Blueprint, jsonify, Flask, request
-from worker.workflows import process_locations
+import logging, math, sys, threading, time, json, re
+from flask import Blueprint, jsonify, Flask, request, g, Response, stream_with_context
+from worker.workflows import celery, submit_locations, submit_article, get_stage_index, PIPELINE_MODES
+from worker.batches import submit_batch, get_batch_status
+from worker.tasks.base.output import load_output
+from utils.progress import get_workflow, get_progress, subscribe
+from utils.results import get_result, save_result, result_etag
 from utils.scrape import _normalize_url
+from utils.admission import client_id, take_token, check_backlog
 from utils.slack import post_slack_log_message
+from utils.metrics import incr, observe, render_prometheus
+from conf.settings import BATCH_MAX_URLS, STREAM_KEEPALIVE, STREAM_MAX_DURATION, STREAM_MAX_CONCURRENT, PRIORITIES, DEFAULT_PRIORITY, \
+    BATCH_PRIORITY, ADMISSION_ENABLED, RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST
 
 # Configure logging to output to stdout
 logging.basicConfig(
@@ -17,6 +25,88 @@ app = Flask(__name__)
 # Create blueprint and define its routes
 main_blueprint = Blueprint("main", __name__,)
 
+# Open progress streams in this process, each of which holds a server thread
+_stream_slots = threading.BoundedSemaphore(STREAM_MAX_CONCURRENT)
+
+########## METRICS ##########
+
+@main_blueprint.before_app_request
+def start_request_timer():
+    g.request_started_at = time.time()
+
+@main_blueprint.after_app_request
+def record_request_metrics(response):
+    """
+    Counts every request and records its latency, labeled by route pattern
+    rather than raw path so article URLs don't explode the label space.
+    """
+    try:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        incr("agate_http_requests_total", endpoint=endpoint, method=request.method, status=response.status_code)
+        if hasattr(g, 'request_started_at'):
+            observe("agate_http_request_duration_seconds", time.time() - g.request_started_at, endpoint=endpoint)
+    except Exception as e:
+        logging.warning(f"Could not record request metrics: {str(e)}")
+    return response
+
+########## HELPER FUNCTIONS ##########
+
+def _parse_batch_urls():
+    """
+    Reads the URLs from a batch request body: a JSON array (or {"urls": [...]})
+    or NDJSON, one entry per line. Entries are URLs or {"url": ...} objects.
+
+    Raises:
+        ValueError: If the body can't be parsed
+    """
+    body = request.get_data(as_text=True)
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        entries = [json.loads(line) for line in body.splitlines() if line.strip()]
+    else:
+        entries = json.loads(body or 'null')
+        if isinstance(entries, dict):
+            entries = entries.get('urls')
+        if not isinstance(entries, list):
+            raise ValueError("Expected a JSON array of URLs")
+
+    urls = []
+    for entry in entries:
+        url = entry.get('url') if isinstance(entry, dict) else entry
+        if not isinstance(url, str) or not url.strip():
+            raise ValueError(f"Invalid URL entry: {json.dumps(entry)}")
+        urls.append(url.strip())
+    return urls
+
+def _admit(priority, count=1, cost=None):
+    """
+    Admission control for a submission of count articles: the pipeline's
+    backlog ceiling for its priority, then the client's rate limit, which each
+    article takes a token from unless a cost is given. Clients are identified
+    by the X-API-Key header, or else their IP address.
+
+    Returns:
+        tuple: A 429 response with Retry-After, or None if it is admitted
+    """
+    wait, reason = check_backlog(priority, count), 'backlog'
+    if not wait:
+        client = client_id(request.headers.get('X-API-Key'), request.remote_addr)
+        wait, reason = take_token(client, cost=count if cost is None else cost), 'rate_limit'
+    if not wait:
+        return None
+
+    incr("agate_admission_rejected_total", reason=reason, priority=priority)
+    retry_after = max(1, math.ceil(wait))
+    response = jsonify({
+        "status": "error",
+        "error": "Too many requests" if reason == 'rate_limit' else "The pipeline is at capacity",
+        "retry_after": retry_after
+    })
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+def _invalid_priority(priority):
+    return jsonify({"error": f"Unknown priority, expected one of: {', '.join(PRIORITIES)}"}), 400
+
 ########## ROUTES ##########
 
 @main_blueprint.route("/", methods=["GET"])
@@ -26,6 +116,13 @@ def healthcheck():
     '''
     return 'ok', 200
 
+@main_blueprint.route("/metrics", methods=["GET"])
+def metrics():
+    '''
+    Prometheus metrics for the API and the whole pipeline.
+    '''
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @main_blueprint.route("/locations/<path:url>", methods=["GET"])
 @main_blueprint.route("/locations", methods=["GET"])
 def process_url(url=None):
@@ -34,6 +131,15 @@ def process_url(url=None):
     
     Args:
         url: Full URL to the article (can be provided as path parameter or query parameter)
+        mode: Optional query parameter, "chained" (each stage is a task) or "fused"
+            (all stages in one task, for lower latency)
+        from_stage: Optional query parameter, a stage to rerun the article from
+            using the checkpoints of the stages before it (e.g. geocode)
+        resume: Optional query parameter, 1 to pick up from the latest checkpoint
+        max_age: Optional query parameter, in hours. If the article was saved
+            more recently, its output location is returned instead.
+        priority: Optional query parameter, breaking, interactive (default)
+            or backfill. Higher priorities are processed first.
     """
     try:
         # Check if URL is provided as query parameter
@@ -41,6 +147,30 @@ def process_url(url=None):
             url = request.args.get('url', '')
             if not url:
                 return jsonify({"error": "No URL provided"}), 400
+
+        mode = request.args.get('mode') or None
+        if mode and mode not in PIPELINE_MODES:
+            return jsonify({"error": f"Unknown mode, expected one of: {', '.join(PIPELINE_MODES)}"}), 400
+
+        from_stage = request.args.get('from_stage') or None
+        if from_stage:
+            try:
+                get_stage_index(from_stage)
+            except ValueError:
+                return jsonify({"error": f"Unknown stage: {from_stage}"}), 400
+        resume = request.args.get('resume', '').lower() in ('1', 'true')
+
+        try:
+            max_age = float(request.args.get('max_age') or 0) * 60 * 60
+        except ValueError:
+            return jsonify({"error": "max_age must be a number of hours"}), 400
+
+        priority = request.args.get('priority') or DEFAULT_PRIORITY
+        if priority not in PRIORITIES:
+            return _invalid_priority(priority)
+        rejected = _admit(priority)
+        if rejected:
+            return rejected
                 
         # Normalize URL
         url = _normalize_url(url)
@@ -48,19 +178,37 @@ def process_url(url=None):
         # Log the request
         logging.info(f"LOCATION REQUEST: Processing URL: {url}")
         
-        # Create a task to scrape the article asynchronously
+        # Submit the workflow straight to the broker
         # Don't wait for the result - return immediately
-        task = process_locations.apply_async(args=[url])
+        try:
+            submitted = submit_locations(url, mode, from_stage=from_stage, resume=resume, max_age=max_age,
+                                         priority=priority)
+        except LookupError as e:
+            return jsonify({"status": "error", "error": str(e)}), 409
+
+        if submitted.get('processed'):
+            logging.info(f"LOCATION ALREADY PROCESSED: {url} was saved at {submitted['processed']['saved_at']}")
+            return jsonify({
+                "status": "processed",
+                "message": "Article was processed recently",
+                "url": url,
+                **submitted['processed']
+            }), 200
         
         # Log the task ID
-        logging.info(f"LOCATION TASK CREATED: Task ID: {task.id} for URL: {url}")
+        logging.info(f"LOCATION TASK CREATED: Task ID: {submitted['task_id']}, root ID: {submitted['root_id']}, mode: {submitted['mode']}, from stage: {submitted['from_stage']} for URL: {url}")
         
         return jsonify({
             "status": "submitted",
-            "message": "Article processing started",
-            "task_id": task.id,
+            "message": "Article is already being processed" if submitted["deduplicated"] else "Article processing started",
+            "deduplicated": submitted["deduplicated"],
+            "task_id": submitted["task_id"],
+            "root_id": submitted["root_id"],
             "url": url,
-            "output_filename": f"{hashlib.sha256(url.encode()).hexdigest()[:20]}.json"
+            "output_filename": submitted["output_filename"],
+            "mode": submitted["mode"],
+            "from_stage": submitted["from_stage"],
+            "priority": submitted.get("priority")
         }), 202  # 202 Accepted
         
     except Exception as e:
@@ -73,6 +221,292 @@ def process_url(url=None):
         }), 500
 
 
+@main_blueprint.route("/locations", methods=["POST"])
+def process_article():
+    """
+    Returns locations from an article submitted as JSON, skipping the scrape.
+
+    Args:
+        headline: Article headline
+        text: Article body text
+        url, author, pub_date: Optional article metadata
+        mode: Optional query parameter, see process_url
+        priority: Optional, in the body or as a query parameter, see process_url
+    """
+    try:
+        article = request.get_json(silent=True)
+        if not isinstance(article, dict):
+            return jsonify({"error": "Expected a JSON object with the article's headline and text"}), 400
+        if not article.get('headline') or not article.get('text'):
+            return jsonify({"error": "headline and text are required"}), 400
+
+        mode = request.args.get('mode') or None
+        if mode and mode not in PIPELINE_MODES:
+            return jsonify({"error": f"Unknown mode, expected one of: {', '.join(PIPELINE_MODES)}"}), 400
+
+        priority = article.get('priority') or request.args.get('priority') or DEFAULT_PRIORITY
+        if priority not in PRIORITIES:
+            return _invalid_priority(priority)
+        rejected = _admit(priority)
+        if rejected:
+            return rejected
+
+        article = {k: article.get(k) for k in ('headline', 'text', 'url', 'author', 'pub_date')}
+        if article['url']:
+            article['url'] = _normalize_url(article['url'])
+
+        logging.info(f"ARTICLE REQUEST: Processing article: {article['headline']}")
+        submitted = submit_article(article, mode, priority=priority)
+        logging.info(f"ARTICLE TASK CREATED: Task ID: {submitted['task_id']}, root ID: {submitted['root_id']}, mode: {submitted['mode']} for article: {submitted['output_filename']}")
+
+        return jsonify({
+            "status": "submitted",
+            "message": "Article is already being processed" if submitted["deduplicated"] else "Article processing started",
+            "deduplicated": submitted["deduplicated"],
+            "task_id": submitted["task_id"],
+            "root_id": submitted["root_id"],
+            "url": article['url'],
+            "output_filename": submitted["output_filename"],
+            "mode": submitted["mode"],
+            "from_stage": submitted["from_stage"],
+            "priority": submitted.get("priority")
+        }), 202  # 202 Accepted
+
+    except Exception as e:
+        logging.error(f"ARTICLE ERROR: Error processing article: {str(e)}")
+        import traceback
+        logging.error(f"ARTICLE ERROR TRACEBACK: {traceback.format_exc()}")
+        return jsonify({
+            "status": "error",
+            "error": str(e)
+        }), 500
+
+@main_blueprint.route("/locations/status/<task_id>", methods=["GET"])
+def task_status(task_id):
+    """
+    Returns the status of a submitted workflow: queued, running (and at which
+    stage), complete or failed.
+
+    Args:
+        task_id: Task ID returned when the URL was submitted
+    """
+    workflow = get_workflow(task_id) or {"task_id": task_id, "root_id": task_id}
+    state = celery.AsyncResult(task_id).state
+    progress = get_progress(workflow['root_id'])
+
+    if state == 'SUCCESS':
+        status = 'complete'
+    elif state in ('FAILURE', 'REVOKED'):
+        status = 'failed'
+    elif progress:
+        status = 'running'
+    elif 'output_filename' in workflow:
+        status = 'queued'
+    else:
+        return jsonify({"error": "Task not found"}), 404
+
+    response = {
+        "task_id": task_id,
+        "root_id": workflow['root_id'],
+        "output_filename": workflow.get('output_filename'),
+        "status": status,
+        "state": state,
+        "stage": (progress or {}).get('current'),
+        "stages": (progress or {}).get('stages', {}),
+        "updated_at": (progress or {}).get('updated_at')
+    }
+    if status == 'complete' and workflow.get('output_filename'):
+        response['result_url'] = f"/locations/result/{workflow['output_filename']}"
+    return jsonify(response), 200
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@main_blueprint.route("/locations/stream/<task_id>", methods=["GET"])
+def task_stream(task_id):
+    """
+    Streams a workflow's progress as server-sent events. The stream opens with
+    a "progress" event giving the stages reached so far, then sends a "stage"
+    event whenever a stage starts or finishes. Finished milestones are sent as
+    scraped, classified, extracted, filtered, geocoded and finalized events,
+    with the locations found so far. It ends with a "complete" or "failed"
+    event, or a "timeout" event after STREAM_MAX_DURATION, when the client
+    should reconnect. Returns 503 if this process already has
+    STREAM_MAX_CONCURRENT streams open.
+
+    Args:
+        task_id: Task ID returned when the URL was submitted
+    """
+    if not _stream_slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many open streams, poll /locations/status instead"})
+        response.headers['Retry-After'] = str(int(STREAM_KEEPALIVE))
+        return response, 503
+
+    try:
+        workflow = get_workflow(task_id) or {"task_id": task_id, "root_id": task_id}
+        result = celery.AsyncResult(task_id)
+
+        # Subscribe before reading the progress so no event falls between the two
+        pubsub = subscribe(workflow['root_id'])
+    except Exception:
+        _stream_slots.release()
+        raise
+
+    def close():
+        pubsub.close()
+        _stream_slots.release()
+
+    try:
+        progress = get_progress(workflow['root_id'])
+        if not progress and 'output_filename' not in workflow and result.state == 'PENDING':
+            close()
+            return jsonify({"error": "Task not found"}), 404
+    except Exception:
+        close()
+        raise
+
+    def finished():
+        if result.state == 'SUCCESS':
+            return 'complete'
+        if result.state in ('FAILURE', 'REVOKED'):
+            return 'failed'
+        return None
+
+    def generate():
+        end = {"task_id": task_id, "output_filename": workflow.get('output_filename')}
+        if end['output_filename']:
+            end['result_url'] = f"/locations/result/{end['output_filename']}"
+        yield _sse('progress', {"task_id": task_id, "root_id": workflow['root_id'], **(progress or {})})
+
+        status = finished()
+        if status:
+            yield _sse(status, end)
+            return
+
+        started_at = last_sent = time.time()
+        while time.time() - started_at < STREAM_MAX_DURATION:
+            message = pubsub.get_message(timeout=1.0)
+            if message and message['type'] == 'message':
+                event = json.loads(message['data'])
+                if event.get('event') == 'complete':
+                    yield _sse('complete', {**end, **event})
+                    return
+                yield _sse(event.get('event') or 'stage', event)
+                last_sent = time.time()
+            elif time.time() - last_sent >= STREAM_KEEPALIVE:
+                # Catches workflows that end without saving, e.g. a failed scrape
+                status = finished()
+                if status:
+                    yield _sse(status, end)
+                    return
+                yield ": keepalive\n\n"
+                last_sent = time.time()
+        yield _sse('timeout', end)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    # Runs when the response is closed, even if the client left before it started
+    response.call_on_close(close)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@main_blueprint.route("/locations/result/<output_filename>", methods=["GET"])
+def task_result(output_filename):
+    """
+    Returns an article's finished output, from the result cache or else Azure.
+    Responses carry an ETag, so clients can poll with If-None-Match and get a
+    304 until the output changes.
+
+    Args:
+        output_filename: Output filename returned when the URL was submitted
+    """
+    if not re.fullmatch(r'[0-9a-f]{20}(\.json)?', output_filename):
+        return jsonify({"error": "Invalid output filename"}), 400
+    if not output_filename.endswith('.json'):
+        output_filename += '.json'
+
+    data = get_result(output_filename)
+    if data is None:
+        data = load_output(output_filename)
+        if data is None:
+            return jsonify({"error": "Result not found"}), 404
+        save_result(output_filename, data)
+
+    response = Response(data, mimetype='application/json')
+    response.set_etag(result_etag(data))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@main_blueprint.route("/locations/batch", methods=["POST"])
+def process_batch():
+    """
+    Submits many URLs at once, as a JSON array or NDJSON body, and returns a
+    batch ID with each URL's task IDs and output filename.
+
+    Args:
+        mode: Optional query parameter, see process_url
+        priority: Optional query parameter, see process_url. Batches default
+            to backfill, and are limited to RATE_LIMIT_BURST URLs at any
+            other priority.
+    """
+    try:
+        try:
+            urls = _parse_batch_urls()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if not urls:
+            return jsonify({"error": "No URLs provided"}), 400
+        if len(urls) > BATCH_MAX_URLS:
+            return jsonify({"error": f"Too many URLs, the limit is {BATCH_MAX_URLS} per batch"}), 413
+
+        mode = request.args.get('mode') or None
+        if mode and mode not in PIPELINE_MODES:
+            return jsonify({"error": f"Unknown mode, expected one of: {', '.join(PIPELINE_MODES)}"}), 400
+
+        priority = request.args.get('priority') or BATCH_PRIORITY
+        if priority not in PRIORITIES:
+            return _invalid_priority(priority)
+
+        # A backfill batch takes one rate limit token, since the backfill
+        # backlog ceiling already keeps it from crowding out newsroom work.
+        # Higher priority batches take one per URL, so can't be bigger than
+        # the bucket.
+        cost = 1 if priority == 'backfill' else len(urls)
+        if ADMISSION_ENABLED and RATE_LIMIT_PER_MINUTE > 0 and cost > RATE_LIMIT_BURST:
+            return jsonify({"error": f"Too many URLs, the rate limit allows {RATE_LIMIT_BURST} per {priority} batch"}), 413
+        rejected = _admit(priority, len(urls), cost)
+        if rejected:
+            return rejected
+
+        batch = submit_batch([_normalize_url(url) for url in urls], mode, priority)
+
+        return jsonify({
+            "status": "submitted",
+            "message": "Batch processing started",
+            **batch
+        }), 202  # 202 Accepted
+
+    except Exception as e:
+        logging.error(f"BATCH ERROR: Error submitting batch: {str(e)}")
+        import traceback
+        logging.error(f"BATCH ERROR TRACEBACK: {traceback.format_exc()}")
+        return jsonify({
+            "status": "error",
+            "error": str(e)
+        }), 500
+
+@main_blueprint.route("/locations/batch/<batch_id>", methods=["GET"])
+def batch_status(batch_id):
+    """
+    Returns a batch's progress. Pass items=0 to leave out the per-URL states.
+    """
+    include_items = request.args.get('items', '1').lower() not in ('0', 'false')
+    status = get_batch_status(batch_id, include_items=include_items)
+    if status is None:
+        return jsonify({"error": "Batch not found"}), 404
+    return jsonify(status), 200
+
 # Register blueprint
 app.register_blueprint(main_blueprint)
 
@@ -2,4 +2,7 @@
 
 echo "Starting Gunicorn..."
 cd /usr/src/app
-exec gunicorn --bind 0.0.0.0:8000 --timeout 120 --workers 4 --threads 2 --worker-class gthread api.app:app
\ No newline at end of file
+# Progress streams hold a thread each (up to STREAM_MAX_CONCURRENT per worker), so each
+# worker has enough threads to keep serving other requests alongside them
+exec gunicorn --bind 0.0.0.0:8000 --timeout 120 --workers "${WEB_WORKERS:-4}" --threads "${WEB_THREADS:-24}" \
+  --worker-class gthread api.app:app
\ No newline at end of file
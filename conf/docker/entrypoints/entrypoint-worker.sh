@@ -1,6 +1,52 @@
 #!/bin/bash
 set -e
 
+# Worker pools, as a comma-separated list of queue:pool:concurrency, e.g.
+#   WORKER_POOLS="scrape+scrape_backfill:threads:20,scrape_backfill:threads:4,llm:threads:16,..."
+# Each entry starts its own worker consuming that queue, or several joined with
+# "+". The work is almost all network I/O, so threads (or gevent, if installed)
+# suit most queues; prefork suits CPU-bound work. Without WORKER_POOLS, a single
+# worker consumes WORKER_QUEUES (default: every pipeline queue) with Celery's
+# default pool.
+#
+# Backfill is sent to a "_backfill" copy of each queue. Workers consume their
+# queues in the order listed (queue_order_strategy=priority), so list a queue
+# before its backfill copy: the pool then only takes backfill when the queue is
+# empty. Give the backfill queues a small pool of their own too, to keep them
+# moving while the newsroom queues are busy, listing the later pipeline stages
+# first so articles already started finish before new ones are scraped.
+
 echo "Starting Celery worker..."
 cd /usr/src/app
-exec celery -A worker.workflows worker --loglevel=info
\ No newline at end of file
+
+DEFAULT_QUEUES="${CELERY_QUEUE_NAME:-celery}"
+if [ "${CELERY_ROUTING_ENABLED:-true}" != "false" ]; then
+  DEFAULT_QUEUES="$DEFAULT_QUEUES,${CELERY_SCRAPE_QUEUE:-scrape},${CELERY_LLM_QUEUE:-llm},${CELERY_GEOCODE_QUEUE:-geocode},${CELERY_IO_QUEUE:-io}"
+fi
+if [ "${BACKFILL_QUEUES_ENABLED:-true}" != "false" ]; then
+  BACKFILL_QUEUES=""
+  IFS=',' read -ra QUEUES <<< "$DEFAULT_QUEUES"
+  for queue in "${QUEUES[@]}"; do
+    BACKFILL_QUEUES="$BACKFILL_QUEUES,$queue${BACKFILL_QUEUE_SUFFIX:-_backfill}"
+  done
+  DEFAULT_QUEUES="$DEFAULT_QUEUES$BACKFILL_QUEUES"
+fi
+
+if [ -z "$WORKER_POOLS" ]; then
+  exec celery -A worker.workflows worker --loglevel=info -Q "${WORKER_QUEUES:-$DEFAULT_QUEUES}"
+fi
+
+IFS=',' read -ra POOLS <<< "$WORKER_POOLS"
+for spec in "${POOLS[@]}"; do
+  IFS=':' read -r queue pool concurrency <<< "$spec"
+  echo "Starting $pool pool for queue $queue with concurrency ${concurrency:-default}"
+  celery -A worker.workflows worker --loglevel=info \
+    -Q "${queue//+/,}" -P "${pool:-prefork}" ${concurrency:+-c "$concurrency"} -n "${queue//+/-}@%h" &
+done
+
+# Stop the container if any pool exits, so it gets restarted as a whole
+trap 'kill $(jobs -p) 2>/dev/null' TERM INT
+status=0
+wait -n || status=$?
+kill $(jobs -p) 2>/dev/null || true
+exit $status
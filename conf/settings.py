@@ -1,4 +1,4 @@
-import os
+import json, os
 from dotenv import load_dotenv
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '../.env')
@@ -36,7 +36,165 @@ CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL") or ''
 CELERY_RESULT_BACKEND = os.environ.get("CELERY_RESULT_BACKEND") or ''
 CELERY_QUEUE_NAME = os.environ.get("CELERY_QUEUE_NAME") or 'celery' 
 CELERY_BROKER_TRANSPORT_OPTIONS = {'region': os.environ.get("CELERY_QUEUE_REGION", 'us-west-1')}
-CELERY_UPDATE_THROTTLE = os.environ.get("CELERY_UPDATE_THROTTLE") or 30 
+CELERY_UPDATE_THROTTLE = os.environ.get("CELERY_UPDATE_THROTTLE") or 30
+
+# Message serialization. Workers always accept both formats; switch CELERY_SERIALIZER to
+# orjson_zstd (orjson, zstd-compressed above the threshold) once every worker accepts it.
+CELERY_SERIALIZER = os.environ.get("CELERY_SERIALIZER") or 'json'
+CELERY_ACCEPT_CONTENT = [c.strip() for c in (os.environ.get("CELERY_ACCEPT_CONTENT") or 'json,orjson_zstd').split(',') if c.strip()]
+CELERY_COMPRESSION_THRESHOLD = int(os.environ.get("CELERY_COMPRESSION_THRESHOLD") or 1024)
+CELERY_ZSTD_LEVEL = int(os.environ.get("CELERY_ZSTD_LEVEL") or 3)
+
+# Default pipeline mode, which requests can override: "chained" runs every stage as its own
+# task, "fused" runs them all in one task on one worker to skip the broker hops between them.
+PIPELINE_MODE = os.environ.get("PIPELINE_MODE") or 'chained'
+
+# Batch submissions: most URLs accepted per request, and how long batch status is kept
+BATCH_MAX_URLS = int(os.environ.get("BATCH_MAX_URLS") or 10000)
+BATCH_TTL = int(os.environ.get("BATCH_TTL") or 60 * 60 * 24 * 7)
+
+# Task routing. Stages are sent to a queue per bottleneck (scraping, LLM calls, geocoding,
+# other I/O) so each can get its own worker pool; tasks without a route use CELERY_QUEUE_NAME.
+# With CELERY_ROUTING_ENABLED=false everything runs on CELERY_QUEUE_NAME.
+CELERY_ROUTING_ENABLED = (os.environ.get("CELERY_ROUTING_ENABLED") or 'true').lower() == 'true'
+CELERY_SCRAPE_QUEUE = os.environ.get("CELERY_SCRAPE_QUEUE") or 'scrape'
+CELERY_LLM_QUEUE = os.environ.get("CELERY_LLM_QUEUE") or 'llm'
+CELERY_GEOCODE_QUEUE = os.environ.get("CELERY_GEOCODE_QUEUE") or 'geocode'
+CELERY_IO_QUEUE = os.environ.get("CELERY_IO_QUEUE") or 'io'
+
+# Request priorities, highest first, and the message priority each is sent at (the Redis
+# broker delivers the lowest number first, in steps of 0, 3, 6 and 9). Single submissions
+# default to DEFAULT_PRIORITY and batches to BATCH_PRIORITY.
+PRIORITIES = {'breaking': 0, 'interactive': 3, 'backfill': 6}
+DEFAULT_PRIORITY = os.environ.get("DEFAULT_PRIORITY") or 'interactive'
+BATCH_PRIORITY = os.environ.get("BATCH_PRIORITY") or 'backfill'
+
+# Backfill runs on a copy of each queue named with BACKFILL_QUEUE_SUFFIX, so it can be given
+# worker capacity of its own and keeps making progress however busy the newsroom queues are.
+# Workers take one message at a time so queued backfill can't hold up later priority work.
+BACKFILL_QUEUES_ENABLED = (os.environ.get("BACKFILL_QUEUES_ENABLED") or 'true').lower() == 'true'
+BACKFILL_QUEUE_SUFFIX = os.environ.get("BACKFILL_QUEUE_SUFFIX") or '_backfill'
+WORKER_PREFETCH_MULTIPLIER = int(os.environ.get("WORKER_PREFETCH_MULTIPLIER") or 1)
+
+_base_queues = [CELERY_QUEUE_NAME] + ([CELERY_SCRAPE_QUEUE, CELERY_LLM_QUEUE, CELERY_GEOCODE_QUEUE, CELERY_IO_QUEUE] if CELERY_ROUTING_ENABLED else [])
+CELERY_QUEUES = _base_queues + ([f"{q}{BACKFILL_QUEUE_SUFFIX}" for q in _base_queues] if BACKFILL_QUEUES_ENABLED else [])
+
+# Admission control. Each client (API key, or IP address without one) has a token bucket of
+# RATE_LIMIT_BURST submissions refilled at RATE_LIMIT_PER_MINUTE; a backfill batch counts as one
+# submission, any other batch as one per URL. New work is turned away with a 429 once BACKLOG_MAX
+# messages are waiting across the pipeline queues, or BACKFILL_BACKLOG_MAX for backfill, so a
+# backfill backlog always leaves room for newsroom requests.
+ADMISSION_ENABLED = (os.environ.get("ADMISSION_ENABLED") or 'true').lower() == 'true'
+RATE_LIMIT_PER_MINUTE = float(os.environ.get("RATE_LIMIT_PER_MINUTE") or 120)
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST") or 240)
+BACKLOG_MAX = int(os.environ.get("BACKLOG_MAX") or 20000)
+BACKFILL_BACKLOG_MAX = int(os.environ.get("BACKFILL_BACKLOG_MAX") or BACKLOG_MAX // 2)
+BACKLOG_RETRY_AFTER = int(os.environ.get("BACKLOG_RETRY_AFTER") or 30)
+
+# Queues whose depth is reported by the metrics endpoints
+METRICS_QUEUES = [q.strip() for q in (os.getenv('METRICS_QUEUES') or ','.join(CELERY_QUEUES)).split(',') if q.strip()]
+METRICS_EXPORTER_PORT = int(os.getenv('METRICS_EXPORTER_PORT') or 9808)
+
+# Payload logging. Payloads are only serialized when PAYLOAD_LOG_LEVEL is enabled and the
+# article is sampled; strings and lists past the limits are truncated (0 = no limit).
+PAYLOAD_LOG_LEVEL = os.getenv('PAYLOAD_LOG_LEVEL') or 'INFO'
+PAYLOAD_LOG_SAMPLE_RATE = float(os.getenv('PAYLOAD_LOG_SAMPLE_RATE') or 1.0)
+PAYLOAD_LOG_MAX_STRING = int(os.getenv('PAYLOAD_LOG_MAX_STRING') or 300)
+PAYLOAD_LOG_MAX_ITEMS = int(os.getenv('PAYLOAD_LOG_MAX_ITEMS') or 25)
+
+# Payload store for large immutable fields (like article text), which tasks pass by handle
+# instead of copying through every broker hop. Uses Redis unless PAYLOAD_STORE_DIR (a
+# directory shared by all workers) is set.
+PAYLOAD_STORE_ENABLED = (os.getenv('PAYLOAD_STORE_ENABLED') or 'true').lower() == 'true'
+PAYLOAD_STORE_DIR = os.getenv('PAYLOAD_STORE_DIR') or ''
+PAYLOAD_STORE_TTL = int(os.getenv('PAYLOAD_STORE_TTL') or 60 * 60 * 24 * 7)
+PAYLOAD_STORE_MIN_SIZE = int(os.getenv('PAYLOAD_STORE_MIN_SIZE') or 2048)
+
+# Stage checkpoints, for resuming an article from a stage instead of starting over. They
+# reference the payload store, so don't keep them longer than it. Bump CHECKPOINT_VERSION to
+# invalidate every checkpoint, e.g. after changing shared code the stage versions don't cover.
+CHECKPOINTS_ENABLED = (os.getenv('CHECKPOINTS_ENABLED') or 'true').lower() == 'true'
+CHECKPOINT_TTL = int(os.getenv('CHECKPOINT_TTL') or PAYLOAD_STORE_TTL)
+CHECKPOINT_VERSION = os.getenv('CHECKPOINT_VERSION') or '1'
+
+# In-flight deduplication. A URL submitted while it is already being processed attaches to
+# the running workflow; the claim lapses after INFLIGHT_TTL if the workflow never finishes.
+# Saved articles are remembered for PROCESSED_TTL so requests can skip recent ones.
+INFLIGHT_DEDUPE_ENABLED = (os.getenv('INFLIGHT_DEDUPE_ENABLED') or 'true').lower() == 'true'
+INFLIGHT_TTL = int(os.getenv('INFLIGHT_TTL') or 60 * 60)
+PROCESSED_TTL = int(os.getenv('PROCESSED_TTL') or 60 * 60 * 24 * 30)
+
+# Workflow progress (which stage each article is at) and finished results, kept in Redis
+# for the status and result endpoints. Results older than RESULT_CACHE_TTL are read back
+# from Azure.
+PROGRESS_TTL = int(os.getenv('PROGRESS_TTL') or 60 * 60 * 24 * 7)
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL') or 60 * 60 * 24 * 7)
+
+# Server-sent event streams of workflow progress. Each open stream holds a web server thread,
+# so each process serves at most STREAM_MAX_CONCURRENT streams (keep it well under the
+# entrypoint's WEB_THREADS, so other requests always have threads left), streams send a
+# keepalive every STREAM_KEEPALIVE seconds and close after STREAM_MAX_DURATION, after which
+# clients reconnect.
+STREAM_KEEPALIVE = float(os.getenv('STREAM_KEEPALIVE') or 15)
+STREAM_MAX_DURATION = float(os.getenv('STREAM_MAX_DURATION') or 60 * 5)
+STREAM_MAX_CONCURRENT = int(os.getenv('STREAM_MAX_CONCURRENT') or 8)
+
+# Cache settings. Caches share the Celery Redis instance unless told otherwise.
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL') or REDIS_URL or CELERY_BROKER_URL or 'redis://localhost:6379/0'
+LLM_CACHE_ENABLED = (os.getenv('LLM_CACHE_ENABLED') or 'true').lower() == 'true'
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL') or 60 * 60 * 24 * 30)
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES') or 100000)
+
+# OpenAI rate limits shared by every worker through Redis: requests and tokens per minute for
+# each model. The fleet learns the account's real limits from OpenAI's rate-limit headers and
+# uses the lower of the two, so these can be set below the account's limits to leave room for
+# other users of the key. OPENAI_RATE_LIMITS (JSON, same shape) replaces them. Calls wait at
+# most OPENAI_LIMITER_MAX_WAIT seconds for budget before going ahead anyway.
+OPENAI_LIMITER_ENABLED = (os.getenv('OPENAI_LIMITER_ENABLED') or 'true').lower() == 'true'
+OPENAI_RATE_LIMITS = json.loads(os.getenv('OPENAI_RATE_LIMITS') or 'null') or {
+    'gpt-4.1': {'rpm': 5000, 'tpm': 800000},
+    'gpt-4.1-mini': {'rpm': 5000, 'tpm': 4000000},
+    'gpt-4o-mini': {'rpm': 5000, 'tpm': 4000000}
+}
+OPENAI_LIMITER_MAX_WAIT = float(os.getenv('OPENAI_LIMITER_MAX_WAIT') or 120)
+
+# Geocoding concurrency. GEOCODE_CONCURRENCY is the number of locations geocoded at
+# once per task (1 = serial); the others cap in-flight calls per provider per worker.
+GEOCODE_CONCURRENCY = int(os.getenv('GEOCODE_CONCURRENCY') or 8)
+GEOCODE_PELIAS_CONCURRENCY = int(os.getenv('GEOCODE_PELIAS_CONCURRENCY') or 8)
+GEOCODE_GEOCODIO_CONCURRENCY = int(os.getenv('GEOCODE_GEOCODIO_CONCURRENCY') or 4)
+GEOCODE_LLM_CONCURRENCY = int(os.getenv('GEOCODE_LLM_CONCURRENCY') or 8)
+
+# Geocoding cache. Empty results are cached too, but for a shorter time.
+GEOCODE_CACHE_ENABLED = (os.getenv('GEOCODE_CACHE_ENABLED') or 'true').lower() == 'true'
+GEOCODE_CACHE_TTL = int(os.getenv('GEOCODE_CACHE_TTL') or 60 * 60 * 24 * 30)
+GEOCODE_CACHE_NEGATIVE_TTL = int(os.getenv('GEOCODE_CACHE_NEGATIVE_TTL') or 60 * 60 * 24)
+GEOCODE_CACHE_MAX_ENTRIES = int(os.getenv('GEOCODE_CACHE_MAX_ENTRIES') or 200000)
+GEOCODE_CACHE_LOCAL_SIZE = int(os.getenv('GEOCODE_CACHE_LOCAL_SIZE') or 2048)
+
+# Local gazetteer for resolving city/state strings without an LLM call. Bare names are only
+# resolved from the full index built by manage.py build-gazetteer, and only if they are found in
+# one state; the seed file in the repo resolves "City, State" strings only.
+GAZETTEER_PATH = os.getenv('GAZETTEER_PATH') or os.path.join(os.path.dirname(__file__), '../utils/data/gazetteer.tsv')
+
+# Geocode candidate fast path. When one Pelias candidate clearly beats the rest on
+# confidence and label similarity it is accepted without an LLM check. Scores run 0-1;
+# similarity is a 0-100 fuzzy match between the query and the candidate label.
+GEOCODE_FAST_PATH_ENABLED = (os.getenv('GEOCODE_FAST_PATH_ENABLED') or 'true').lower() == 'true'
+GEOCODE_FAST_PATH_MIN_SCORE = float(os.getenv('GEOCODE_FAST_PATH_MIN_SCORE') or 0.85)
+GEOCODE_FAST_PATH_MIN_SIMILARITY = float(os.getenv('GEOCODE_FAST_PATH_MIN_SIMILARITY') or 90)
+GEOCODE_FAST_PATH_MARGIN = float(os.getenv('GEOCODE_FAST_PATH_MARGIN') or 0.15)
+
+# Geocode validation. In batch mode an article's geocoded locations are validated in as few
+# LLM requests as the item and (estimated) token budgets allow.
+GEOCODE_VALIDATION_BATCH = (os.getenv('GEOCODE_VALIDATION_BATCH') or 'true').lower() == 'true'
+GEOCODE_VALIDATION_BATCH_SIZE = int(os.getenv('GEOCODE_VALIDATION_BATCH_SIZE') or 40)
+GEOCODE_VALIDATION_BATCH_TOKENS = int(os.getenv('GEOCODE_VALIDATION_BATCH_TOKENS') or 8000)
+
+# Outbound HTTP defaults, per worker process. Upstream-specific policies live in utils/sessions.py.
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT') or 5)
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT') or 30)
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE') or 16)
 
 # Slack credentials, set by environment variables
 SLACK_LOG_WEBHOOK_URL = os.getenv('SLACK_LOG_WEBHOOK_URL') or ''
@@ -1,8 +1,18 @@
+import click
 from flask.cli import FlaskGroup
 from api import create_app
+from utils.gazetteer import build_gazetteer
 
 app = create_app()
 cli = FlaskGroup(create_app=create_app)
 
+@cli.command("build-gazetteer")
+@click.argument("places_path")
+@click.argument("counties_path")
+def build_gazetteer_command(places_path, counties_path):
+    """Rebuild the local gazetteer from the Census Gazetteer place and county files."""
+    rows = build_gazetteer(places_path, counties_path)
+    click.echo(f"Wrote {rows} gazetteer entries")
+
 if __name__ == "__main__":
     cli()
\ No newline at end of file
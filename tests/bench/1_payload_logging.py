@@ -0,0 +1,28 @@
+import json, logging, os, timeit
+from utils.logs import log_payload
+from tests.bench.payloads import make_payload
+
+# Measures the cost of logging a large payload the old way (json.dumps with
+# indent at INFO) against log_payload, with the level enabled, disabled and
+# sampled. Output goes to /dev/null so only serialization is measured.
+
+def bench(label, func, number=200):
+    seconds = timeit.timeit(func, number=number)
+    print(f"{label:<40} {seconds / number * 1000:8.3f} ms/call")
+
+if __name__ == "__main__":
+    logger = logging.getLogger()
+    logger.handlers = [logging.StreamHandler(open(os.devnull, 'w'))]
+    payload = make_payload()
+
+    print(f"Payload size: {len(json.dumps(payload)) / 1024:.0f} KB")
+
+    logger.setLevel(logging.INFO)
+    bench("json.dumps(indent=2) at INFO", lambda: logging.info("Payload: %s" % json.dumps(payload, indent=2)))
+    bench("log_payload, truncated", lambda: log_payload("Payload", payload, level=logging.INFO))
+    bench("log_payload, not truncated", lambda: log_payload("Payload", payload, level=logging.INFO, truncate=False))
+    bench("log_payload, 10% sampled", lambda: log_payload("Payload", payload, level=logging.INFO, sample_rate=0.1))
+
+    logger.setLevel(logging.WARNING)
+    bench("json.dumps(indent=2), INFO filtered", lambda: logging.info("Payload: %s" % json.dumps(payload, indent=2)))
+    bench("log_payload, INFO filtered", lambda: log_payload("Payload", payload, level=logging.INFO))
@@ -0,0 +1,31 @@
+import timeit
+from kombu.utils.json import dumps as json_dumps, loads as json_loads
+from worker.serializers import encode, decode
+from tests.bench.payloads import load_pipeline_payloads
+
+# Compares Celery's default json serializer with orjson_zstd on pipeline
+# payloads: encode and decode time, and bytes on the wire. The Redis transport
+# base64-encodes message bodies, so the stored size is shown too.
+
+def bench(func, number=200):
+    return timeit.timeit(func, number=number) / number * 1000
+
+if __name__ == "__main__":
+    print(f"{'payload':<28} {'format':<12} {'bytes':>9} {'redis bytes':>12} {'encode ms':>10} {'decode ms':>10}")
+
+    for name, payload in load_pipeline_payloads().items():
+        # Celery sends (args, kwargs, embed) as the message body
+        body = [[payload], {}, {"callbacks": None, "errbacks": None, "chain": None, "chord": None}]
+
+        json_body = json_dumps(body)
+        packed_body = encode(body)
+        assert decode(packed_body) == json_loads(json_body)
+
+        rows = [
+            ("json", len(json_body.encode()), len(json_body.encode()) * 4 // 3,
+             bench(lambda: json_dumps(body)), bench(lambda: json_loads(json_body))),
+            ("orjson_zstd", len(packed_body), len(packed_body) * 4 // 3,
+             bench(lambda: encode(body)), bench(lambda: decode(packed_body)))
+        ]
+        for fmt, size, wire_size, encode_ms, decode_ms in rows:
+            print(f"{name:<28} {fmt:<12} {size:>9} {wire_size:>12} {encode_ms:>10.3f} {decode_ms:>10.3f}")
@@ -0,0 +1,51 @@
+import statistics, sys, time
+from worker.workflows import submit_locations
+from celery.result import AsyncResult
+
+# Compares end-to-end latency of the chained and fused pipeline modes against a
+# running stack (API not needed, but Redis and a worker are). Each URL is run in
+# both modes, alternating which goes first. Run the workers with
+# LLM_CACHE_ENABLED=false and GEOCODE_CACHE_ENABLED=false, or the second run of
+# each URL is mostly cache hits.
+#
+#   python tests/bench/3_pipeline_modes.py [url ...]
+
+URLS = [
+    "https://www.startribune.com/minneapolis-city-council-approves-2024-budget/600326036",
+    "https://www.startribune.com/st-paul-police-shooting-investigation/600330981",
+    "https://www.startribune.com/duluth-lift-bridge-repairs/600328874"
+]
+
+def run(url, mode, timeout=600):
+    """
+    Submits a URL and waits for the workflow to finish.
+
+    Returns:
+        tuple: Wall time in ms, and the queue wait between stages in ms (if the
+        saved payload came back with its timings)
+    """
+    started_at = time.time()
+    submitted = submit_locations(url, mode)
+    payload = AsyncResult(submitted['task_id']).get(timeout=timeout, propagate=False)
+    wall_ms = (time.time() - started_at) * 1000
+
+    stages = ((payload or {}).get('_timings') or {}).get('stages', []) if isinstance(payload, dict) else []
+    queue_ms = sum(s['queue_wait_ms'] or 0 for s in stages) if stages else None
+    return wall_ms, queue_ms
+
+if __name__ == "__main__":
+    urls = sys.argv[1:] or URLS
+    results = {'chained': [], 'fused': []}
+
+    for i, url in enumerate(urls):
+        modes = ('chained', 'fused') if i % 2 == 0 else ('fused', 'chained')
+        for mode in modes:
+            wall_ms, queue_ms = run(url, mode)
+            results[mode].append(wall_ms)
+            queue = f"{queue_ms:10.0f}" if queue_ms is not None else f"{'-':>10}"
+            print(f"{mode:<8} {wall_ms:10.0f} ms  queue wait {queue} ms  {url}")
+
+    print()
+    print(f"{'mode':<8} {'runs':>5} {'median ms':>10} {'mean ms':>10} {'max ms':>10}")
+    for mode, times in results.items():
+        print(f"{mode:<8} {len(times):>5} {statistics.median(times):10.0f} {statistics.mean(times):10.0f} {max(times):10.0f}")
@@ -0,0 +1,50 @@
+import glob, json, os
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '../data')
+
+def make_payload(words=5000, locations=60):
+    """
+    Builds a payload shaped like a long article late in the pipeline.
+    """
+    return {
+        "url": "https://www.startribune.com/example/601331870",
+        "output_filename": "bench.json",
+        "headline": "Example headline",
+        "text": " ".join(["Minneapolis"] * words),
+        "locations": [
+            {
+                "location": f"{i} Hennepin Ave, Minneapolis, MN",
+                "original_text": "Lorem ipsum dolor sit amet " * 20,
+                "type": "address",
+                "geocode": {
+                    "geocode": "search",
+                    "text": f"{i} Hennepin Ave, Minneapolis, MN",
+                    "results": {
+                        "label": f"{i} Hennepin Ave, Minneapolis, MN, USA",
+                        "geometry": {"type": "Point", "coordinates": [-93.27, 44.98]},
+                        "boundaries": {k: {"id": f"whosonfirst:{k}:1", "name": k} for k in ("neighborhood", "city", "county", "state")}
+                    }
+                }
+            }
+            for i in range(locations)
+        ]
+    }
+
+def load_pipeline_payloads():
+    """
+    Returns real payloads saved by the stage scripts (tests/data/*-output.json)
+    keyed by file, falling back to synthetic ones if none have been saved yet.
+    """
+    payloads = {}
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, '*-output.json'))):
+        with open(path) as f:
+            articles = json.load(f)
+        if articles:
+            payloads[os.path.basename(path)] = articles[0]
+
+    if not payloads:
+        payloads = {
+            "synthetic (short)": make_payload(words=800, locations=5),
+            "synthetic (long)": make_payload(words=10000, locations=60)
+        }
+    return payloads
@@ -0,0 +1,103 @@
+import logging
+import redis
+from utils.cache import get_redis_client, queue_length, sha256
+from conf.settings import (
+    ADMISSION_ENABLED, RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST, BACKLOG_MAX, BACKFILL_BACKLOG_MAX,
+    BACKLOG_RETRY_AFTER, CELERY_QUEUES
+)
+
+# Refills a token bucket for the time since it was last used and takes the
+# requested tokens if there are enough. Returns "0" if they were taken, or else
+# the seconds until there will be enough (as a string, since Redis would
+# truncate a Lua number).
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+########## HELPER FUNCTIONS ##########
+
+def _bucket_key(client_id):
+    return f"agate:ratelimit:{client_id}"
+
+def client_id(api_key=None, address=None):
+    """
+    Identifies the client a request is rate limited as: its API key if it sent
+    one (hashed, so keys don't end up in Redis), otherwise its IP address.
+    """
+    if api_key:
+        return f"key:{sha256(api_key)[:16]}"
+    return f"ip:{address or 'unknown'}"
+
+########## ADMISSION ##########
+
+def take_token(client, cost=1):
+    """
+    Takes tokens from a client's bucket, which holds up to RATE_LIMIT_BURST
+    tokens and refills at RATE_LIMIT_PER_MINUTE.
+
+    Redis errors are logged and the request let through, so the API keeps
+    working (without rate limits) if Redis is unavailable.
+
+    Returns:
+        float: 0 if the tokens were taken, otherwise seconds until they can be
+    """
+    if not ADMISSION_ENABLED or RATE_LIMIT_PER_MINUTE <= 0:
+        return 0
+    try:
+        wait = get_redis_client().eval(
+            TOKEN_BUCKET_SCRIPT, 1, _bucket_key(client), RATE_LIMIT_PER_MINUTE / 60, RATE_LIMIT_BURST, cost
+        )
+        return float(wait)
+    except redis.RedisError as e:
+        logging.warning(f"Could not check rate limit for {client}: {str(e)}")
+        return 0
+
+def get_backlog():
+    """
+    Returns the number of task messages waiting across the pipeline's queues.
+    """
+    return sum(queue_length(queue) for queue in CELERY_QUEUES)
+
+def check_backlog(priority, count=1):
+    """
+    Checks whether the pipeline can take count more articles of a priority,
+    each of which adds a message to the backlog. Backfill is turned away at
+    BACKFILL_BACKLOG_MAX, so there is always room left under BACKLOG_MAX for
+    newsroom requests.
+
+    Returns:
+        float: 0 if the work can be submitted, otherwise seconds to wait
+    """
+    if not ADMISSION_ENABLED:
+        return 0
+    limit = BACKFILL_BACKLOG_MAX if priority == 'backfill' else BACKLOG_MAX
+    if limit <= 0:
+        return 0
+    try:
+        backlog = get_backlog()
+    except redis.RedisError as e:
+        logging.warning(f"Could not read the backlog: {str(e)}")
+        return 0
+    if backlog + count > limit:
+        logging.warning(f"BACKLOG FULL: {backlog} messages waiting, turning away {count} {priority} articles")
+        return BACKLOG_RETRY_AFTER
+    return 0
@@ -0,0 +1,257 @@
+import hashlib, json, logging, os, threading, time
+from collections import Counter, OrderedDict
+import redis
+from conf.settings import CACHE_REDIS_URL, CELERY_BROKER_URL
+
+########## CONNECTION ##########
+
+_redis_clients = {}
+_broker_clients = {}
+
+# Kombu's Redis transport keeps each queue's messages in one list per priority
+# step, named "<queue>\x06\x16<step>" for all but the first
+PRIORITY_STEPS = [0, 3, 6, 9]
+PRIORITY_SEP = '\x06\x16'
+
+def get_redis_client():
+    """
+    Returns a Redis client for caches and other shared worker state.
+
+    Celery forks its worker processes after importing the task modules, so the
+    client is created lazily and keyed on the process ID rather than created at
+    import time and shared (unsafely) across forks.
+    """
+    pid = os.getpid()
+    client = _redis_clients.get(pid)
+    if client is None:
+        client = redis.from_url(
+            CACHE_REDIS_URL,
+            socket_timeout=2,
+            socket_connect_timeout=2
+        )
+        _redis_clients.clear()
+        _redis_clients[pid] = client
+    return client
+
+def get_broker_client():
+    """
+    Returns a Redis client for the Celery broker, which may be a different
+    instance than the one holding caches and metrics.
+    """
+    url = CELERY_BROKER_URL or CACHE_REDIS_URL
+    if url == CACHE_REDIS_URL:
+        return get_redis_client()
+    pid = os.getpid()
+    client = _broker_clients.get((pid, url))
+    if client is None:
+        client = redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+        _broker_clients[(pid, url)] = client
+    return client
+
+def queue_length(queue):
+    """
+    Returns the number of messages waiting in a Celery queue, across all of
+    its priority steps.
+    """
+    pipe = get_broker_client().pipeline(transaction=False)
+    for step in PRIORITY_STEPS:
+        pipe.llen(f"{queue}{PRIORITY_SEP}{step}" if step else queue)
+    return sum(pipe.execute())
+
+########## HELPER FUNCTIONS ##########
+
+def sha256(value):
+    """
+    Returns the hex sha256 digest of a string.
+    """
+    return hashlib.sha256(value.encode()).hexdigest()
+
+def make_key(*parts):
+    """
+    Builds a stable, content-addressed cache key from any JSON-serializable parts.
+    """
+    return sha256(json.dumps(parts, sort_keys=True, default=str))
+
+########## CACHE ##########
+
+# Drops cache entries whose keys have expired from the LRU index (KEYS[1]) and
+# the expiry index (KEYS[2]), up to ARGV[2] of them per call, given the time
+# now (ARGV[1])
+TRIM_EXPIRED_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], 0, ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #expired > 0 then
+    redis.call('ZREM', KEYS[1], unpack(expired))
+    redis.call('ZREM', KEYS[2], unpack(expired))
+end
+return #expired
+"""
+
+class RedisCache(object):
+    """
+    Key/value cache backed by Redis, with a per-entry TTL, LRU eviction down to a
+    maximum number of entries and hit/miss counters. It can optionally be fronted
+    by a small in-process LRU so hot keys don't leave the worker at all.
+
+    Values are strings (callers serialize their own data). Any Redis failure is
+    logged and treated as a miss, so the cache can never take down the pipeline.
+    """
+
+    def __init__(self, namespace, ttl, max_entries=None, local_size=0, enabled=True):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.local_size = local_size
+        self.enabled = enabled
+
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters that haven't been written to Redis yet. They ride along with
+        # the next Redis round trip instead of costing one of their own.
+        self._pending = Counter()
+
+    def _key(self, key):
+        return f"agate:cache:{self.namespace}:{key}"
+
+    @property
+    def _lru_key(self):
+        return f"agate:cache:{self.namespace}:_lru"
+
+    @property
+    def _expiry_key(self):
+        return f"agate:cache:{self.namespace}:_expiry"
+
+    @property
+    def _stats_key(self):
+        return f"agate:cache:{self.namespace}:_stats"
+
+    def _count(self, field):
+        with self._lock:
+            self._pending[field] += 1
+
+    def _flush_stats(self, pipe):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        for field, amount in pending.items():
+            pipe.hincrby(self._stats_key, field, amount)
+
+    def _get_local(self, key):
+        if not self.local_size:
+            return None
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return value
+
+    def _set_local(self, key, value, ttl):
+        if not self.local_size:
+            return
+        with self._lock:
+            self._local[key] = (value, time.time() + ttl)
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def get(self, key):
+        """
+        Returns the cached string for a key, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+
+        value = self._get_local(key)
+        if value is not None:
+            self._count('hits')
+            return value
+
+        try:
+            client = get_redis_client()
+            value = client.get(self._key(key))
+
+            # Record the access for LRU eviction along with any pending counters
+            pipe = client.pipeline(transaction=False)
+            if value is not None:
+                pipe.zadd(self._lru_key, {key: time.time()})
+                pipe.hincrby(self._stats_key, 'hits', 1)
+            else:
+                pipe.hincrby(self._stats_key, 'misses', 1)
+            self._flush_stats(pipe)
+            pipe.execute()
+        except redis.RedisError as e:
+            logging.warning(f"Cache {self.namespace} unavailable, treating as miss: {str(e)}")
+            self._count('misses')
+            return None
+
+        if value is None:
+            return None
+
+        value = value.decode()
+        self._set_local(key, value, self.ttl)
+        return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores a string under a key, evicting the least recently used entries if
+        the cache has grown past max_entries.
+        """
+        if not self.enabled:
+            return
+
+        ttl = ttl or self.ttl
+        self._set_local(key, value, ttl)
+
+        try:
+            client = get_redis_client()
+            now = time.time()
+
+            pipe = client.pipeline(transaction=False)
+            pipe.setex(self._key(key), ttl, value)
+            pipe.zadd(self._lru_key, {key: now})
+            pipe.zadd(self._expiry_key, {key: now + ttl})
+            # Forget entries whose keys have expired, whatever TTL they were written with
+            pipe.eval(TRIM_EXPIRED_SCRIPT, 2, self._lru_key, self._expiry_key, now, 1000)
+            pipe.zcard(self._lru_key)
+            self._flush_stats(pipe)
+            size = pipe.execute()[4]
+
+            if self.max_entries and size > self.max_entries:
+                evicted = client.zpopmin(self._lru_key, size - self.max_entries)
+                if evicted:
+                    keys = [k.decode() for k, _ in evicted]
+                    pipe = client.pipeline(transaction=False)
+                    pipe.delete(*[self._key(k) for k in keys])
+                    pipe.zrem(self._expiry_key, *keys)
+                    pipe.hincrby(self._stats_key, 'evictions', len(evicted))
+                    pipe.execute()
+        except redis.RedisError as e:
+            logging.warning(f"Cache {self.namespace} unavailable, skipping write: {str(e)}")
+
+    def stats(self):
+        """
+        Returns fleet-wide hit/miss/eviction counts and the hit ratio for this cache.
+        """
+        try:
+            client = get_redis_client()
+            pipe = client.pipeline(transaction=False)
+            self._flush_stats(pipe)
+            pipe.hgetall(self._stats_key)
+            raw = pipe.execute()[-1]
+            stats = {k.decode(): int(v) for k, v in raw.items()}
+        except redis.RedisError as e:
+            logging.warning(f"Cache {self.namespace} unavailable, returning local stats: {str(e)}")
+            with self._lock:
+                stats = dict(self._pending)
+
+        hits, misses = stats.get('hits', 0), stats.get('misses', 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "evictions": stats.get('evictions', 0),
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None
+        }
@@ -0,0 +1,172 @@
+import functools, glob, hashlib, inspect, json, logging, os
+import redis
+from utils.cache import get_redis_client
+from utils.payload_store import STORED_FIELDS, get_field
+from conf.settings import CHECKPOINTS_ENABLED, CHECKPOINT_TTL, CHECKPOINT_VERSION
+
+########## STAGES ##########
+
+# Stages up to the filter step. Classification and extraction run in parallel
+# from the scrape, so neither depends on the other.
+_BRANCH_DEPENDENCIES = {
+    'scrape': [],
+    'classify': ['scrape'],
+    'extract': ['scrape'],
+    'extract_review': ['scrape', 'extract']
+}
+
+# Stages from the filter step on, each depending on everything before it
+_LINEAR_STAGES = [
+    'classify_locations', 'consolidate_locations', 'prep', 'geocode', 'validate',
+    'consolidate_geocodes', 'localize', 'review', 'finalize'
+]
+
+def _build_dependencies():
+    dependencies = dict(_BRANCH_DEPENDENCIES)
+    upstream = list(_BRANCH_DEPENDENCIES)
+    for stage in _LINEAR_STAGES:
+        dependencies[stage] = list(upstream)
+        upstream.append(stage)
+    return dependencies
+
+# Stages whose output each checkpointed stage's output depends on
+STAGE_DEPENDENCIES = _build_dependencies()
+
+# Source file of each stage's function, registered by checkpoint_stage
+_stage_files = {}
+
+########## VERSIONS ##########
+
+@functools.lru_cache(maxsize=None)
+def _stage_version(stage):
+    """
+    Hashes a stage's code and prompts: the source of the module it is defined
+    in and every file in the prompts directory next to that module.
+
+    Returns:
+        str: Hex digest, or None if the stage isn't loaded in this process
+    """
+    path = _stage_files.get(stage)
+    if not path:
+        return None
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        digest.update(f.read())
+
+    prompts_dir = os.path.join(os.path.dirname(path), 'prompts')
+    for prompt_path in sorted(glob.glob(os.path.join(prompts_dir, '**', '*'), recursive=True)):
+        if os.path.isfile(prompt_path):
+            digest.update(os.path.relpath(prompt_path, prompts_dir).encode())
+            with open(prompt_path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+def checkpoint_version(stage):
+    """
+    Version of a stage's checkpoints. It changes whenever the code or prompts of
+    the stage, or of any stage upstream of it, change.
+
+    Returns:
+        str: Short hex digest, or None if some stage's version isn't known
+    """
+    versions = [_stage_version(s) for s in STAGE_DEPENDENCIES[stage] + [stage]]
+    if None in versions:
+        return None
+    return hashlib.sha256(f"{CHECKPOINT_VERSION}:{':'.join(versions)}".encode()).hexdigest()[:16]
+
+def _key(output_filename, stage):
+    version = checkpoint_version(stage)
+    if not output_filename or not version:
+        return None
+    # The output filename is the article's URL hash
+    article = output_filename.rsplit('.', 1)[0]
+    return f"agate:checkpoint:{article}:{stage}:{version}"
+
+########## CHECKPOINTS ##########
+
+def completed_stages(payload):
+    """
+    Returns the stages that completed successfully on the way to a payload,
+    including those done before it was resumed from a checkpoint.
+    """
+    timings = payload.get('_timings') or {}
+    return {s['stage'] for s in timings.get('stages', [])} | set(timings.get('resumed', []))
+
+def save_checkpoint(stage, payload):
+    """
+    Checkpoints a stage's output. Outputs that went through a stage that gave
+    up (so it carries on with e.g. locations set to None) are not checkpointed,
+    so a resume always starts from the last good one.
+    """
+    if not CHECKPOINTS_ENABLED or stage not in STAGE_DEPENDENCIES or not isinstance(payload, dict):
+        return
+
+    missing = set(STAGE_DEPENDENCIES[stage]) - completed_stages(payload)
+    if missing:
+        logging.info(f"Not checkpointing {stage}, upstream stages didn't complete: {', '.join(sorted(missing))}")
+        return
+
+    key = _key(payload.get('output_filename'), stage)
+    if not key:
+        return
+    try:
+        get_redis_client().set(key, json.dumps(payload, default=str), ex=CHECKPOINT_TTL)
+    except redis.RedisError as e:
+        logging.warning(f"Could not save {stage} checkpoint: {str(e)}")
+
+def load_checkpoint(output_filename, stage):
+    """
+    Loads a stage's checkpointed output for an article, if there is one for the
+    current version of the stage and the stored fields it references are still
+    in the payload store.
+
+    Returns:
+        dict: The stage's output, or None
+    """
+    key = _key(output_filename, stage)
+    if not CHECKPOINTS_ENABLED or not key:
+        return None
+    try:
+        value = get_redis_client().get(key)
+    except redis.RedisError as e:
+        logging.warning(f"Could not load {stage} checkpoint: {str(e)}")
+        return None
+    if value is None:
+        return None
+
+    payload = json.loads(value)
+    try:
+        for field in STORED_FIELDS:
+            get_field(payload, field)
+    except KeyError:
+        logging.info(f"Ignoring {stage} checkpoint for {output_filename}, its stored fields have expired")
+        return None
+    return payload
+
+def restart_timings(payload):
+    """
+    Starts a fresh _timings block for a payload resumed from a checkpoint, so
+    the time spent waiting for the resume doesn't count as queue wait. The
+    stages it already went through are kept for later checkpoints.
+    """
+    payload['_timings'] = {"stages": [], "resumed": sorted(completed_stages(payload))}
+    return payload
+
+########## DECORATOR ##########
+
+def checkpoint_stage(name):
+    """
+    Decorator that checkpoints a pipeline stage's output whenever it succeeds.
+    The stage's version is taken from the module its function is defined in.
+    """
+    def decorator(func):
+        _stage_files[name] = inspect.getsourcefile(inspect.unwrap(func))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            result = func(*args, **kwargs)
+            save_checkpoint(name, result)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,325 @@
+import csv, functools, gzip, io, logging, os, re, zipfile
+from conf.settings import GAZETTEER_PATH
+
+########## STATES ##########
+
+# State name to abbreviation mapping
+STATE_ABBREVS = {
+    'alabama': 'AL',
+    'alaska': 'AK',
+    'arizona': 'AZ',
+    'arkansas': 'AR',
+    'california': 'CA',
+    'colorado': 'CO',
+    'connecticut': 'CT',
+    'delaware': 'DE',
+    'florida': 'FL',
+    'georgia': 'GA',
+    'hawaii': 'HI',
+    'idaho': 'ID',
+    'illinois': 'IL',
+    'indiana': 'IN',
+    'iowa': 'IA',
+    'kansas': 'KS',
+    'kentucky': 'KY',
+    'louisiana': 'LA',
+    'maine': 'ME',
+    'maryland': 'MD',
+    'massachusetts': 'MA',
+    'michigan': 'MI',
+    'minnesota': 'MN',
+    'mississippi': 'MS',
+    'missouri': 'MO',
+    'montana': 'MT',
+    'nebraska': 'NE',
+    'nevada': 'NV',
+    'new hampshire': 'NH',
+    'new jersey': 'NJ',
+    'new mexico': 'NM',
+    'new york': 'NY',
+    'north carolina': 'NC',
+    'north dakota': 'ND',
+    'ohio': 'OH',
+    'oklahoma': 'OK',
+    'oregon': 'OR',
+    'pennsylvania': 'PA',
+    'rhode island': 'RI',
+    'south carolina': 'SC',
+    'south dakota': 'SD',
+    'tennessee': 'TN',
+    'texas': 'TX',
+    'utah': 'UT',
+    'vermont': 'VT',
+    'virginia': 'VA',
+    'washington': 'WA',
+    'west virginia': 'WV',
+    'wisconsin': 'WI',
+    'wyoming': 'WY',
+    'district of columbia': 'DC'
+}
+
+# AP style state abbreviations (and common variants), without periods or spaces
+AP_STATE_ABBREVS = {
+    'ala': 'AL',
+    'ariz': 'AZ',
+    'ark': 'AR',
+    'calif': 'CA',
+    'cal': 'CA',
+    'colo': 'CO',
+    'conn': 'CT',
+    'del': 'DE',
+    'fla': 'FL',
+    'ga': 'GA',
+    'ill': 'IL',
+    'ind': 'IN',
+    'kan': 'KS',
+    'kans': 'KS',
+    'ky': 'KY',
+    'la': 'LA',
+    'md': 'MD',
+    'mass': 'MA',
+    'mich': 'MI',
+    'minn': 'MN',
+    'miss': 'MS',
+    'mo': 'MO',
+    'mont': 'MT',
+    'neb': 'NE',
+    'nebr': 'NE',
+    'nev': 'NV',
+    'nh': 'NH',
+    'nj': 'NJ',
+    'nm': 'NM',
+    'ny': 'NY',
+    'nc': 'NC',
+    'nd': 'ND',
+    'okla': 'OK',
+    'ore': 'OR',
+    'pa': 'PA',
+    'penn': 'PA',
+    'ri': 'RI',
+    'sc': 'SC',
+    'sd': 'SD',
+    'tenn': 'TN',
+    'tex': 'TX',
+    'vt': 'VT',
+    'va': 'VA',
+    'wash': 'WA',
+    'wva': 'WV',
+    'wis': 'WI',
+    'wisc': 'WI',
+    'wyo': 'WY',
+    'dc': 'DC'
+}
+
+POSTAL_ABBREVS = set(STATE_ABBREVS.values())
+
+########## HELPER FUNCTIONS ##########
+
+# Last words that mark a street or intersection rather than a place name
+STREET_WORDS = {
+    'street', 'st', 'avenue', 'ave', 'road', 'rd', 'boulevard', 'blvd', 'drive', 'dr',
+    'lane', 'ln', 'parkway', 'pkwy', 'highway', 'hwy', 'way', 'court', 'ct', 'place',
+    'pl', 'trail', 'circle', 'terrace', 'freeway', 'expressway', 'interstate'
+}
+
+def _normalize_name(name):
+    """
+    Normalizes a place name for lookup: case, punctuation and the usual
+    Saint/Fort/Mount abbreviations.
+    """
+    name = name.lower().replace('.', ' ').replace('-', ' ')
+    name = ' '.join(name.split())
+    name = re.sub(r'^saint ', 'st ', name)
+    name = re.sub(r'^ft ', 'fort ', name)
+    name = re.sub(r'^mt ', 'mount ', name)
+    return name
+
+def parse_state(text):
+    """
+    Resolves a state written as a full name, postal code or AP abbreviation
+    (optionally followed by a ZIP code) to its postal code.
+
+    Returns:
+        str: Two-letter state abbreviation, or None if not recognized
+    """
+    text = re.sub(r'\s+\d{5}(-\d{4})?$', '', text.strip())
+    name = ' '.join(text.lower().replace('.', ' ').split())
+    if name in STATE_ABBREVS:
+        return STATE_ABBREVS[name]
+
+    abbrev = name.replace(' ', '')
+    if abbrev.upper() in POSTAL_ABBREVS:
+        return abbrev.upper()
+    return AP_STATE_ABBREVS.get(abbrev)
+
+def _is_county(name):
+    return bool(re.search(r'\b(county|parish)$', name.lower().strip(' .')))
+
+def _looks_like_place(name):
+    """
+    Whether an unrecognized string could plausibly be a city name, as opposed to
+    an address or intersection.
+    """
+    if re.search(r'\d|&|@|/', name):
+        return False
+    words = _normalize_name(name).split()
+    if not words or len(words) > 4 or 'and' in words or 'at' in words:
+        return False
+    return words[-1] not in STREET_WORDS
+
+def _only_state(states):
+    """
+    Returns the state of a bare name found in only one, or None for a name
+    found in several ("Springfield", "Paris"), which can't be resolved locally.
+    """
+    return next(iter(states)) if len(states) == 1 else None
+
+########## INDEX ##########
+
+# First line of a gazetteer built by build_gazetteer, which marks it as the
+# full Census index rather than the seed file
+BUILT_HEADER = '# name\tstate\tkind (built from the Census Gazetteer files)\n'
+
+@functools.lru_cache(maxsize=None)
+def _load_index(path=GAZETTEER_PATH):
+    """
+    Loads the gazetteer into memory once per process.
+
+    The file is a (optionally gzipped) TSV of name, state and kind ("city" or
+    "county") rows. Lines starting with # are comments.
+
+    Returns:
+        dict: {"city": {normalized name: {state: name}}, "county": {...},
+        "complete": whether it was built from the full Census files}
+    """
+    index = {'city': {}, 'county': {}, 'complete': False}
+    opener = gzip.open if path.endswith('.gz') else open
+
+    try:
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line == BUILT_HEADER:
+                    index['complete'] = True
+                if not line.strip() or line.startswith('#'):
+                    continue
+                name, state, kind = line.rstrip('\n').split('\t')
+                index[kind].setdefault(_normalize_name(name), {})[state] = name
+    except FileNotFoundError:
+        logging.warning(f"Gazetteer not found at {path}, place lookups will fall back to the LLM")
+
+    logging.info(f"Loaded gazetteer with {len(index['city'])} places and {len(index['county'])} counties")
+    return index
+
+def lookup_city_state(location_str):
+    """
+    Resolves a location string to a city and state using the local gazetteer.
+    Handles "City, State" strings with any state spelling, addresses ending in a
+    city and state, and bare place or county names found in only one state.
+    Bare names are only resolved from the full index, since the seed file
+    can't tell whether a name is found in other states too.
+
+    Args:
+        location_str (str): Location string to parse
+
+    Returns:
+        dict: Dictionary containing city and state, or None if the string can't
+        be resolved locally. Example: {"city": "Duluth", "state": "MN"}
+    """
+    if not location_str:
+        return None
+
+    index = _load_index()
+    parts = [p.strip() for p in location_str.split(',') if p.strip()]
+    if parts and parts[-1].lower().strip('.') in ('usa', 'us', 'u s a', 'united states'):
+        parts = parts[:-1]
+    if not parts:
+        return None
+
+    # "..., City, State"
+    state = parse_state(parts[-1]) if len(parts) > 1 else None
+    if state:
+        name = parts[-2]
+        if _is_county(name):
+            return {"city": None, "state": state}
+
+        known = index['city'].get(_normalize_name(name), {})
+        if state in known:
+            return {"city": known[state], "state": state}
+        if _looks_like_place(name):
+            return {"city": name, "state": state}
+        return None
+
+    # A bare place or county name
+    name = parts[-1]
+    cities = index['city'].get(_normalize_name(name))
+    counties = index['county'].get(_normalize_name(name))
+    if (cities or counties) and not index['complete']:
+        return None
+
+    if cities:
+        state = _only_state(cities)
+        return {"city": cities[state], "state": state} if state else None
+
+    if counties:
+        state = _only_state(counties)
+        return {"city": None, "state": state} if state else None
+
+    if len(parts) == 1:
+        state = parse_state(name)
+        if state:
+            return {"city": None, "state": state}
+
+    return None
+
+########## BUILD ##########
+
+# Legal/statistical area descriptions the Census appends to place names
+PLACE_SUFFIXES = re.compile(
+    r'\s+(city and borough|city|town|village|borough|CDP|municipality|'
+    r'(consolidated|metropolitan|metro|unified) government \(balance\)|'
+    r'\(balance\)|urban county|corporation)$'
+)
+
+def _read_census_file(path):
+    """
+    Reads a Census Gazetteer file (the .txt, or the .zip it is distributed in).
+    """
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as z:
+            text = z.read(z.namelist()[0]).decode('latin-1')
+    else:
+        with open(path, encoding='latin-1') as f:
+            text = f.read()
+
+    reader = csv.DictReader(io.StringIO(text), delimiter='\t')
+    reader.fieldnames = [n.strip() for n in reader.fieldnames]
+    return list(reader)
+
+def build_gazetteer(places_path, counties_path, output_path=GAZETTEER_PATH):
+    """
+    Builds the gazetteer from the Census Gazetteer place and county files, e.g.
+    https://www2.census.gov/geo/docs/maps-data/data/gazetteer/2023_Gazetteer/2023_Gaz_place_national.zip
+    https://www2.census.gov/geo/docs/maps-data/data/gazetteer/2023_Gazetteer/2023_Gaz_counties_national.zip
+
+    Returns:
+        int: Number of rows written
+    """
+    rows = set()
+    for row in _read_census_file(places_path):
+        name = PLACE_SUFFIXES.sub('', row['NAME'].strip())
+        # Consolidated cities, e.g. "Nashville-Davidson metropolitan government (balance)"
+        if '(balance)' in row['NAME']:
+            name = re.split(r'[/-]', name)[0]
+        rows.add((name, row['USPS'].strip(), 'city'))
+    for row in _read_census_file(counties_path):
+        rows.add((row['NAME'].strip(), row['USPS'].strip(), 'county'))
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    opener = gzip.open if output_path.endswith('.gz') else open
+    with opener(output_path, 'wt', encoding='utf-8') as f:
+        f.write(BUILT_HEADER)
+        for name, state, kind in sorted(rows, key=lambda r: (r[2], r[1], r[0])):
+            f.write(f"{name}\t{state}\t{kind}\n")
+
+    _load_index.cache_clear()
+    return len(rows)
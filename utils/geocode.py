@@ -1,66 +1,31 @@
-import requests, logging, json
+import requests, logging, json, threading, time
 from geocodio import GeocodioClient
-from langchain_openai import ChatOpenAI
+from utils.llm import get_chat_model
+from utils.cache import RedisCache, make_key
+from utils.gazetteer import STATE_ABBREVS, lookup_city_state
+from utils.metrics import incr, record_external_call
+from utils import sessions
 from langchain.prompts import ChatPromptTemplate
-from conf.settings import GEOCODE_EARTH_API_KEY, GEOCODIO_API_KEY
+from conf.settings import GEOCODE_EARTH_API_KEY, GEOCODIO_API_KEY, GEOCODE_PELIAS_CONCURRENCY, GEOCODE_GEOCODIO_CONCURRENCY, \
+    GEOCODE_CACHE_ENABLED, GEOCODE_CACHE_TTL, GEOCODE_CACHE_NEGATIVE_TTL, GEOCODE_CACHE_MAX_ENTRIES, GEOCODE_CACHE_LOCAL_SIZE
 
 ########## INITIALIZATION ##########
 
-# State name to abbreviation mapping
-STATE_ABBREVS = {
-    'alabama': 'AL',
-    'alaska': 'AK',
-    'arizona': 'AZ',
-    'arkansas': 'AR',
-    'california': 'CA',
-    'colorado': 'CO',
-    'connecticut': 'CT',
-    'delaware': 'DE',
-    'florida': 'FL',
-    'georgia': 'GA',
-    'hawaii': 'HI',
-    'idaho': 'ID',
-    'illinois': 'IL',
-    'indiana': 'IN',
-    'iowa': 'IA',
-    'kansas': 'KS',
-    'kentucky': 'KY',
-    'louisiana': 'LA',
-    'maine': 'ME',
-    'maryland': 'MD',
-    'massachusetts': 'MA',
-    'michigan': 'MI',
-    'minnesota': 'MN',
-    'mississippi': 'MS',
-    'missouri': 'MO',
-    'montana': 'MT',
-    'nebraska': 'NE',
-    'nevada': 'NV',
-    'new hampshire': 'NH',
-    'new jersey': 'NJ',
-    'new mexico': 'NM',
-    'new york': 'NY',
-    'north carolina': 'NC',
-    'north dakota': 'ND',
-    'ohio': 'OH',
-    'oklahoma': 'OK',
-    'oregon': 'OR',
-    'pennsylvania': 'PA',
-    'rhode island': 'RI',
-    'south carolina': 'SC',
-    'south dakota': 'SD',
-    'tennessee': 'TN',
-    'texas': 'TX',
-    'utah': 'UT',
-    'vermont': 'VT',
-    'virginia': 'VA',
-    'washington': 'WA',
-    'west virginia': 'WV',
-    'wisconsin': 'WI',
-    'wyoming': 'WY',
-    'district of columbia': 'DC'
+# Per-provider caps on in-flight requests, shared by all threads in a worker
+PROVIDER_LIMITS = {
+    'pelias': threading.BoundedSemaphore(GEOCODE_PELIAS_CONCURRENCY),
+    'geocodio': threading.BoundedSemaphore(GEOCODE_GEOCODIO_CONCURRENCY)
 }
 
+# Geocoding results cache: a small in-process LRU in front of Redis
+GEOCODE_CACHE = RedisCache(
+    'geocode',
+    ttl=GEOCODE_CACHE_TTL,
+    max_entries=GEOCODE_CACHE_MAX_ENTRIES,
+    local_size=GEOCODE_CACHE_LOCAL_SIZE,
+    enabled=GEOCODE_CACHE_ENABLED
+)
+
 # Initialize Geocodio client
 geocodio_client = None
 if GEOCODIO_API_KEY:
@@ -74,7 +39,8 @@ if GEOCODIO_API_KEY:
 
 def get_city_state(location_str):
     """
-    Use LLM to extract city and state from a location string.
+    Extract city and state from a location string. Most strings are resolved from
+    the local gazetteer; the LLM is only used for those it can't resolve.
     
     Args:
         location_str (str): Location string to parse
@@ -83,7 +49,15 @@ def get_city_state(location_str):
         dict: Dictionary containing city and state, or None if extraction fails
         Example: {"city": "Minneapolis", "state": "MN"}
     """
-    llm = ChatOpenAI(model="gpt-4o-mini")
+    city_state = lookup_city_state(location_str)
+    if city_state:
+        incr("agate_gazetteer_lookups_total", result="hit")
+        return city_state
+
+    logging.info(f"Gazetteer could not resolve '{location_str}', asking LLM")
+    incr("agate_gazetteer_lookups_total", result="miss")
+
+    llm = get_chat_model("gpt-4o-mini")
     
     template = """Extract the city and state from the following location string.
     Return ONLY a JSON object with two fields:
@@ -113,8 +87,89 @@ def get_city_state(location_str):
         logging.error(f"Error extracting city/state from '{location_str}': {str(e)}")
         return None
 
+########## CACHING ##########
+
+def _normalize_query(text):
+    """
+    Normalizes free text so trivially different queries share a cache entry.
+    """
+    return ' '.join(str(text).lower().split())
+
+def _cached_geocode(provider, query, geocode, is_empty=lambda result: not result):
+    """
+    Returns the cached result for a provider and normalized query, or calls
+    geocode() and caches what it returns.
+
+    Empty results are cached for GEOCODE_CACHE_NEGATIVE_TTL so they can be retried
+    sooner. None means the call failed and is never cached.
+    """
+    key = make_key(provider, query)
+
+    cached = GEOCODE_CACHE.get(key)
+    if cached is not None:
+        return json.loads(cached)
+
+    result = geocode()
+    if result is not None:
+        ttl = GEOCODE_CACHE_NEGATIVE_TTL if is_empty(result) else GEOCODE_CACHE_TTL
+        GEOCODE_CACHE.set(key, json.dumps(result), ttl=ttl)
+    return result
+
+def get_geocode_cache_stats():
+    """
+    Returns hit/miss counts and hit ratio for the geocoding cache.
+    """
+    return GEOCODE_CACHE.stats()
+
 ########## GEOCODING FUNCTIONS ##########
 
+def _standardize_candidates(features):
+    """
+    Converts Pelias GeoJSON features into our standardized candidate format.
+    """
+    candidates = []
+    for f in features:
+        candidate = {
+            "id": f.get("properties").get("id"),
+            "label": f.get("properties").get("label"),
+            "geometry": f.get("geometry"),
+            "confidence": {
+                "score": f.get("properties").get("confidence"),
+                "match_type": f.get("properties").get("match_type"),
+                "accuracy": f.get("properties").get("accuracy")
+            },
+            "boundaries": {
+                "neighborhood": {
+                    "id": f.get("properties").get("neighbourhood_gid"),
+                    "name": f.get("properties").get("neighbourhood"),
+                },
+                "city": {
+                    "id": f.get("properties").get("locality_gid"),
+                    "name": f.get("properties").get("locality"),
+                },
+                "county": { 
+                    "id": f.get("properties").get("county_gid"),
+                    "name": f.get("properties").get("county"),
+                },
+                "state": {
+                    "id": f.get("properties").get("region_gid"),
+                    "name": f.get("properties").get("region"),
+                }
+            }
+        }
+        candidates.append(candidate)
+    return candidates
+
+def _pelias_get(query):
+    """
+    Calls the Pelias API and returns the decoded response, raising on HTTP errors
+    so that rate limits and outages are never mistaken for empty results.
+    """
+    with PROVIDER_LIMITS['pelias']:
+        response = sessions.get('geocode_earth', query)
+    response.raise_for_status()
+    return response.json()
+
 def pelias_geocode_reverse(lat, lng):
     """
     Geocode a location using the Pelias Geocode Earth reverse API.
@@ -125,8 +180,12 @@ def pelias_geocode_reverse(lat, lng):
             "point.lon="+str(lng)
 
     try:
-        response = requests.get(query).json()
-        return response
+        return _cached_geocode(
+            'pelias_reverse',
+            f"{round(float(lat), 6)},{round(float(lng), 6)}",
+            lambda: _pelias_get(query),
+            is_empty=lambda response: not response.get('features')
+        )
     except Exception as e:
         logging.error(f"Error geocoding {lat}, {lng} with Pelias: {str(e)}")
         return None
@@ -140,40 +199,11 @@ def pelias_geocode_search(text):
             "api_key="+GEOCODE_EARTH_API_KEY+"&"\
             "text="+text
     try:
-        response = requests.get(query).json()
-
-        candidates = []
-        for f in response.get('features'):
-            candidate = {
-                "id": f.get("properties").get("id"),
-                "label": f.get("properties").get("label"),
-                "geometry": f.get("geometry"),
-                "confidence": {
-                    "score": f.get("properties").get("confidence"),
-                    "match_type": f.get("properties").get("match_type"),
-                    "accuracy": f.get("properties").get("accuracy")
-                },
-                "boundaries": {
-                    "neighborhood": {
-                        "id": f.get("properties").get("neighbourhood_gid"),
-                        "name": f.get("properties").get("neighbourhood"),
-                    },
-                    "city": {
-                        "id": f.get("properties").get("locality_gid"),
-                        "name": f.get("properties").get("locality"),
-                    },
-                    "county": { 
-                        "id": f.get("properties").get("county_gid"),
-                        "name": f.get("properties").get("county"),
-                    },
-                    "state": {
-                        "id": f.get("properties").get("region_gid"),
-                        "name": f.get("properties").get("region"),
-                    }
-                }
-            }
-            candidates.append(candidate)
-        return candidates
+        return _cached_geocode(
+            'pelias_search',
+            _normalize_query(text),
+            lambda: _standardize_candidates(_pelias_get(query).get('features'))
+        )
     except Exception as e:
         logging.error(f"Error geocoding {text}: {str(e)}")
         return None
@@ -208,42 +238,18 @@ def pelias_geocode_structured(address_obj):
             
     # Construct the query URL
     query = "https://api.geocode.earth/v1/search/structured?" + "&".join(params)
+
+    # Key the cache on the normalized components that were actually sent
+    components = {
+        k: _normalize_query(v) for k, v in address_obj.items() if v
+    }
     
     try:
-        response = requests.get(query).json()
-
-        candidates = []
-        for f in response.get('features'):
-            candidate = {
-                "id": f.get("properties").get("id"),
-                "label": f.get("properties").get("label"),
-                "geometry": f.get("geometry"),
-                "confidence": {
-                    "score": f.get("properties").get("confidence"),
-                    "match_type": f.get("properties").get("match_type"),
-                    "accuracy": f.get("properties").get("accuracy")
-                },
-                "boundaries": {
-                    "neighborhood": {
-                        "id": f.get("properties").get("neighbourhood_gid"),
-                        "name": f.get("properties").get("neighbourhood"),
-                    },
-                    "city": {
-                        "id": f.get("properties").get("locality_gid"),
-                        "name": f.get("properties").get("locality"),
-                    },
-                    "county": { 
-                        "id": f.get("properties").get("county_gid"),
-                        "name": f.get("properties").get("county"),
-                    },
-                    "state": {
-                        "id": f.get("properties").get("region_gid"),
-                        "name": f.get("properties").get("region"),
-                    }
-                }
-            }
-            candidates.append(candidate)
-        return candidates
+        return _cached_geocode(
+            'pelias_structured',
+            components,
+            lambda: _standardize_candidates(_pelias_get(query).get('features'))
+        )
     except Exception as e:
         logging.error(f"Error in structured geocoding: {str(e)}")
         return None
@@ -265,70 +271,54 @@ def geocodio_geocode(text):
         return None
         
     try:
-        geocodio_response = geocodio_client.geocode(text)
+        return _cached_geocode(
+            'geocodio',
+            _normalize_query(text),
+            lambda: _geocodio_geocode(text)
+        )
+    except Exception as e:
+        logging.error(f"Error geocoding {text} with Geocodio: {str(e)}")
+        return None
 
-        if not geocodio_response or not geocodio_response.get('results'):
-            return None
-        
-        for result in geocodio_response.get('results'):
+def _geocodio_geocode(text):
+    """
+    Uncached Geocodio lookup behind geocodio_geocode. Returns an empty list when
+    Geocodio has no results so that the miss can be cached.
+    """
+    with PROVIDER_LIMITS['geocodio']:
+        started_at = time.time()
+        try:
+            geocodio_response = geocodio_client.geocode(text)
+        finally:
+            record_external_call('geocodio', time.time() - started_at)
+
+    if not geocodio_response or not geocodio_response.get('results'):
+        return []
+    
+    for result in geocodio_response.get('results'):
 
-            # Fall back to city and state if accuracy is too low
-            if result.get('accuracy') < 0.8:
-                city_state = get_city_state(text)
-                
-                city = city_state.get('city')
-                state = city_state.get('state')
+        # Fall back to city and state if accuracy is too low
+        if result.get('accuracy') < 0.8:
+            city_state = get_city_state(text)
+            
+            city = city_state.get('city')
+            state = city_state.get('state')
 
-                if city and state:
-                    return pelias_geocode_search(f"{city}, {state}")
-                else:
-                    result = None
-            # If accuracy is sufficient, try to get a point and reverse geocode for consistency with Pelias
+            if city and state:
+                return pelias_geocode_search(f"{city}, {state}")
             else:
-                lat = result.get('location').get('lat')
-                lng = result.get('location').get('lng')
+                result = None
+        # If accuracy is sufficient, try to get a point and reverse geocode for consistency with Pelias
+        else:
+            lat = result.get('location').get('lat')
+            lng = result.get('location').get('lng')
 
-                try:    
-                    response = pelias_geocode_reverse(lat, lng)
-                    candidates = []
-                    for f in response.get('features')[:1]:
-                        candidate = {
-                            "id": f.get("properties").get("id"),
-                            "label": f.get("properties").get("label"),
-                            "geometry": f.get("geometry"),
-                            "confidence": {
-                                "score": f.get("properties").get("confidence"),
-                                "match_type": f.get("properties").get("match_type"),
-                                "accuracy": f.get("properties").get("accuracy")
-                            },
-                            "boundaries": {
-                                "neighborhood": {
-                                    "id": f.get("properties").get("neighbourhood_gid"),
-                                    "name": f.get("properties").get("neighbourhood"),
-                                },
-                                "city": {
-                                    "id": f.get("properties").get("locality_gid"),
-                                    "name": f.get("properties").get("locality"),
-                                },
-                                "county": { 
-                                    "id": f.get("properties").get("county_gid"),
-                                    "name": f.get("properties").get("county"),
-                                },
-                                "state": {
-                                    "id": f.get("properties").get("region_gid"),
-                                    "name": f.get("properties").get("region"),
-                                }
-                            }
-                        }
-                        candidates.append(candidate)
-                    return candidates
-                except Exception as e:
-                    logging.error(f"Error geocoding {text} with Pelias: {str(e)}")
-                    return None
-        
-    except Exception as e:
-        logging.error(f"Error geocoding {text} with Geocodio: {str(e)}")
-        return None
+            try:    
+                response = pelias_geocode_reverse(lat, lng)
+                return _standardize_candidates(response.get('features')[:1])
+            except Exception as e:
+                logging.error(f"Error geocoding {text} with Pelias: {str(e)}")
+                return None
 
 def get_state_abbrev(state_name):
     """
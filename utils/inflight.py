@@ -0,0 +1,132 @@
+import json, logging, time
+import redis
+from utils.cache import get_redis_client
+from conf.settings import INFLIGHT_DEDUPE_ENABLED, INFLIGHT_TTL, PROCESSED_TTL
+
+# How long a claim can sit without a task ID while its workflow is submitted
+SUBMITTING_TTL = 30
+
+# Deletes a claim only if it still belongs to the given task's workflow, which
+# is identified by its final or its root task
+RELEASE_SCRIPT = """
+local value = redis.call('GET', KEYS[1])
+if value then
+    local claim = cjson.decode(value)
+    if claim['task_id'] == ARGV[1] or claim['root_id'] == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+end
+return 0
+"""
+
+########## HELPER FUNCTIONS ##########
+
+def _inflight_key(output_filename):
+    return f"agate:inflight:{output_filename}"
+
+def _processed_key(output_filename):
+    return f"agate:processed:{output_filename}"
+
+########## IN-FLIGHT ##########
+
+def claim(output_filename, wait=2.0):
+    """
+    Claims an article for processing (a single-flight lock on its output
+    filename, which is the URL's hash). If another request already holds the
+    claim, returns that request's workflow instead, waiting briefly if it is
+    still being submitted (and giving up on it after that).
+
+    Redis errors are logged and treated as a successful claim, so the pipeline
+    keeps working (without deduplication) if Redis is unavailable.
+
+    Returns:
+        dict: The running workflow's task IDs, or None if the claim was made
+    """
+    if not INFLIGHT_DEDUPE_ENABLED:
+        return None
+
+    key = _inflight_key(output_filename)
+    try:
+        client = get_redis_client()
+        if client.set(key, json.dumps({"task_id": None}), nx=True, ex=SUBMITTING_TTL):
+            return None
+
+        deadline = time.time() + wait
+        while True:
+            value = client.get(key)
+            existing = json.loads(value) if value else None
+            if existing is None:
+                # Released in the meantime, so try again
+                if client.set(key, json.dumps({"task_id": None}), nx=True, ex=SUBMITTING_TTL):
+                    return None
+            elif existing.get('task_id'):
+                return existing
+            elif time.time() > deadline:
+                logging.warning(f"Workflow for {output_filename} is still being submitted, submitting another")
+                return None
+            time.sleep(0.1)
+    except redis.RedisError as e:
+        logging.warning(f"Could not claim {output_filename}, processing without deduplication: {str(e)}")
+        return None
+
+def record(output_filename, submitted):
+    """
+    Stores the submitted workflow's task IDs on a claim, for duplicate
+    requests to attach to.
+    """
+    if not INFLIGHT_DEDUPE_ENABLED:
+        return
+    try:
+        get_redis_client().set(_inflight_key(output_filename), json.dumps(submitted), ex=INFLIGHT_TTL)
+    except redis.RedisError as e:
+        logging.warning(f"Could not record in-flight workflow for {output_filename}: {str(e)}")
+
+def release(output_filename, task_id=None):
+    """
+    Releases a claim, e.g. once the article is saved. With a task ID (the
+    workflow's final or root task), the claim is only released if it still
+    belongs to that workflow.
+    """
+    if not INFLIGHT_DEDUPE_ENABLED or not output_filename:
+        return
+    try:
+        client = get_redis_client()
+        if task_id is None:
+            client.delete(_inflight_key(output_filename))
+        else:
+            client.eval(RELEASE_SCRIPT, 1, _inflight_key(output_filename), task_id)
+    except redis.RedisError as e:
+        logging.warning(f"Could not release in-flight claim for {output_filename}: {str(e)}")
+
+########## PROCESSED ##########
+
+def mark_processed(output_filename, storage_url=None):
+    """
+    Remembers that an article was saved, and where.
+    """
+    try:
+        get_redis_client().set(_processed_key(output_filename), json.dumps({
+            "output_filename": output_filename,
+            "storage_url": storage_url,
+            "saved_at": round(time.time(), 3)
+        }), ex=PROCESSED_TTL)
+    except redis.RedisError as e:
+        logging.warning(f"Could not mark {output_filename} as processed: {str(e)}")
+
+def get_processed(output_filename, max_age):
+    """
+    Returns where an article was saved, if it was saved within max_age seconds.
+
+    Returns:
+        dict: The output filename, storage URL and save time, or None
+    """
+    try:
+        value = get_redis_client().get(_processed_key(output_filename))
+    except redis.RedisError as e:
+        logging.warning(f"Could not check whether {output_filename} was processed: {str(e)}")
+        return None
+
+    processed = json.loads(value) if value else None
+    if processed and time.time() - processed['saved_at'] <= max_age:
+        return processed
+    return None
@@ -1,58 +1,182 @@
-import json, os, logging
-from openai import OpenAI
-from langchain_community.callbacks.manager import get_openai_callback
-from conf.settings import OPENAI_API_KEY
+import json, os, logging, functools, threading, time
+from openai import OpenAI, DefaultHttpxClient
+from langchain_openai import ChatOpenAI
+from langchain_core.caches import BaseCache
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.load import dumps, loads
+from conf.settings import OPENAI_API_KEY, LLM_CACHE_ENABLED, LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES, OPENAI_LIMITER_ENABLED
+from utils.cache import RedisCache, make_key, sha256
+from utils.metrics import record_llm_call, observe
+from utils.llm_limits import before_request, after_response
 
 OPENAI_MODEL = "gpt-4.1"
+OPENAI_TEMPERATURE = 0.0
+
+# HTTP client for every OpenAI call, raw and through LangChain, which holds each
+# call to the rate limits shared by all workers
+HTTP_CLIENT = DefaultHttpxClient(
+    event_hooks={'request': [before_request], 'response': [after_response]}
+) if OPENAI_LIMITER_ENABLED else None
 
 OPENAI_CLIENT = OpenAI(
-    api_key=OPENAI_API_KEY
+    api_key=OPENAI_API_KEY,
+    http_client=HTTP_CLIENT
+)
+
+# Shared response cache for every LLM call in the pipeline
+LLM_CACHE = RedisCache(
+    'llm',
+    ttl=LLM_CACHE_TTL,
+    max_entries=LLM_CACHE_MAX_ENTRIES,
+    enabled=LLM_CACHE_ENABLED
 )
 
+########## CACHING ##########
+
+def llm_cache_key(model, temperature, system, user, response_format=None):
+    """
+    Content-addressed key for an LLM response.
+    """
+    return make_key(model, temperature, sha256(system), sha256(user), response_format)
+
+class LangChainLLMCache(BaseCache):
+    """
+    Adapts the shared LLM cache to LangChain so ChatOpenAI chains use it too.
+    LangChain's llm_string already encodes the model, temperature and other
+    invocation parameters, and the prompt encodes the full message list.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def lookup(self, prompt, llm_string):
+        value = self.cache.get(make_key(llm_string, sha256(prompt)))
+        if value is None:
+            return None
+        try:
+            return [loads(generation) for generation in json.loads(value)]
+        except Exception as e:
+            logging.warning(f"Could not load cached LLM generation: {str(e)}")
+            return None
+
+    def update(self, prompt, llm_string, return_val):
+        self.cache.set(
+            make_key(llm_string, sha256(prompt)),
+            json.dumps([dumps(generation) for generation in return_val])
+        )
+
+    def clear(self, **kwargs):
+        pass
+
+########## METRICS ##########
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """
+    Records request latency for a ChatOpenAI model's calls.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, run_id, **kwargs):
+        with self._lock:
+            self._started[run_id] = time.time()
+
+    def on_llm_end(self, response, run_id, **kwargs):
+        with self._lock:
+            started_at = self._started.pop(run_id, None)
+        if started_at is not None:
+            observe("agate_llm_request_duration_seconds", time.time() - started_at, model=self.model)
+
+    def on_llm_error(self, error, run_id, **kwargs):
+        with self._lock:
+            self._started.pop(run_id, None)
+
+########## MODELS ##########
+
+@functools.lru_cache(maxsize=None)
+def get_chat_model(model=OPENAI_MODEL, **kwargs):
+    """
+    Returns a ChatOpenAI instance wired to the shared LLM cache and rate
+    limits. Instances are reused per model/parameters instead of being rebuilt
+    on every call.
+    """
+    return ChatOpenAI(
+        model=model,
+        cache=LangChainLLMCache(LLM_CACHE) if LLM_CACHE_ENABLED else False,
+        callbacks=[LLMMetricsHandler(model)],
+        http_client=HTTP_CLIENT,
+        **kwargs
+    )
+
 def get_json_openai(system, user, force_object=False):
     """
     Get JSON response from OpenAI
-    
+
     Args:
         system: System prompt
         user: User prompt
         force_object: If True, requires response to be a JSON object. If False, allows arrays.
     """
     try:
-        with get_openai_callback() as cb:
-            kwargs = {
-                "model": OPENAI_MODEL,
-                "messages": [
-                    {"role": "system", "content": system},
-                    {"role": "user", "content": "%s" % user}
-                ],
-                "temperature": 0.0
-            }
-            
-            if force_object:
-                kwargs["response_format"] = {"type": "json_object"}
+        kwargs = {
+            "model": OPENAI_MODEL,
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": "%s" % user}
+            ],
+            "temperature": OPENAI_TEMPERATURE
+        }
+
+        if force_object:
+            kwargs["response_format"] = {"type": "json_object"}
 
+        # Check the cache before going to the network
+        cache_key = llm_cache_key(
+            kwargs["model"],
+            kwargs["temperature"],
+            system,
+            kwargs["messages"][1]["content"],
+            kwargs.get("response_format")
+        )
+        content = LLM_CACHE.get(cache_key)
+        cached = content is not None
+
+        if not cached:
+            started_at = time.time()
             response = OPENAI_CLIENT.chat.completions.create(**kwargs)
+            observe("agate_llm_request_duration_seconds", time.time() - started_at, model=kwargs["model"])
             content = response.choices[0].message.content.strip()
-            
-            if not content:
-                raise ValueError("Empty response from LLM")
-            
-            # Clean up markdown formatting if present
-            if content.startswith('```'):
-                # Remove opening backticks and optional 'json' identifier
-                content = content.split('\n', 1)[1] if '\n' in content else content[3:]
-                # Remove closing backticks
-                content = content.rsplit('\n', 1)[0] if '\n' in content else content[:-3]
-                content = content.strip()
-                
-            try:
-                return json.loads(content)
-            except json.JSONDecodeError:
-                # If JSON parsing fails, log the response and raise
-                logging.error(f"Failed to parse LLM response as JSON: {content}")
-                raise
+            record_llm_call(response.usage)
+        else:
+            record_llm_call(cached=True)
+
+        if not content:
+            raise ValueError("Empty response from LLM")
+
+        # Clean up markdown formatting if present
+        if content.startswith('```'):
+            # Remove opening backticks and optional 'json' identifier
+            content = content.split('\n', 1)[1] if '\n' in content else content[3:]
+            # Remove closing backticks
+            content = content.rsplit('\n', 1)[0] if '\n' in content else content[:-3]
+            content = content.strip()
+
+        try:
+            result = json.loads(content)
+        except json.JSONDecodeError:
+            # If JSON parsing fails, log the response and raise
+            logging.error(f"Failed to parse LLM response as JSON: {content}")
+            raise
+
+        # Only responses that parsed cleanly are worth keeping
+        if not cached:
+            LLM_CACHE.set(cache_key, content)
+
+        return result
 
     except Exception as e:
         logging.error(f"LLM error: {str(e)}")
-        raise
\ No newline at end of file
+        raise
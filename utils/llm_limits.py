@@ -0,0 +1,233 @@
+import json, logging, math, random, re, time
+import redis
+from utils.cache import get_redis_client
+from utils.metrics import incr, observe
+from conf.settings import OPENAI_LIMITER_ENABLED, OPENAI_RATE_LIMITS, OPENAI_LIMITER_MAX_WAIT
+
+# How long a model's limiter state is kept after its last call
+STATE_TTL = 60 * 60
+
+# Rough characters per token, for estimating a request's prompt tokens
+CHARS_PER_TOKEN = 4
+
+# Each model has a request bucket and a token bucket, refilled continuously at
+# its per-minute limits. The limits are the lower of the configured ones
+# (ARGV[1], ARGV[2]) and those learned from OpenAI's headers. Sets requests,
+# tokens, rpm, tpm, now and blocked_until (while OpenAI is rejecting calls).
+_REFILL = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'rpm', 'tpm', 'requests', 'tokens', 'updated_at', 'blocked_until')
+
+local function lower(a, b)
+    if a and b then return math.min(a, b) end
+    return a or b
+end
+local rpm = lower(tonumber(state[1]), tonumber(ARGV[1]))
+local tpm = lower(tonumber(state[2]), tonumber(ARGV[2]))
+local blocked_until = tonumber(state[6]) or 0
+
+local requests, tokens
+if rpm and tpm and rpm > 0 and tpm > 0 then
+    local elapsed = math.max(0, now - (tonumber(state[5]) or now))
+    requests = math.min(rpm, (tonumber(state[3]) or rpm) + elapsed * rpm / 60)
+    tokens = math.min(tpm, (tonumber(state[4]) or tpm) + elapsed * tpm / 60)
+end
+"""
+
+# Takes a request and ARGV[3] tokens if the budget allows. Returns "0" if they
+# were taken, or else the seconds until they can be (as a string, since Redis
+# would truncate a Lua number).
+ACQUIRE_SCRIPT = _REFILL + """
+if not requests then
+    return '0'
+end
+
+local cost = math.min(tonumber(ARGV[3]), tpm)
+local wait = math.max(0, blocked_until - now)
+if wait == 0 then
+    if requests < 1 then wait = (1 - requests) * 60 / rpm end
+    if tokens < cost then wait = math.max(wait, (cost - tokens) * 60 / tpm) end
+end
+if wait == 0 then
+    requests = requests - 1
+    tokens = tokens - cost
+end
+
+redis.call('HSET', KEYS[1], 'requests', tostring(requests), 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return tostring(wait)
+"""
+
+# Corrects a model's state from a response's rate-limit headers: the limits
+# (ARGV[3], ARGV[4]), what OpenAI says remains (ARGV[5], ARGV[6]), which only
+# ever lowers the buckets since calls still in flight aren't counted yet, and
+# how long to hold off calls after a 429 (ARGV[7]). Empty arguments are skipped.
+SYNC_SCRIPT = _REFILL + """
+local learned_rpm, learned_tpm = tonumber(ARGV[3]), tonumber(ARGV[4])
+if learned_rpm then redis.call('HSET', KEYS[1], 'rpm', tostring(learned_rpm)) end
+if learned_tpm then redis.call('HSET', KEYS[1], 'tpm', tostring(learned_tpm)) end
+
+local remaining_requests, remaining_tokens = tonumber(ARGV[5]), tonumber(ARGV[6])
+if remaining_requests then requests = lower(requests, remaining_requests) end
+if remaining_tokens then tokens = lower(tokens, remaining_tokens) end
+if requests then redis.call('HSET', KEYS[1], 'requests', tostring(requests)) end
+if tokens then redis.call('HSET', KEYS[1], 'tokens', tostring(tokens)) end
+
+local blocked_for = tonumber(ARGV[7]) or 0
+if blocked_for > 0 then
+    redis.call('HSET', KEYS[1], 'blocked_until', tostring(math.max(blocked_until, now + blocked_for)))
+end
+
+redis.call('HSET', KEYS[1], 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[8])
+return 1
+"""
+
+########## HELPER FUNCTIONS ##########
+
+def _state_key(model):
+    return f"agate:openai_limits:{model}"
+
+def _configured(model):
+    limits = OPENAI_RATE_LIMITS.get(model) or {}
+    return limits.get('rpm', ''), limits.get('tpm', '')
+
+def parse_duration(value):
+    """
+    Parses a duration from OpenAI's reset headers, like "20ms", "1s" or "6m0s".
+
+    Returns:
+        float: Seconds, or None if it can't be parsed
+    """
+    if not value:
+        return None
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 60 * 60}
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|s|m|h)', value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+def estimate_tokens(body):
+    """
+    Estimates the tokens a chat completion request counts against the limit:
+    its prompt, from the length of the messages, plus its completion limit.
+    """
+    chars = sum(len(json.dumps(message.get('content') or '')) for message in body.get('messages') or [])
+    completion = body.get('max_completion_tokens') or body.get('max_tokens') or 0
+    return math.ceil(chars / CHARS_PER_TOKEN) + completion
+
+def _retry_after(headers):
+    """
+    Returns how long OpenAI asked to wait after a 429, in seconds.
+    """
+    if headers.get('retry-after-ms'):
+        return float(headers['retry-after-ms']) / 1000
+    if headers.get('retry-after'):
+        return parse_duration(headers['retry-after']) or 1
+    resets = [
+        parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+        for kind in ('requests', 'tokens')
+        if headers.get(f"x-ratelimit-remaining-{kind}") == '0'
+    ]
+    return max([r for r in resets if r] or [1])
+
+########## LIMITER ##########
+
+def acquire(model, tokens):
+    """
+    Waits until a model has budget for a request of about this many tokens,
+    then takes it. The budget is shared by every worker through Redis.
+
+    Redis errors are logged and the call let through, and after
+    OPENAI_LIMITER_MAX_WAIT seconds the call goes ahead anyway, so the limiter
+    can't stall the pipeline.
+
+    Returns:
+        float: Seconds spent waiting
+    """
+    if not OPENAI_LIMITER_ENABLED or not model:
+        return 0
+
+    rpm, tpm = _configured(model)
+    started_at = time.time()
+    while True:
+        try:
+            wait = float(get_redis_client().eval(
+                ACQUIRE_SCRIPT, 1, _state_key(model), rpm, tpm, tokens, STATE_TTL
+            ))
+        except redis.RedisError as e:
+            logging.warning(f"Could not check OpenAI rate limits for {model}: {str(e)}")
+            wait = 0
+
+        waited = time.time() - started_at
+        if not wait:
+            break
+        if waited + wait > OPENAI_LIMITER_MAX_WAIT:
+            logging.warning(f"Waited {waited:.1f}s for {model} rate limit budget, sending anyway")
+            break
+        # Jitter keeps waiting workers from all trying again at once
+        time.sleep(min(wait, 5) * random.uniform(1, 1.2))
+
+    if waited:
+        observe("agate_llm_rate_limit_wait_seconds", waited, model=model)
+    return waited
+
+def sync(model, headers, status_code=200):
+    """
+    Updates a model's shared state from an OpenAI response's rate-limit
+    headers, and holds off every worker's calls after a 429.
+    """
+    if not OPENAI_LIMITER_ENABLED or not model:
+        return
+
+    blocked_for = ''
+    if status_code == 429:
+        incr("agate_llm_rate_limited_total", model=model)
+        blocked_for = _retry_after(headers)
+        logging.warning(f"OpenAI rate limited {model}, holding off calls for {blocked_for}s")
+
+    rpm, tpm = _configured(model)
+    try:
+        get_redis_client().eval(
+            SYNC_SCRIPT, 1, _state_key(model), rpm, tpm,
+            headers.get('x-ratelimit-limit-requests') or '',
+            headers.get('x-ratelimit-limit-tokens') or '',
+            headers.get('x-ratelimit-remaining-requests') or '',
+            headers.get('x-ratelimit-remaining-tokens') or '',
+            blocked_for,
+            STATE_TTL
+        )
+    except redis.RedisError as e:
+        logging.warning(f"Could not update OpenAI rate limits for {model}: {str(e)}")
+
+########## HTTP HOOKS ##########
+
+def _chat_completion_body(request):
+    if request.method != 'POST' or not request.url.path.endswith('/chat/completions'):
+        return None
+    try:
+        return json.loads(request.content or b'{}')
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def before_request(request):
+    """
+    httpx request hook that waits for rate limit budget before each chat
+    completion, including the OpenAI client's own retries.
+    """
+    body = _chat_completion_body(request)
+    if body:
+        acquire(body.get('model'), estimate_tokens(body))
+
+def after_response(response):
+    """
+    httpx response hook that feeds each chat completion's rate-limit headers
+    back into the shared state.
+    """
+    body = _chat_completion_body(response.request)
+    if body:
+        sync(body.get('model'), response.headers, response.status_code)
@@ -0,0 +1,62 @@
+import hashlib, json, logging
+from conf.settings import PAYLOAD_LOG_LEVEL, PAYLOAD_LOG_SAMPLE_RATE, PAYLOAD_LOG_MAX_STRING, PAYLOAD_LOG_MAX_ITEMS
+
+# Level payloads are logged at by default, e.g. INFO or DEBUG
+DEFAULT_LEVEL = logging.getLevelName(PAYLOAD_LOG_LEVEL.upper())
+
+########## HELPER FUNCTIONS ##########
+
+def _summarize(value, max_string, max_items):
+    """
+    Returns a copy of a JSON-like value with long strings and lists cut down.
+    """
+    if isinstance(value, str):
+        if max_string and len(value) > max_string:
+            return f"{value[:max_string]}... [+{len(value) - max_string} chars]"
+        return value
+    if isinstance(value, dict):
+        return {k: _summarize(v, max_string, max_items) for k, v in value.items()}
+    if isinstance(value, list):
+        items = [_summarize(v, max_string, max_items) for v in value[:max_items or None]]
+        if max_items and len(value) > max_items:
+            items.append(f"... [+{len(value) - max_items} items]")
+        return items
+    return value
+
+def _sampled(payload, rate):
+    """
+    Decides whether to log a payload. Sampling is keyed on the article, so a
+    sampled article is logged at every stage rather than at random ones.
+    """
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    key = (payload.get('output_filename') or payload.get('url')) if isinstance(payload, dict) else None
+    if not key:
+        return True
+    bucket = int(hashlib.md5(str(key).encode()).hexdigest()[:8], 16) / 0xffffffff
+    return bucket < rate
+
+########## LOGGING ##########
+
+def log_payload(message, payload, level=DEFAULT_LEVEL, truncate=True, sample_rate=PAYLOAD_LOG_SAMPLE_RATE):
+    """
+    Logs a pipeline payload. Nothing is serialized unless the level is enabled
+    and the article is sampled, and large fields (like the article text) are
+    truncated unless truncate is False.
+
+    Args:
+        message (str): Log message, followed by the payload
+        payload: JSON-serializable payload
+        level (int): Logging level
+        truncate (bool): Whether to cut down long strings and lists
+        sample_rate (float): Fraction of articles whose payloads are logged
+    """
+    logger = logging.getLogger()
+    if not logger.isEnabledFor(level) or not _sampled(payload, sample_rate):
+        return
+
+    if truncate:
+        payload = _summarize(payload, PAYLOAD_LOG_MAX_STRING, PAYLOAD_LOG_MAX_ITEMS)
+    logger.log(level, "%s: %s", message, json.dumps(payload, default=str))
@@ -0,0 +1,426 @@
+import contextvars, functools, json, logging, re, threading, time
+from collections import Counter, defaultdict
+import redis
+from celery import current_task
+from langchain_community.callbacks.manager import get_openai_callback
+from utils.cache import get_redis_client, queue_length
+from utils.progress import record_stage_progress, get_workflow
+from conf.settings import METRICS_QUEUES, PRIORITIES
+
+METRICS_KEY = "agate:metrics"
+
+# Default histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Buckets for whole workflows, which can wait in a backlog for a long time
+WORKFLOW_BUCKETS = (5, 10, 30, 60, 120, 300, 600, 1800, 3600, 3 * 3600, 12 * 3600)
+
+# Type and help text for each metric family, used when rendering
+METRIC_FAMILIES = {
+    'agate_http_requests_total': ('counter', 'API requests by endpoint, method and status'),
+    'agate_http_request_duration_seconds': ('histogram', 'API request latency by endpoint'),
+    'agate_stage_runs_total': ('counter', 'Pipeline stage runs by stage and status'),
+    'agate_stage_retries_total': ('counter', 'Celery retries seen by pipeline stages'),
+    'agate_stage_duration_seconds': ('histogram', 'Pipeline stage wall time by stage and priority'),
+    'agate_stage_queue_wait_seconds': ('histogram', 'Time between a stage finishing and the next one starting, by priority'),
+    'agate_workflow_duration_seconds': ('histogram', 'Time from submission to saved output, by priority and mode'),
+    'agate_admission_rejected_total': ('counter', 'Submissions turned away by reason and priority'),
+    'agate_stage_llm_calls_total': ('counter', 'LLM calls made by pipeline stages'),
+    'agate_stage_llm_cache_hits_total': ('counter', 'LLM calls answered from the cache by pipeline stages'),
+    'agate_stage_llm_tokens_total': ('counter', 'LLM tokens used by pipeline stages, by kind'),
+    'agate_stage_external_calls_total': ('counter', 'External calls made by pipeline stages, by upstream'),
+    'agate_external_calls_total': ('counter', 'Calls to external services by upstream'),
+    'agate_external_request_duration_seconds': ('histogram', 'External service call latency by upstream'),
+    'agate_llm_request_duration_seconds': ('histogram', 'LLM request latency by model'),
+    'agate_llm_rate_limit_wait_seconds': ('histogram', 'Time LLM calls waited for rate limit budget, by model'),
+    'agate_llm_rate_limited_total': ('counter', 'LLM calls rejected by OpenAI with a 429, by model'),
+    'agate_geocode_candidates_total': ('counter', 'Geocode candidate selections by route'),
+    'agate_gazetteer_lookups_total': ('counter', 'Gazetteer city/state lookups by result'),
+    'agate_cache_requests_total': ('counter', 'Cache lookups by cache and result'),
+    'agate_cache_evictions_total': ('counter', 'Cache LRU evictions'),
+    'agate_cache_hit_ratio': ('gauge', 'Cache hit ratio'),
+    'agate_celery_queue_length': ('gauge', 'Messages waiting in each Celery queue')
+}
+
+# Counts since this process started, kept even when Redis is unavailable
+_local_metrics = Counter()
+
+# Request priority for each message priority
+_PRIORITY_NAMES = {value: name for name, value in PRIORITIES.items()}
+_lock = threading.Lock()
+
+# Usage collector for the stage currently running in this context. Thread pools
+# inside a stage copy the context, so their calls are attributed to the stage too.
+_current_stage = contextvars.ContextVar('current_stage', default=None)
+
+########## SERIES ##########
+
+def series(name, **labels):
+    """
+    Returns the Prometheus series name for a metric and its labels, e.g.
+    agate_stage_runs_total{stage="geocode",status="success"}
+    """
+    if not labels:
+        return name
+    label_str = ','.join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+def _family(series_name):
+    name = series_name.split('{', 1)[0]
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRIC_FAMILIES:
+            return name[:-len(suffix)]
+    return name
+
+########## COUNTERS ##########
+
+def incr(name, amount=1, **labels):
+    """
+    Increments a counter, both in-process and in the fleet-wide Redis hash.
+    Redis failures are logged and ignored; metrics never fail a task.
+
+    Args:
+        name (str): Metric name, e.g. "agate_geocode_candidates_total"
+        amount (int): Amount to add
+        **labels: Prometheus labels for the series
+    """
+    incr_many({series(name, **labels): amount})
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    """
+    Records an observation in a histogram.
+
+    Args:
+        name (str): Metric name, e.g. "agate_stage_duration_seconds"
+        value (float): Observed value, in the metric's unit
+        buckets (tuple): Upper bounds of the histogram buckets
+        **labels: Prometheus labels for the series
+    """
+    # Every bucket is written, even with 0, so the histogram is always complete
+    amounts = {
+        series(f"{name}_bucket", le=str(bound), **labels): 1 if value <= bound else 0
+        for bound in buckets
+    }
+    amounts[series(f"{name}_bucket", le="+Inf", **labels)] = 1
+    amounts[series(f"{name}_sum", **labels)] = float(value)
+    amounts[series(f"{name}_count", **labels)] = 1
+    incr_many(amounts, keep_zeros=True)
+
+def incr_many(amounts, keep_zeros=False):
+    """
+    Increments several series in a single Redis round trip.
+
+    Args:
+        amounts (dict): Series names to amounts
+        keep_zeros (bool): Write series even when their amount is 0
+    """
+    if not keep_zeros:
+        amounts = {name: amount for name, amount in amounts.items() if amount}
+    if not amounts:
+        return
+
+    with _lock:
+        _local_metrics.update(amounts)
+
+    try:
+        pipe = get_redis_client().pipeline(transaction=False)
+        for name, amount in amounts.items():
+            if isinstance(amount, float):
+                pipe.hincrbyfloat(METRICS_KEY, name, amount)
+            else:
+                pipe.hincrby(METRICS_KEY, name, amount)
+        pipe.execute()
+    except redis.RedisError as e:
+        logging.warning(f"Metrics unavailable, counting locally only: {str(e)}")
+
+def get_counters(prefix=None):
+    """
+    Returns fleet-wide series values, optionally limited to names starting with
+    prefix. Falls back to this process's counts if Redis is unavailable.
+    """
+    try:
+        raw = get_redis_client().hgetall(METRICS_KEY)
+        counters = {k.decode(): float(v) if b'.' in v else int(v) for k, v in raw.items()}
+    except redis.RedisError as e:
+        logging.warning(f"Metrics unavailable, returning local counters: {str(e)}")
+        with _lock:
+            counters = dict(_local_metrics)
+
+    if prefix:
+        counters = {k: v for k, v in counters.items() if k.startswith(prefix)}
+    return counters
+
+########## STAGE USAGE ##########
+
+class StageUsage(object):
+    """
+    Thread-safe tally of the LLM and external calls made during one stage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.llm_calls = 0
+        self.llm_cache_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.external_calls = Counter()
+
+    def add_llm_call(self, prompt_tokens=0, completion_tokens=0, cached=False):
+        with self._lock:
+            if cached:
+                self.llm_cache_hits += 1
+            else:
+                self.llm_calls += 1
+                self.prompt_tokens += prompt_tokens or 0
+                self.completion_tokens += completion_tokens or 0
+
+    def add_external_call(self, upstream):
+        with self._lock:
+            self.external_calls[upstream] += 1
+
+def record_llm_call(usage=None, cached=False):
+    """
+    Attributes an LLM call made outside LangChain (which is tracked separately)
+    to the current stage.
+
+    Args:
+        usage: The OpenAI response's usage object, if the call wasn't cached
+        cached (bool): Whether the response came from the LLM cache
+    """
+    stage = _current_stage.get()
+    if stage is None:
+        return
+    stage.add_llm_call(
+        prompt_tokens=getattr(usage, 'prompt_tokens', 0),
+        completion_tokens=getattr(usage, 'completion_tokens', 0),
+        cached=cached
+    )
+
+def record_external_call(upstream, duration=None):
+    """
+    Counts a call to an external service and attributes it to the current stage.
+
+    Args:
+        upstream (str): Name of the external service
+        duration (float): Call latency in seconds, if known
+    """
+    incr("agate_external_calls_total", upstream=upstream)
+    if duration is not None:
+        observe("agate_external_request_duration_seconds", duration, upstream=upstream)
+
+    stage = _current_stage.get()
+    if stage is not None:
+        stage.add_external_call(upstream)
+
+########## STAGES ##########
+
+def _find_payload(args):
+    for arg in args:
+        if isinstance(arg, dict):
+            return arg
+    return None
+
+def _current_priority():
+    """
+    Returns the request priority the running task was sent at, or "unknown"
+    (e.g. on a thread started by the task).
+    """
+    request = current_task.request if current_task else None
+    if not request or not request.id:
+        return 'unknown'
+    return _PRIORITY_NAMES.get((request.delivery_info or {}).get('priority'), 'unknown')
+
+def _record_stage(metrics):
+    """
+    Emits a stage's metrics as a structured log line and adds them to the
+    fleet-wide metrics.
+    """
+    logging.info(json.dumps({"event": "stage_metrics", **metrics}))
+
+    stage = metrics['stage']
+    incr_many({
+        series("agate_stage_runs_total", stage=stage, status=metrics['status']): 1,
+        series("agate_stage_retries_total", stage=stage): metrics['retries'],
+        series("agate_stage_llm_calls_total", stage=stage): metrics['llm_calls'],
+        series("agate_stage_llm_cache_hits_total", stage=stage): metrics['llm_cache_hits'],
+        series("agate_stage_llm_tokens_total", stage=stage, kind="prompt"): metrics['prompt_tokens'],
+        series("agate_stage_llm_tokens_total", stage=stage, kind="completion"): metrics['completion_tokens'],
+        **{
+            series("agate_stage_external_calls_total", stage=stage, upstream=upstream): count
+            for upstream, count in metrics['external_calls'].items()
+        }
+    })
+    priority = metrics['priority']
+    observe("agate_stage_duration_seconds", metrics['wall_ms'] / 1000, stage=stage, priority=priority)
+    if metrics.get('queue_wait_ms') is not None:
+        observe("agate_stage_queue_wait_seconds", metrics['queue_wait_ms'] / 1000, stage=stage, priority=priority)
+
+def instrument_stage(name):
+    """
+    Decorator for a pipeline stage that records wall time, queue wait (since the
+    previous stage finished), Celery retries, LLM calls and tokens, and external
+    calls. Metrics are logged, counted, and appended to the payload's _timings
+    block, which is carried forward even by stages that build a new payload.
+    The workflow's progress is updated as the stage starts and finishes.
+
+    The stage's payload is the first dict argument, if any. Stages that don't
+    take a payload (like scrape) start the _timings block.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            payload = _find_payload(args)
+            timings = (payload or {}).get('_timings') or {"stages": []}
+
+            started_at = time.time()
+            usage = StageUsage()
+            token = _current_stage.set(usage)
+            status = 'error'
+            record_stage_progress(name, 'running')
+
+            try:
+                # Catches tokens from LangChain chains; raw OpenAI calls record themselves
+                with get_openai_callback() as cb:
+                    result = func(*args, **kwargs)
+                status = 'success'
+                return result
+            finally:
+                _current_stage.reset(token)
+                finished_at = time.time()
+
+                previous = timings['stages'][-1] if timings['stages'] else None
+                retries = current_task.request.retries if current_task and current_task.request else 0
+
+                metrics = {
+                    "stage": name,
+                    "status": status,
+                    "started_at": round(started_at, 3),
+                    "finished_at": round(finished_at, 3),
+                    "wall_ms": round((finished_at - started_at) * 1000, 1),
+                    "queue_wait_ms": round((started_at - previous['finished_at']) * 1000, 1) if previous else None,
+                    "retries": retries or 0,
+                    "priority": _current_priority(),
+                    "llm_calls": usage.llm_calls + cb.successful_requests,
+                    "llm_cache_hits": usage.llm_cache_hits,
+                    "prompt_tokens": usage.prompt_tokens + cb.prompt_tokens,
+                    "completion_tokens": usage.completion_tokens + cb.completion_tokens,
+                    "external_calls": dict(usage.external_calls)
+                }
+                _record_stage(metrics)
+
+                output = (result if isinstance(result, dict) else payload) if status == 'success' else None
+                record_stage_progress(name, status, output)
+
+                if status == 'success':
+                    if output is not None:
+                        timings['stages'].append(metrics)
+                        timings['total_ms'] = round((finished_at - timings['stages'][0]['started_at']) * 1000, 1)
+                        output['_timings'] = timings
+        return wrapper
+    return decorator
+
+def record_workflow_duration():
+    """
+    Records how long the current workflow took from submission to its output
+    being saved, by priority and mode. Called by the save stage, which runs in
+    the task the workflow was registered under.
+    """
+    request = current_task.request if current_task else None
+    if not request or not request.id:
+        return
+    try:
+        workflow = get_workflow(request.id)
+    except redis.RedisError as e:
+        logging.warning(f"Could not read workflow {request.id}: {str(e)}")
+        return
+    if not workflow or not workflow.get('submitted_at'):
+        return
+
+    observe(
+        "agate_workflow_duration_seconds",
+        time.time() - workflow['submitted_at'],
+        buckets=WORKFLOW_BUCKETS,
+        priority=workflow.get('priority') or 'unknown',
+        mode=workflow.get('mode')
+    )
+
+def merge_timings(*timings):
+    """
+    Merges the _timings blocks of stages that ran in parallel from the same
+    payload. Stages shared by both (those before the split) are kept once.
+
+    Returns:
+        dict: A _timings block with every stage, in the order they finished
+    """
+    stages = {}
+    for block in timings:
+        for stage in (block or {}).get('stages', []):
+            stages[(stage['stage'], stage['started_at'])] = stage
+
+    merged = {"stages": sorted(stages.values(), key=lambda s: s['finished_at'])}
+    resumed = set().union(*((block or {}).get('resumed', []) for block in timings))
+    if resumed:
+        merged['resumed'] = sorted(resumed)
+    if merged['stages']:
+        started_at = min(s['started_at'] for s in merged['stages'])
+        merged['total_ms'] = round((merged['stages'][-1]['finished_at'] - started_at) * 1000, 1)
+    return merged
+
+########## EXPOSITION ##########
+
+def _collect_gauges():
+    """
+    Reads point-in-time values (queue depths, cache stats) straight from Redis.
+    """
+    values = {}
+
+    for queue in METRICS_QUEUES:
+        values[series("agate_celery_queue_length", queue=queue)] = queue_length(queue)
+
+    client = get_redis_client()
+    for key in client.scan_iter(match="agate:cache:*:_stats"):
+        cache = key.decode().split(':')[2]
+        stats = {k.decode(): int(v) for k, v in client.hgetall(key).items()}
+        hits, misses = stats.get('hits', 0), stats.get('misses', 0)
+        values[series("agate_cache_requests_total", cache=cache, result="hit")] = hits
+        values[series("agate_cache_requests_total", cache=cache, result="miss")] = misses
+        values[series("agate_cache_evictions_total", cache=cache)] = stats.get('evictions', 0)
+        if hits + misses:
+            values[series("agate_cache_hit_ratio", cache=cache)] = round(hits / (hits + misses), 4)
+
+    return values
+
+def _bucket_sort_key(series_name):
+    # Group histogram buckets by their other labels and order them numerically
+    match = re.search(r'le="([^"]*)",?', series_name)
+    if not match:
+        return (series_name, 0)
+    le = match.group(1)
+    return (series_name.replace(match.group(0), ''), float('inf') if le == '+Inf' else float(le))
+
+def render_prometheus():
+    """
+    Renders every fleet-wide metric in the Prometheus text exposition format.
+    Both the API's /metrics endpoint and the worker exporter serve this, so
+    either can be scraped (or used for autoscaling on queue depth).
+    """
+    values = get_counters()
+    try:
+        values.update(_collect_gauges())
+    except redis.RedisError as e:
+        logging.warning(f"Could not collect queue and cache metrics: {str(e)}")
+
+    families = defaultdict(list)
+    for name in values:
+        families[_family(name)].append(name)
+
+    lines = []
+    for family in sorted(families):
+        metric_type, help_text = METRIC_FAMILIES.get(family, ('untyped', ''))
+        if help_text:
+            lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {metric_type}")
+        for name in sorted(families[family], key=_bucket_sort_key):
+            lines.append(f"{name} {values[name]}")
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,127 @@
+import functools, logging, os
+import redis
+from utils.cache import get_redis_client, sha256
+from conf.settings import PAYLOAD_STORE_ENABLED, PAYLOAD_STORE_DIR, PAYLOAD_STORE_TTL, PAYLOAD_STORE_MIN_SIZE
+
+# Large immutable fields that are stored once and passed between tasks by handle
+STORED_FIELDS = ('text', 'html')
+
+########## STORE ##########
+
+def _redis_key(digest):
+    return f"agate:blob:{digest}"
+
+def _file_path(digest):
+    return os.path.join(PAYLOAD_STORE_DIR, digest[:2], digest)
+
+def put(value):
+    """
+    Writes a string to the payload store (a shared directory if PAYLOAD_STORE_DIR
+    is set, otherwise Redis) and returns its content-addressed handle.
+
+    Returns:
+        str: Handle like "redis:<sha256>" or "file:<sha256>", or None if the
+        store couldn't be written
+    """
+    digest = sha256(value)
+    try:
+        if PAYLOAD_STORE_DIR:
+            path = _file_path(digest)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(value)
+                os.replace(tmp_path, path)
+            return f"file:{digest}"
+
+        get_redis_client().set(_redis_key(digest), value.encode(), ex=PAYLOAD_STORE_TTL)
+        return f"redis:{digest}"
+    except (redis.RedisError, OSError) as e:
+        logging.warning(f"Payload store unavailable, keeping value inline: {str(e)}")
+        return None
+
+@functools.lru_cache(maxsize=32)
+def get(handle):
+    """
+    Reads a value back from the payload store. Values are immutable, so recent
+    ones are kept in memory for the next stage that runs in this process.
+
+    Raises:
+        KeyError: If the value has expired or was never stored
+    """
+    backend, digest = handle.split(':', 1)
+    if backend == 'file':
+        try:
+            with open(_file_path(digest), encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise KeyError(f"Payload store value not found: {handle}")
+
+    value = get_redis_client().get(_redis_key(digest))
+    if value is None:
+        raise KeyError(f"Payload store value not found: {handle}")
+    return value.decode()
+
+########## PAYLOADS ##########
+
+def store_fields(payload):
+    """
+    Moves large fields out of a payload and into the store, replacing each with
+    a <field>_ref handle. Small fields, and fields the store can't take right
+    now, stay inline.
+
+    Returns:
+        dict: The updated payload
+    """
+    if not PAYLOAD_STORE_ENABLED:
+        return payload
+
+    for field in STORED_FIELDS:
+        value = payload.get(field)
+        if not isinstance(value, str) or len(value) < PAYLOAD_STORE_MIN_SIZE:
+            continue
+        handle = put(value)
+        if handle:
+            payload[f"{field}_ref"] = handle
+            del payload[field]
+    return payload
+
+def get_field(payload, field, default=None):
+    """
+    Returns a field from a payload, fetching it from the store if the payload
+    only carries its handle.
+    """
+    if field in payload:
+        return payload[field]
+    handle = payload.get(f"{field}_ref")
+    if handle:
+        return get(handle)
+    return default
+
+def get_text(payload, default=None):
+    """
+    Returns the article text from a payload, wherever it is kept.
+    """
+    return get_field(payload, 'text', default)
+
+def carry_fields(source, target):
+    """
+    Copies the stored fields (inline values or handles) from one payload to a
+    new one, for stages that build their output from scratch.
+    """
+    for field in STORED_FIELDS:
+        for key in (field, f"{field}_ref"):
+            if key in source:
+                target[key] = source[key]
+    return target
+
+def resolve_fields(payload):
+    """
+    Puts every stored field back inline, e.g. before the payload is saved.
+    """
+    for field in STORED_FIELDS:
+        handle = payload.pop(f"{field}_ref", None)
+        if handle:
+            payload[field] = get(handle)
+    return payload
@@ -0,0 +1,132 @@
+import contextvars, json, logging, time
+import redis
+from celery import current_task
+from utils.cache import get_redis_client
+from conf.settings import PROGRESS_TTL
+
+# Events published when these stages succeed, named for what has happened
+MILESTONES = {
+    'scrape': 'scraped',
+    'classify': 'classified',
+    'extract_review': 'extracted',
+    'consolidate_locations': 'filtered',
+    'consolidate_geocodes': 'geocoded',
+    'finalize': 'finalized',
+    'save': 'complete'
+}
+
+# Workflow ID for threads started by a task, which don't see Celery's current task
+_workflow_id = contextvars.ContextVar('workflow_id', default=None)
+
+########## HELPER FUNCTIONS ##########
+
+def _progress_key(workflow_id):
+    return f"agate:progress:{workflow_id}"
+
+def _workflow_key(task_id):
+    return f"agate:workflow:{task_id}"
+
+def _events_channel(workflow_id):
+    return f"agate:events:{workflow_id}"
+
+def current_workflow_id():
+    """
+    Returns the ID of the workflow the running task belongs to: its root task
+    ID, which every task in a chain (and the fused task) shares.
+    """
+    request = current_task.request if current_task else None
+    if not request or not request.id:
+        return _workflow_id.get()
+    return request.root_id or request.id
+
+def set_workflow_id(workflow_id):
+    """
+    Sets the workflow that stages run on this thread belong to, for threads a
+    task starts to run stages on.
+    """
+    _workflow_id.set(workflow_id)
+
+########## WORKFLOWS ##########
+
+def register_workflow(submitted):
+    """
+    Remembers a submitted workflow (its root ID and output filename) under its
+    task ID, which is what clients are given to poll.
+    """
+    try:
+        get_redis_client().set(_workflow_key(submitted['task_id']), json.dumps(submitted), ex=PROGRESS_TTL)
+    except redis.RedisError as e:
+        logging.warning(f"Could not register workflow {submitted['task_id']}: {str(e)}")
+
+def get_workflow(task_id):
+    """
+    Returns a submitted workflow by task ID, or None if it is unknown.
+    """
+    value = get_redis_client().get(_workflow_key(task_id))
+    return json.loads(value) if value else None
+
+########## PROGRESS ##########
+
+def record_stage_progress(stage, state, payload=None):
+    """
+    Records that a stage of the current workflow started ("running") or
+    finished ("success" or "error"), and publishes it to the workflow's event
+    stream. Milestone events carry the locations found so far. Does nothing
+    outside a workflow.
+    """
+    workflow_id = current_workflow_id()
+    if not workflow_id:
+        return
+
+    updated_at = round(time.time(), 3)
+    event = {"stage": stage, "state": state, "updated_at": updated_at}
+    progress = {f"stage:{stage}": state, "current": stage, "updated_at": updated_at}
+
+    if state == 'success' and stage in MILESTONES:
+        event['event'] = MILESTONES[stage]
+        locations = payload.get('locations') if isinstance(payload, dict) else None
+        if isinstance(locations, list):
+            event['locations'] = locations
+            progress['locations'] = json.dumps(locations, default=str)
+
+    key = _progress_key(workflow_id)
+    try:
+        pipe = get_redis_client().pipeline(transaction=False)
+        pipe.hset(key, mapping=progress)
+        pipe.expire(key, PROGRESS_TTL)
+        pipe.publish(_events_channel(workflow_id), json.dumps(event, default=str))
+        pipe.execute()
+    except redis.RedisError as e:
+        logging.warning(f"Could not record progress for {stage}: {str(e)}")
+
+def get_progress(workflow_id):
+    """
+    Returns a workflow's progress: the stage it was last at, when, the state
+    of every stage it has reached and the latest locations found.
+
+    Returns:
+        dict: {"current": ..., "updated_at": ..., "stages": {stage: state},
+        "locations": [...]}, or None if no stage has started
+    """
+    values = get_redis_client().hgetall(_progress_key(workflow_id))
+    if not values:
+        return None
+
+    values = {k.decode(): v.decode() for k, v in values.items()}
+    return {
+        "current": values.get('current'),
+        "updated_at": float(values['updated_at']) if 'updated_at' in values else None,
+        "stages": {k.split(':', 1)[1]: v for k, v in values.items() if k.startswith('stage:')},
+        "locations": json.loads(values['locations']) if 'locations' in values else None
+    }
+
+def subscribe(workflow_id):
+    """
+    Subscribes to a workflow's event stream.
+
+    Returns:
+        redis.client.PubSub: Subscription whose messages are JSON events
+    """
+    pubsub = get_redis_client().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(_events_channel(workflow_id))
+    return pubsub
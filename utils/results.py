@@ -0,0 +1,35 @@
+import hashlib, logging
+import redis
+from utils.cache import get_redis_client
+from conf.settings import RESULT_CACHE_TTL
+
+########## RESULTS ##########
+
+def _result_key(output_filename):
+    return f"agate:result:{output_filename}"
+
+def result_etag(data):
+    """
+    Returns an entity tag for a result's JSON.
+    """
+    return hashlib.sha256(data.encode()).hexdigest()[:32]
+
+def save_result(output_filename, data):
+    """
+    Caches an article's finished JSON output.
+    """
+    try:
+        get_redis_client().set(_result_key(output_filename), data.encode(), ex=RESULT_CACHE_TTL)
+    except redis.RedisError as e:
+        logging.warning(f"Could not cache result {output_filename}: {str(e)}")
+
+def get_result(output_filename):
+    """
+    Returns an article's cached JSON output, or None if it isn't cached.
+    """
+    try:
+        value = get_redis_client().get(_result_key(output_filename))
+    except redis.RedisError as e:
+        logging.warning(f"Could not read cached result {output_filename}: {str(e)}")
+        return None
+    return value.decode() if value is not None else None
@@ -1,8 +1,8 @@
-import requests
 from bs4 import BeautifulSoup
 import logging
 import urllib.parse
 from conf.settings import SCRAPER_API_KEY
+from utils import sessions
 from utils.scrapers.strib import StarTribuneArticle
 from utils.scrapers.philly import PhillyInquirerArticle
 from fake_useragent import UserAgent
@@ -86,7 +86,8 @@ def _get_with_proxy(url):
                 logging.info(f"Using ScraperAPI to fetch URL: {url}")
                 
                 # Make the request with params
-                response = requests.get(
+                response = sessions.get(
+                    'scraperapi',
                     'https://api.scraperapi.com/',
                     params=payload,
                     headers=HEADERS,
@@ -105,7 +106,7 @@ def _get_with_proxy(url):
         # If ScraperAPI failed or no key, try direct request
         logging.warning(f"Trying direct request for URL: {url}")
         try:
-            response = requests.get(url, headers=HEADERS, timeout=30)
+            response = sessions.get('articles', url, headers=HEADERS, timeout=30)
             if response.status_code == 200:
                 logging.info(f"Successfully fetched URL directly: {url}")
                 return BeautifulSoup(response.text, "html.parser")
@@ -133,7 +134,7 @@ def _get_with_requests(url):
         'Connection': 'keep-alive',
     }
     logging.info(f"Using requests to fetch URL: {url}")
-    response = requests.get(url, headers=headers, timeout=10)
+    response = sessions.get('articles', url, headers=headers, timeout=10)
     response.raise_for_status()
     logging.info(f"Successfully fetched URL with requests: {url}")
     return BeautifulSoup(response.text, "html.parser")
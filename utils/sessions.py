@@ -0,0 +1,123 @@
+import os, threading, time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from conf.settings import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_POOL_SIZE
+from utils.metrics import record_external_call
+
+########## UPSTREAMS ##########
+
+# Timeout and retry policy for each upstream service we call. Retries use
+# exponential backoff (backoff * 2^n seconds) and honor Retry-After headers.
+UPSTREAMS = {
+    'geocode_earth': {
+        'read_timeout': 10,
+        'retries': 3,
+        'backoff': 0.5,
+        'status_forcelist': (429, 500, 502, 503, 504)
+    },
+    'scraperapi': {
+        # ScraperAPI can legitimately take up to a minute, so don't retry reads
+        'read_timeout': 60,
+        'retries': 1,
+        'read_retries': 0,
+        'backoff': 2,
+        'status_forcelist': (500, 502, 503, 504)
+    },
+    'articles': {
+        'read_timeout': 30,
+        'retries': 1,
+        'backoff': 1,
+        'status_forcelist': (502, 503, 504)
+    },
+    'context_api': {
+        'read_timeout': 10,
+        'retries': 3,
+        'backoff': 0.5,
+        'status_forcelist': (429, 500, 502, 503, 504)
+    },
+    'slack': {
+        # Webhook posts aren't idempotent, so only retry failed connections
+        'read_timeout': 10,
+        'retries': 2,
+        'read_retries': 0,
+        'backoff': 1,
+        'status_forcelist': ()
+    }
+}
+
+########## SESSIONS ##########
+
+_sessions = {}
+_lock = threading.Lock()
+
+def _build_session(upstream):
+    """
+    Builds a pooled keep-alive session with the upstream's retry policy mounted.
+    """
+    policy = UPSTREAMS[upstream]
+
+    retry = Retry(
+        total=policy.get('retries', 0),
+        read=policy.get('read_retries'),
+        backoff_factor=policy.get('backoff', 0),
+        status_forcelist=policy.get('status_forcelist', ()),
+        allowed_methods=None,
+        raise_on_status=False,
+        respect_retry_after_header=True
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_SIZE,
+        pool_maxsize=HTTP_POOL_SIZE,
+        max_retries=retry
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_session(upstream):
+    """
+    Returns the shared session for an upstream, creating it on first use.
+
+    Sessions are created once per worker process (Celery forks after import, so
+    they are keyed on the process ID) and shared by all of its threads.
+    """
+    key = (os.getpid(), upstream)
+    session = _sessions.get(key)
+    if session is None:
+        with _lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _build_session(upstream)
+                _sessions[key] = session
+    return session
+
+def request(upstream, method, url, timeout=None, **kwargs):
+    """
+    Makes a request through an upstream's pooled session, applying its
+    connect/read timeouts unless a timeout is passed explicitly.
+    """
+    if timeout is None:
+        timeout = (
+            HTTP_CONNECT_TIMEOUT,
+            UPSTREAMS[upstream].get('read_timeout', HTTP_READ_TIMEOUT)
+        )
+    started_at = time.time()
+    try:
+        return get_session(upstream).request(method, url, timeout=timeout, **kwargs)
+    finally:
+        record_external_call(upstream, time.time() - started_at)
+
+def get(upstream, url, **kwargs):
+    """
+    GET through an upstream's pooled session.
+    """
+    return request(upstream, 'GET', url, **kwargs)
+
+def post(upstream, url, **kwargs):
+    """
+    POST through an upstream's pooled session.
+    """
+    return request(upstream, 'POST', url, **kwargs)
@@ -1,5 +1,6 @@
-import requests, json, logging, sys
+import json, logging, sys
 from conf.settings import SLACK_LOG_WEBHOOK_URL
+from utils import sessions
 
 logging.basicConfig(level=logging.INFO)
 
@@ -120,7 +121,7 @@ def post_slack_log_message(message, context, message_type):
 
     try: # Post to Slack, fail silently with logging
         print(json.dumps(payload))
-        response = requests.post(SLACK_LOG_WEBHOOK_URL, 
+        response = sessions.post('slack', SLACK_LOG_WEBHOOK_URL,
             data=json.dumps(payload),
             headers=headers)
 
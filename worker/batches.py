@@ -0,0 +1,109 @@
+import json, logging, time, uuid
+from collections import Counter
+from utils.cache import get_redis_client
+from worker.workflows import celery, submit_locations
+from conf.settings import BATCH_TTL, BATCH_PRIORITY
+
+# Task states that won't change again
+FINISHED_STATES = ('SUCCESS', 'FAILURE', 'REVOKED')
+
+########## HELPER FUNCTIONS ##########
+
+def _batch_key(batch_id):
+    return f"agate:batch:{batch_id}"
+
+def _get_task_states(task_ids, chunk_size=500):
+    """
+    Reads the states of many tasks from the result backend, a chunk of keys
+    per round trip rather than one request per task.
+    """
+    backend = celery.backend
+    states = {}
+    for i in range(0, len(task_ids), chunk_size):
+        chunk = task_ids[i:i + chunk_size]
+        values = backend.mget([backend.get_key_for_task(task_id) for task_id in chunk])
+        for task_id, value in zip(chunk, values):
+            states[task_id] = backend.decode_result(value)['status'] if value else 'PENDING'
+    return states
+
+########## BATCHES ##########
+
+def submit_batch(urls, mode=None, priority=None):
+    """
+    Submits the locations workflow for many (normalized) URLs, publishing every
+    message over one broker connection, and records the batch so its progress
+    can be polled.
+
+    Args:
+        urls (list): Normalized article URLs. Duplicates are submitted once.
+        mode (str): Pipeline mode, see submit_locations
+        priority (str): Request priority, defaults to BATCH_PRIORITY
+
+    Returns:
+        dict: The batch ID and, for each URL, its task IDs and output filename
+        (or the error that kept it from being submitted)
+    """
+    batch_id = uuid.uuid4().hex
+    priority = priority or BATCH_PRIORITY
+    items = []
+
+    with celery.producer_or_acquire() as producer:
+        for url in dict.fromkeys(urls):
+            try:
+                submitted = submit_locations(url, mode, producer=producer, priority=priority)
+                items.append({
+                    "url": url,
+                    "task_id": submitted["task_id"],
+                    "root_id": submitted["root_id"],
+                    "output_filename": submitted["output_filename"],
+                    "deduplicated": submitted["deduplicated"]
+                })
+            except Exception as e:
+                logging.error(f"Error submitting {url} in batch {batch_id}: {str(e)}")
+                items.append({"url": url, "error": str(e)})
+
+    batch = {
+        "batch_id": batch_id,
+        "created_at": round(time.time(), 3),
+        "mode": mode,
+        "priority": priority,
+        "items": items
+    }
+    get_redis_client().set(_batch_key(batch_id), json.dumps(batch), ex=BATCH_TTL)
+
+    logging.info(f"BATCH SUBMITTED: {batch_id} with {len(items)} URLs")
+    return batch
+
+def get_batch_status(batch_id, include_items=True):
+    """
+    Returns a batch's progress: a count of its tasks in each state and, unless
+    include_items is False, each URL's state.
+
+    Returns:
+        dict: Batch status, or None if the batch is unknown or has expired
+    """
+    value = get_redis_client().get(_batch_key(batch_id))
+    if value is None:
+        return None
+    batch = json.loads(value)
+
+    items = batch['items']
+    states = _get_task_states([item['task_id'] for item in items if item.get('task_id')])
+    for item in items:
+        item['state'] = states.get(item.get('task_id'), 'NOT_SUBMITTED')
+
+    counts = Counter(item['state'] for item in items)
+    finished = sum(counts[state] for state in FINISHED_STATES) + counts['NOT_SUBMITTED']
+
+    status = {
+        "batch_id": batch_id,
+        "created_at": batch['created_at'],
+        "mode": batch.get('mode'),
+        "total": len(items),
+        "finished": finished,
+        "complete": finished == len(items),
+        "states": dict(counts)
+    }
+    if include_items:
+        status['items'] = items
+    return status
@@ -0,0 +1,51 @@
+import logging, sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils.metrics import render_prometheus
+from conf.settings import METRICS_EXPORTER_PORT
+
+# Configure logging to output to stdout
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(message)s',
+    stream=sys.stdout
+)
+
+########## EXPORTER ##########
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serves the pipeline's metrics at /metrics. Workers record everything in
+    Redis, so one exporter per deployment (or one sidecar per worker) sees
+    the whole fleet, including queue depth for autoscaling.
+    """
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        try:
+            body = render_prometheus().encode()
+        except Exception as e:
+            logging.error(f"Error rendering metrics: {str(e)}")
+            self.send_response(500)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are frequent; keep them out of the logs
+        pass
+
+def serve(port=METRICS_EXPORTER_PORT):
+    logging.info(f"Serving worker metrics on :{port}/metrics")
+    ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler).serve_forever()
+
+if __name__ == "__main__":
+    serve()
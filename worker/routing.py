@@ -0,0 +1,93 @@
+from celery.canvas import Signature
+from utils.cache import PRIORITY_STEPS, PRIORITY_SEP
+from conf.settings import (
+    CELERY_QUEUE_NAME, CELERY_ROUTING_ENABLED, CELERY_SCRAPE_QUEUE, CELERY_LLM_QUEUE,
+    CELERY_GEOCODE_QUEUE, CELERY_IO_QUEUE, PRIORITIES, BACKFILL_QUEUES_ENABLED, BACKFILL_QUEUE_SUFFIX,
+    WORKER_PREFETCH_MULTIPLIER
+)
+
+# Queue for each task, by the resource that bounds it. Quick bookkeeping tasks
+# share the I/O queue; the fused pipeline task stays on the default queue.
+TASK_QUEUES = {
+    'scrape_article': CELERY_SCRAPE_QUEUE,
+
+    'classify_article': CELERY_LLM_QUEUE,
+    'extract_locations': CELERY_LLM_QUEUE,
+    'extract_locations_review': CELERY_LLM_QUEUE,
+    'classify_locations': CELERY_LLM_QUEUE,
+    'prep_locations': CELERY_LLM_QUEUE,
+    'validate_locations': CELERY_LLM_QUEUE,
+    'review_locations': CELERY_LLM_QUEUE,
+
+    'geocode_locations': CELERY_GEOCODE_QUEUE,
+
+    'localize_locations': CELERY_IO_QUEUE,
+    'save_to_azure': CELERY_IO_QUEUE,
+    'merge_payloads': CELERY_IO_QUEUE,
+    'consolidate_locations': CELERY_IO_QUEUE,
+    'consolidate_geocoded_locations': CELERY_IO_QUEUE,
+    'finalize_locations': CELERY_IO_QUEUE,
+    'process_locations': CELERY_IO_QUEUE
+}
+
+def get_queue(task_name, priority=None):
+    """
+    Returns the queue a task is sent to at a request priority: its routed
+    queue, or that queue's backfill copy for backfill.
+    """
+    queue = TASK_QUEUES.get(task_name, CELERY_QUEUE_NAME) if CELERY_ROUTING_ENABLED else CELERY_QUEUE_NAME
+    if priority == 'backfill' and BACKFILL_QUEUES_ENABLED:
+        queue = f"{queue}{BACKFILL_QUEUE_SUFFIX}"
+    return queue
+
+def task_options(task_name, priority):
+    """
+    Returns the apply_async options that send a task at a request priority.
+    """
+    return {"priority": PRIORITIES[priority], "queue": get_queue(task_name, priority)}
+
+def apply_priority(signature, priority):
+    """
+    Sets a request priority on every task in a canvas (chains, groups and
+    chords included), so each stage is sent at it and not just the first.
+
+    Returns:
+        The same signature
+    """
+    if signature.subtask_type in ('chain', 'group', 'chord'):
+        # A chord's header may be a group or a list of tasks
+        tasks = signature.tasks
+        for task in ([tasks] if isinstance(tasks, Signature) else tasks):
+            apply_priority(task, priority)
+        if signature.subtask_type == 'chord':
+            apply_priority(signature.body, priority)
+    else:
+        signature.set(**task_options(signature.task, priority))
+    return signature
+
+def configure_routing(app):
+    """
+    Applies the pipeline's task routes to a Celery app. Routes have to be set
+    on every app that sends tasks, since a task is routed by the app it was
+    defined on. Tasks sent by a task (e.g. chord callbacks and retries) keep
+    its message priority.
+
+    Workers consume their queues in the order given to -Q rather than round
+    robin, so a worker on a queue and its backfill copy only takes backfill
+    when the queue is empty. The priority steps and separator are pinned to
+    the ones queue_length() counts.
+    """
+    app.conf.update(
+        task_default_queue=CELERY_QUEUE_NAME,
+        task_routes={
+            name: {'queue': queue} for name, queue in TASK_QUEUES.items()
+        } if CELERY_ROUTING_ENABLED else {},
+        task_inherit_parent_priority=True,
+        worker_prefetch_multiplier=WORKER_PREFETCH_MULTIPLIER,
+        broker_transport_options={
+            'queue_order_strategy': 'priority',
+            'priority_steps': PRIORITY_STEPS,
+            'sep': PRIORITY_SEP
+        }
+    )
+    return app
@@ -0,0 +1,93 @@
+import threading
+import orjson
+import zstandard
+from kombu.serialization import register
+from worker.routing import configure_routing
+from conf.settings import CELERY_SERIALIZER, CELERY_ACCEPT_CONTENT, CELERY_COMPRESSION_THRESHOLD, CELERY_ZSTD_LEVEL
+
+SERIALIZER_NAME = 'orjson_zstd'
+CONTENT_TYPE = 'application/x-orjson-zstd'
+
+# First byte of every encoded message says whether the rest is compressed
+RAW = b'\x00'
+ZSTD = b'\x01'
+
+# zstd contexts aren't safe to share between threads
+_local = threading.local()
+
+########## HELPER FUNCTIONS ##########
+
+def _compressor():
+    if not hasattr(_local, 'compressor'):
+        _local.compressor = zstandard.ZstdCompressor(level=CELERY_ZSTD_LEVEL)
+    return _local.compressor
+
+def _decompressor():
+    if not hasattr(_local, 'decompressor'):
+        _local.decompressor = zstandard.ZstdDecompressor()
+    return _local.decompressor
+
+def _default(obj):
+    # Types orjson doesn't handle natively but kombu's json serializer does
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8')
+    return str(obj)
+
+########## SERIALIZER ##########
+
+def encode(obj):
+    """
+    Encodes a message body with orjson, compressing it with zstd once it
+    reaches CELERY_COMPRESSION_THRESHOLD bytes.
+    """
+    data = orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    if len(data) >= CELERY_COMPRESSION_THRESHOLD:
+        return ZSTD + _compressor().compress(data)
+    return RAW + data
+
+def decode(data):
+    """
+    Decodes a message body produced by encode().
+    """
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    data = bytes(data)
+
+    marker, body = data[:1], data[1:]
+    if marker == ZSTD:
+        body = _decompressor().decompress(body)
+    elif marker != RAW:
+        raise ValueError(f"Unknown {SERIALIZER_NAME} marker: {marker!r}")
+    return orjson.loads(body)
+
+def register_serializers():
+    """
+    Registers the orjson/zstd serializer with kombu. Safe to call repeatedly.
+    """
+    register(
+        SERIALIZER_NAME,
+        encode,
+        decode,
+        content_type=CONTENT_TYPE,
+        content_encoding='binary'
+    )
+
+def configure_celery(app):
+    """
+    Applies the pipeline's serialization settings, and its task routes, to a
+    Celery app.
+
+    Every app accepts both json and orjson_zstd, so messages are readable by
+    workers on either side of a rollout. Deploy that first, then switch
+    CELERY_SERIALIZER to orjson_zstd once no worker only accepts json.
+    """
+    register_serializers()
+    app.conf.update(
+        task_serializer=CELERY_SERIALIZER,
+        result_serializer=CELERY_SERIALIZER,
+        accept_content=CELERY_ACCEPT_CONTENT,
+        result_accept_content=CELERY_ACCEPT_CONTENT
+    )
+    return configure_routing(app)
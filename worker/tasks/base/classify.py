@@ -1,16 +1,23 @@
-import logging, traceback, os, json
+import logging, traceback, os
 from utils.llm import get_json_openai
 from celery import Celery
+from worker.serializers import configure_celery
 from celery.exceptions import MaxRetriesExceededError
 from utils.slack import post_slack_log_message
+from utils.metrics import instrument_stage
+from utils.checkpoints import checkpoint_stage
+from utils.logs import log_payload
+from utils.payload_store import carry_fields
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-celery = Celery(__name__)
+celery = configure_celery(Celery(__name__))
 
 ########## CORE FUNCTION ##########
 
+@checkpoint_stage("classify")
+@instrument_stage("classify")
 def _classify_article(payload):
     """
     Core logic for classifying a story into a category.
@@ -25,7 +32,6 @@ def _classify_article(payload):
     Raises:
         Exception: If classification fails
     """
-    text = payload.get("text", "")
     headline = payload.get("headline", "")
     url = payload.get("url", "")
     
@@ -45,7 +51,6 @@ def _classify_article(payload):
     
     output = {
         "story_type": story_type,
-        "text": text,
         "headline": headline,
         "url": url,
         "author": payload.get("author", ""),
@@ -53,7 +58,10 @@ def _classify_article(payload):
         "output_filename": payload.get("output_filename")
     }
 
-    logging.info(f"Classification output: {json.dumps(output, indent=2)}")
+    # Carry the article text (or its payload store handle) forward
+    carry_fields(payload, output)
+
+    log_payload("Classification output", output)
     return output
 
 ########## TASKS ##########
@@ -0,0 +1,57 @@
+import logging, traceback
+from celery import Celery
+from worker.serializers import configure_celery
+from utils.slack import post_slack_log_message
+from utils.metrics import merge_timings
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+celery = configure_celery(Celery(__name__))
+
+########## CORE FUNCTION ##########
+
+def _merge_payloads(payloads):
+    """
+    Merges the payloads of branches that ran in parallel from the same article,
+    e.g. article classification and location extraction.
+
+    The first payload is the base. Fields it lacks (like story_type) are taken
+    from the others, and their _timings are combined. Branches that gave up
+    (returning an error status instead of a payload) contribute nothing.
+
+    Args:
+        payloads (list): Branch outputs, in group order
+
+    Returns:
+        dict: Merged payload
+    """
+    branches = [p for p in payloads if isinstance(p, dict) and p.get('status') != 'error']
+    if not branches:
+        raise ValueError("No branch produced a payload")
+
+    merged = dict(branches[0])
+    for branch in branches[1:]:
+        for key, value in branch.items():
+            if key != '_timings' and key not in merged:
+                merged[key] = value
+
+    merged['_timings'] = merge_timings(*(b.get('_timings') for b in branches))
+    return merged
+
+########## TASKS ##########
+
+@celery.task(name="merge_payloads")
+def _merge_payloads_task(payloads):
+    """
+    Celery task that joins parallel branches back into one payload.
+    """
+    try:
+        return _merge_payloads(payloads)
+    except Exception as e:
+        logging.error(f"Error merging payloads: {str(e)}")
+        post_slack_log_message('Error merging payloads', {
+            'error_message': str(e.args[0]),
+            'traceback': traceback.format_exc()
+        }, 'create_error')
+        raise
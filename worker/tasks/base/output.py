@@ -1,12 +1,19 @@
 import os, logging, json, traceback
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import ResourceNotFoundError
 from azure.storage.blob import BlobServiceClient
 from celery import Celery
+from worker.serializers import configure_celery
 from celery.exceptions import MaxRetriesExceededError
 from utils.slack import post_slack_log_message
+from utils.metrics import instrument_stage, record_external_call, record_workflow_duration
+from utils.logs import log_payload
+from utils.payload_store import resolve_fields
+from utils.inflight import mark_processed, release
+from utils.results import save_result
 from conf.settings import AZURE_STORAGE_CONNECTION_STRING, AZURE_STORAGE_CONTAINER_NAME, AZURE_STORAGE_ACCOUNT_NAME
 
-celery = Celery(__name__)
+celery = configure_celery(Celery(__name__))
 
 def get_azure_client():
     """
@@ -26,69 +33,109 @@ def get_azure_client():
         logging.error(f"Error initializing Azure client: {str(e)}")
         return None
 
-########### TASKS ##########
+def load_output(output_filename):
+    """
+    Reads an article's saved output back from Azure Blob Storage.
 
-@celery.task(name="save_to_azure", bind=True, max_retries=3)
-def _save_to_azure(self, payload):
+    Returns:
+        str: The output JSON, or None if Azure isn't configured or the blob
+        doesn't exist
+    """
+    azure_client = get_azure_client()
+    if not azure_client or not AZURE_STORAGE_CONTAINER_NAME:
+        return None
+
+    blob_client = azure_client.get_container_client(AZURE_STORAGE_CONTAINER_NAME).get_blob_client(output_filename)
+    try:
+        record_external_call('azure_blob')
+        return blob_client.download_blob().readall().decode('utf-8')
+    except ResourceNotFoundError:
+        return None
+
+########### CORE FUNCTION ##########
+
+@instrument_stage("save")
+def _save_output(payload):
     """
     Saves the payload to Azure Blob Storage if credentials are configured.
     If Azure credentials are not set or invalid, logs the output locally.
+
+    Raises:
+        Exception: If the upload fails
     """
-    try:
-        logging.info('Saving output:')
-        logging.info(json.dumps(payload, indent=2))
+    # Saved output carries the full text, not payload store handles
+    payload = resolve_fields(payload)
+    log_payload("Saving output", payload)
+
+    # Convert payload to JSON string, and cache it for the result endpoint
+    json_data = json.dumps(payload, indent=2)
+    if payload.get('output_filename'):
+        save_result(payload['output_filename'], json_data)
+
+    # Get Azure client
+    azure_client = get_azure_client()
 
-        # Get Azure client
-        azure_client = get_azure_client()
+    # Check if Azure is properly configured
+    if not azure_client or not AZURE_STORAGE_CONTAINER_NAME or not AZURE_STORAGE_ACCOUNT_NAME:
+        logging.info("Azure storage not properly configured. Skipping blob storage upload.")
+        # Without Azure the log is the only output, so keep it whole
+        log_payload("Final payload", payload, level=logging.INFO, truncate=False, sample_rate=1)
+        mark_processed(payload.get('output_filename'))
+        record_workflow_duration()
+        return
 
-        # Check if Azure is properly configured
-        if not azure_client or not AZURE_STORAGE_CONTAINER_NAME or not AZURE_STORAGE_ACCOUNT_NAME:
-            logging.info("Azure storage not properly configured. Skipping blob storage upload.")
-            logging.info("Final payload:")
-            logging.info(json.dumps(payload, indent=2))
-            return
+    # Get container client
+    container_client = azure_client.get_container_client(
+        AZURE_STORAGE_CONTAINER_NAME)
+    
+    # Get output filename from payload
+    blob_name = payload.get('output_filename')
+    logging.info(f"Container name: {AZURE_STORAGE_CONTAINER_NAME}, Blob name: {blob_name}")
+    
+    if not blob_name:
+        raise ValueError("Missing output_filename in payload")
+    
+    # Upload to blob storage
+    blob_client = container_client.get_blob_client(blob_name)
+    record_external_call('azure_blob')
+    blob_client.upload_blob(
+        json_data, 
+        overwrite=True,
+        content_type='application/json'
+    )
+    
+    # Construct the blob URL
+    storage_account = AZURE_STORAGE_ACCOUNT_NAME
+    container_name = AZURE_STORAGE_CONTAINER_NAME
+    blob_url = f"https://{storage_account}.blob.core.windows.net/{container_name}/{blob_name}"
+    
+    logging.info(f"Successfully saved payload to blob: {blob_name}")
+    mark_processed(blob_name, blob_url)
+    record_workflow_duration()
+    post_slack_log_message(f"Successfully processed locations!", {
+        'agate_update_msg': "View the payload below:",
+        'storage_url': blob_url,
+        'headline': payload.get('headline', ''),
+        'article_url': payload.get('url', '')
+    }, 'create_success')
 
-        # Get task ID and URL from the request
-        task_id = self.request.id
+    return payload
+
+########### TASKS ##########
+
+@celery.task(name="save_to_azure", bind=True, max_retries=3)
+def _save_to_azure(self, payload):
+    """
+    Celery task wrapper for saving the output.
+    Handles retries and error reporting.
+    """
+    try:
         url = payload.get('url')
-        
+
         try:
-            # Get container client
-            container_client = azure_client.get_container_client(
-                AZURE_STORAGE_CONTAINER_NAME)
-            
-            # Get output filename from payload
-            blob_name = payload.get('output_filename')
-            logging.info(f"Container name: {AZURE_STORAGE_CONTAINER_NAME}, Blob name: {blob_name}")
-            
-            if not blob_name:
-                raise ValueError("Missing output_filename in payload")
-                          
-            # Convert payload to JSON string
-            json_data = json.dumps(payload, indent=2)
-            
-            # Upload to blob storage
-            blob_client = container_client.get_blob_client(blob_name)
-            blob_client.upload_blob(
-                json_data, 
-                overwrite=True,
-                content_type='application/json'
-            )
-            
-            # Construct the blob URL
-            storage_account = AZURE_STORAGE_ACCOUNT_NAME
-            container_name = AZURE_STORAGE_CONTAINER_NAME
-            blob_url = f"https://{storage_account}.blob.core.windows.net/{container_name}/{blob_name}"
-            
-            logging.info(f"Successfully saved payload to blob: {blob_name}")
-            post_slack_log_message(f"Successfully processed locations!", {
-                'agate_update_msg': "View the payload below:",
-                'storage_url': blob_url,
-                'headline': payload.get('headline', ''),
-                'article_url': payload.get('url', '')
-            }, 'create_success')
-
-            return payload
+            output = _save_output(payload)
+            release(payload.get('output_filename'), self.request.id)
+            return output
             
         except Exception as e:
             # Calculate backoff time: 2^retry_count seconds
@@ -102,6 +149,7 @@ def _save_to_azure(self, payload):
             'error_message':  str(e.args[0]),
             'traceback':  traceback.format_exc()
         }, 'create_error')
+        release(payload.get('output_filename'), self.request.id)
         return payload
         
     except Exception as e:
@@ -110,4 +158,5 @@ def _save_to_azure(self, payload):
             'error_message':  str(e.args[0]),
             'traceback':  traceback.format_exc()
         }, 'create_error')
+        release(payload.get('output_filename'), self.request.id)
         return payload
\ No newline at end of file
@@ -1,16 +1,52 @@
 import logging, traceback
 from utils.scrape import scrape
 from celery import Celery
-from celery.exceptions import MaxRetriesExceededError
+from worker.serializers import configure_celery
 from utils.slack import post_slack_log_message
+from utils.metrics import instrument_stage
+from utils.checkpoints import checkpoint_stage
+from utils.payload_store import store_fields
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-celery = Celery(__name__)
+celery = configure_celery(Celery(__name__))
 
 ########## CORE FUNCTION ##########
 
+def _prepare_article(article, output_filename):
+    """
+    Builds the payload the rest of the pipeline starts from, out of a scraped
+    article or one whose content was submitted directly.
+
+    Args:
+        article (dict): headline and text, and optionally url, author and pub_date
+        output_filename (str): Name of output file
+
+    Returns:
+        dict: Dictionary containing article content and metadata
+
+    Raises:
+        ValueError: If the headline or text is missing
+    """
+    text = article.get("text") or ""
+    headline = article.get("headline") or ""
+
+    if not text or not headline:
+        raise ValueError(f"Failed to extract content: text={bool(text)}, headline={bool(headline)}")
+
+    # Store the text once and pass a handle, rather than copying it through every task
+    return store_fields({
+        "author": article.get("author") or "",
+        "pub_date": article.get("pub_date") or "",
+        "headline": headline,
+        "text": text,
+        "url": article.get("url") or "",
+        "output_filename": output_filename
+    })
+
+@checkpoint_stage("scrape")
+@instrument_stage("scrape")
 def _scrape_article(url, output_filename):
     """
     Core logic for scraping article from URL.
@@ -35,23 +71,9 @@ def _scrape_article(url, output_filename):
     if not article:
         raise Exception("Failed to scrape article: returned None")
         
-    # Extract text and headline
-    text = article.get("text", "")
-    headline = article.get("headline", "")
+    logging.info(f"Extracted content - headline: '{article.get('headline', '')}', text length: {len(article.get('text') or '')}")
     
-    logging.info(f"Extracted content - headline: '{headline}', text length: {len(text)}")
-    
-    if not text or not headline:
-        raise Exception(f"Failed to extract content: text={bool(text)}, headline={bool(headline)}")
-    
-    return {
-        "author": article.get("author", ""),
-        "pub_date": article.get("pub_date", ""),
-        "headline": headline,
-        "text": text,
-        "url": url,
-        "output_filename": output_filename
-    }
+    return _prepare_article({**article, "url": url}, output_filename)
 
 ########## TASKS ##########
 
@@ -68,30 +90,33 @@ def _scrape_article_task(self, url, output_filename):
     Returns:
         dict: Dictionary containing article content and metadata
     """
+    logging.info(f"Starting scrape task [Task ID: {self.request.id}] for URL: {url}")
+
     try:
-        logging.info(f"Starting scrape task [Task ID: {self.request.id}] for URL: {url}")
-        
-        try:
-            return _scrape_article(url, output_filename)
-            
-        except Exception as e:
-            # Calculate backoff time: 2^retry_count minutes
-            backoff = 60 * (2 ** self.request.retries)
-            logging.error(f"Error scraping article, retrying in {backoff} seconds. Error: {str(e)}")
-            logging.error(f"Error traceback: {traceback.format_exc()}")
-            
-            if not self.request.retries:  # Only post to Slack on first error
-                post_slack_log_message(f'Error scraping {url}', {
-                    'error_message': str(e.args[0]),
-                    'traceback': traceback.format_exc()
-                }, 'create_error')
-                
-            raise self.retry(exc=e, countdown=backoff)
-            
-    except MaxRetriesExceededError as e:
-        logging.error(f"Max retries exceeded for scraping article: {url}")
-        post_slack_log_message(f'Error scraping {url} (max retries exceeded)', {
-            'error_message': str(e.args[0]),
-            'traceback': traceback.format_exc()
-        }, 'create_error')
-        return {"status": "error", "error": f"Max retries exceeded: {url}"}
\ No newline at end of file
+        return _scrape_article(url, output_filename)
+
+    except Exception as e:
+        # retry() re-raises the scrape's own error once retries run out, so
+        # check for that here rather than catching MaxRetriesExceededError
+        if self.request.retries >= self.max_retries:
+            logging.error(f"Max retries exceeded for scraping article: {url}")
+            post_slack_log_message(f'Error scraping {url} (max retries exceeded)', {
+                'error_message': str(e.args[0]) if e.args else str(e),
+                'traceback': traceback.format_exc()
+            }, 'create_error')
+            # Nothing to carry on with, so fail the task (the workflow's
+            # errback releases the article's claim)
+            raise
+
+        # Calculate backoff time: 2^retry_count minutes
+        backoff = 60 * (2 ** self.request.retries)
+        logging.error(f"Error scraping article, retrying in {backoff} seconds. Error: {str(e)}")
+        logging.error(f"Error traceback: {traceback.format_exc()}")
+
+        if not self.request.retries:  # Only post to Slack on first error
+            post_slack_log_message(f'Error scraping {url}', {
+                'error_message': str(e.args[0]),
+                'traceback': traceback.format_exc()
+            }, 'create_error')
+
+        raise self.retry(exc=e, countdown=backoff)
\ No newline at end of file
@@ -1,16 +1,23 @@
-import logging, traceback, json, os
+import logging, traceback, os
 from utils.llm import get_json_openai
 from celery import Celery
+from worker.serializers import configure_celery
 from celery.exceptions import MaxRetriesExceededError
 from utils.slack import post_slack_log_message
+from utils.metrics import instrument_stage
+from utils.checkpoints import checkpoint_stage
+from utils.logs import log_payload
+from utils.payload_store import get_text
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-celery = Celery(__name__)
+celery = configure_celery(Celery(__name__))
 
 ########## HELPER FUNCTIONS ##########
 
+@checkpoint_stage("extract")
+@instrument_stage("extract")
 def _extract_locations(payload):
     """
     Core logic for extracting locations from a story using LLM.
@@ -25,7 +32,7 @@ def _extract_locations(payload):
     Raises:
         Exception: If location extraction fails
     """
-    text = payload.get('text')
+    text = get_text(payload)
     url = payload.get('url')
     
     if not text:
@@ -73,7 +80,7 @@ def _extract_locations(payload):
     
     # Preserve output_filename
     payload['output_filename'] = payload.get('output_filename')
-    logging.info("Extracted locations payload: %s" % json.dumps(payload, indent=2))
+    log_payload("Extracted locations payload", payload)
     return payload
 
 ########## TASKS ##########
@@ -1,7 +1,12 @@
-import logging, json, os, traceback
+import logging, os, traceback
 from celery import Celery
+from worker.serializers import configure_celery
 from utils.slack import post_slack_log_message
 from utils.llm import get_json_openai
+from utils.metrics import instrument_stage, record_external_call
+from utils.checkpoints import checkpoint_stage
+from utils.logs import log_payload
+from utils.payload_store import get_text
 from celery.exceptions import MaxRetriesExceededError
 from azure.core.credentials import AzureKeyCredential
 from azure.ai.textanalytics import TextAnalyticsClient
@@ -13,7 +18,7 @@ logging.basicConfig(level=logging.INFO)
 
 ########## CELERY INITIALIZATION ##########
 
-celery = Celery(__name__)
+celery = configure_celery(Celery(__name__))
 
 ########## AZURE NER INITIALIZATION ##########
 
@@ -57,6 +62,7 @@ def extract_locations(text, client=None):
         # Prepare document
         document = {"id": "1", "language": "en", "text": text}
         
+        record_external_call('azure_ner')
         result = client.recognize_entities(documents=[document])[0]
         
         # Filter for only Location entities
@@ -134,6 +140,8 @@ def process_text_ner(text):
     logging.info(f"Found {len(all_locations)} unique locations")
     return [location['text'] for location in all_locations]
 
+@checkpoint_stage("extract_review")
+@instrument_stage("extract_review")
 def _extract_locations_review(payload):
     """
     Core logic for reviewing extracted locations using LLM and conventional NER if available.
@@ -148,7 +156,7 @@ def _extract_locations_review(payload):
     Raises:
         Exception: If location review fails
     """
-    text = payload.get('text')
+    text = get_text(payload)
     url = payload.get('url')
     
     if not text:
@@ -224,7 +232,7 @@ def _extract_locations_review(payload):
     
     # Preserve output_filename
     payload['output_filename'] = payload.get('output_filename')
-    logging.info("Reviewed locations payload: %s" % json.dumps(payload, indent=2))
+    log_payload("Reviewed locations payload", payload)
     return payload
 
 ########## TASKS ##########
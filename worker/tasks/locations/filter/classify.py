@@ -1,16 +1,23 @@
-import logging, traceback, json, os
+import logging, traceback, os
 from utils.llm import get_json_openai
 from celery import Celery
+from worker.serializers import configure_celery
 from celery.exceptions import MaxRetriesExceededError
 from utils.slack import post_slack_log_message
+from utils.metrics import instrument_stage
+from utils.checkpoints import checkpoint_stage
+from utils.logs import log_payload
+from utils.payload_store import get_text
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-celery = Celery(__name__)
+celery = configure_celery(Celery(__name__))
 
 ########## HELPER FUNCTIONS ##########
 
+@checkpoint_stage("classify_locations")
+@instrument_stage("classify_locations")
 def _classify_locations(payload):
     """
     Core logic for classifying the relevance of locations to the story.
@@ -26,7 +33,7 @@ def _classify_locations(payload):
         Exception: If location classification fails
     """
     story_type = payload.get('story_type', {}).get('category')
-    text = payload.get('text')
+    text = get_text(payload)
     url = payload.get('url')
     
     if not text:
@@ -77,7 +84,7 @@ def _classify_locations(payload):
     
     # Preserve output_filename
     payload['output_filename'] = payload.get('output_filename')
-    logging.info("Classified location relevance payload: %s" % json.dumps(payload, indent=2))
+    log_payload("Classified location relevance payload", payload)
     return payload
 
 ########## TASKS ##########
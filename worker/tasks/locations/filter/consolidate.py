@@ -1,15 +1,21 @@
-import logging, traceback, json
+import logging, traceback
 from celery import Celery
+from worker.serializers import configure_celery
 from celery.exceptions import MaxRetriesExceededError
 from utils.slack import post_slack_log_message
+from utils.metrics import instrument_stage
+from utils.checkpoints import checkpoint_stage
+from utils.logs import log_payload
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-celery = Celery(__name__)
+celery = configure_celery(Celery(__name__))
 
 ########## HELPER FUNCTIONS ##########
 
+@checkpoint_stage("consolidate_locations")
+@instrument_stage("consolidate_locations")
 def _consolidate_locations(payload):
     """
     Core logic for filtering out non-relevant locations and cleaning up metadata.
@@ -43,7 +49,7 @@ def _consolidate_locations(payload):
             filtered_locations.append(clean_location)
     
     logging.info(f"Filtered {len(locations)} locations down to {len(filtered_locations)} relevant locations")
-    logging.info("Consolidated location payload: %s" % json.dumps(filtered_locations, indent=2))
+    log_payload("Consolidated location payload", filtered_locations)
     
     # Update payload with filtered locations
     payload['locations'] = filtered_locations
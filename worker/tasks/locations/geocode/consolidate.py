@@ -1,17 +1,22 @@
-import json
 import logging
 import traceback
 from celery import Celery
+from worker.serializers import configure_celery
 from celery.exceptions import MaxRetriesExceededError
 from utils.slack import post_slack_log_message
+from utils.metrics import instrument_stage
+from utils.checkpoints import checkpoint_stage
+from utils.logs import log_payload
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-celery = Celery(__name__)
+celery = configure_celery(Celery(__name__))
 
 ########## CORE FUNCTION ##########
 
+@checkpoint_stage("consolidate_geocodes")
+@instrument_stage("consolidate_geocodes")
 def _consolidate_geocoded_locations(payload):
     """
     Core logic for consolidating geocoded locations by removing invalid ones.
@@ -59,7 +64,7 @@ def _consolidate_geocoded_locations(payload):
     # Update the payload with filtered and cleaned locations
     payload['locations'] = validated_locations
     
-    logging.info("Consolidated locations payload: %s" % json.dumps(payload, indent=2))    
+    log_payload("Consolidated locations payload", payload)
     return payload
 
 ########## TASKS ##########
@@ -1,16 +1,108 @@
-import requests, json, logging, traceback, os
-from conf.settings import GEOCODE_EARTH_API_KEY, GEOCODIO_API_KEY
-from langchain_openai import ChatOpenAI
+import requests, json, logging, traceback, os, threading, contextvars
+from concurrent.futures import ThreadPoolExecutor
+from rapidfuzz import fuzz
+from conf.settings import GEOCODE_EARTH_API_KEY, GEOCODIO_API_KEY, GEOCODE_CONCURRENCY, GEOCODE_LLM_CONCURRENCY, \
+    GEOCODE_FAST_PATH_ENABLED, GEOCODE_FAST_PATH_MIN_SCORE, GEOCODE_FAST_PATH_MIN_SIMILARITY, GEOCODE_FAST_PATH_MARGIN
+from utils.llm import get_chat_model
 from langchain.prompts import ChatPromptTemplate
 from celery import Celery
+from worker.serializers import configure_celery
 from celery.exceptions import MaxRetriesExceededError
 from utils.slack import post_slack_log_message
-from utils.geocode import pelias_geocode_search, pelias_geocode_structured, geocodio_geocode
+from utils.geocode import pelias_geocode_search, pelias_geocode_structured, geocodio_geocode, get_geocode_cache_stats
+from utils.metrics import incr, get_counters, instrument_stage
+from utils.checkpoints import checkpoint_stage
+from utils.logs import log_payload
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-celery = Celery(__name__)
+celery = configure_celery(Celery(__name__))
+
+# Caps concurrent candidate checks against the LLM within one worker
+LLM_SEMAPHORE = threading.BoundedSemaphore(GEOCODE_LLM_CONCURRENCY)
+
+## Candidate ranking
+
+# How much each Pelias match type and accuracy level says about a candidate
+MATCH_TYPE_WEIGHTS = {
+    "exact": 1.0,
+    "interpolated": 0.7,
+    "fallback": 0.3
+}
+
+ACCURACY_WEIGHTS = {
+    "point": 1.0,
+    "centroid": 0.6
+}
+
+def _query_text(query):
+    """
+    Returns the text to compare candidate labels against. Structured queries are
+    passed around as JSON, so flatten them into an address string.
+    """
+    try:
+        components = json.loads(query)
+    except (TypeError, ValueError):
+        return query or ''
+    if isinstance(components, dict):
+        return ', '.join(str(v) for v in components.values() if v)
+    return query
+
+def _score_candidate(query, candidate):
+    """
+    Scores a candidate from 0 to 1 using the confidence fields Pelias returns and
+    the similarity of its label to the query.
+
+    Returns:
+        tuple: (score, similarity), where similarity is 0-100
+    """
+    confidence = candidate.get('confidence') or {}
+    boundaries = candidate.get('boundaries') or {}
+
+    similarity = fuzz.token_set_ratio(query.lower(), (candidate.get('label') or '').lower())
+
+    score = (
+        0.35 * (confidence.get('score') or 0) +
+        0.20 * MATCH_TYPE_WEIGHTS.get(confidence.get('match_type'), 0) +
+        0.10 * ACCURACY_WEIGHTS.get(confidence.get('accuracy'), 0) +
+        0.35 * similarity / 100
+    )
+
+    # A candidate that can't be placed in a state isn't a clear winner
+    if not (boundaries.get('state') or {}).get('name'):
+        score *= 0.5
+
+    return score, similarity
+
+def _select_clear_winner(query, candidates):
+    """
+    Deterministically picks a candidate when one clearly beats the others, so
+    the LLM only sees ambiguous cases. Thresholds are set in conf/settings.py.
+
+    Returns:
+        dict: The winning candidate, or None if the choice is ambiguous
+    """
+    query = _query_text(query)
+    if not query:
+        return None
+
+    scored = sorted(
+        ((_score_candidate(query, c), c) for c in candidates),
+        key=lambda x: x[0][0],
+        reverse=True
+    )
+    (best_score, best_similarity), best = scored[0]
+    runner_up_score = scored[1][0][0] if len(scored) > 1 else 0
+
+    logging.info(f"Best candidate {best.get('label')} scored {best_score:.3f} "
+                 f"(similarity {best_similarity:.0f}, runner-up {runner_up_score:.3f})")
+
+    if (best_score >= GEOCODE_FAST_PATH_MIN_SCORE and
+            best_similarity >= GEOCODE_FAST_PATH_MIN_SIMILARITY and
+            best_score - runner_up_score >= GEOCODE_FAST_PATH_MARGIN):
+        return best
+    return None
 
 ## Checking and validation
 
@@ -25,7 +117,18 @@ def check_candidates(original_text, original_context, candidates, max_retries=3)
     # If there's only one candidate, return it directly
     if len(candidates) == 1:
         logging.info("Single candidate found, returning directly")
+        incr("agate_geocode_candidates_total", route="single")
         return candidates[0]
+
+    # Accept a clear winner without asking the LLM
+    if GEOCODE_FAST_PATH_ENABLED:
+        winner = _select_clear_winner(original_text, candidates)
+        if winner:
+            logging.info("Clear winner among candidates, skipping LLM check")
+            incr("agate_geocode_candidates_total", route="fast_path")
+            return winner
+
+    incr("agate_geocode_candidates_total", route="llm")
         
     # Get the validation prompt
     try:
@@ -49,7 +152,7 @@ Your response (just the number or "none"):"""
         logging.error("Check candidates prompt not found")
         raise
         
-    llm = ChatOpenAI(model="gpt-4.1")
+    llm = get_chat_model("gpt-4.1")
     
     # Format candidates into a numbered list with relevant details
     formatted_candidates = "\n\n".join([
@@ -101,10 +204,84 @@ Your response (just the number or "none"):"""
 
 ########## CORE FUNCTION ##########
 
+def _geocode_location(item):
+    """
+    Geocodes a single prepared location in place.
+
+    Args:
+        item (dict): Location with a prepared geocode block
+    """
+    # Initialize geocode dict if it doesn't exist
+    if 'geocode' not in item:
+        item['geocode'] = {}
+        
+    geocode_type = item["geocode"].get("geocode")            
+    
+    if geocode_type == "search":
+        geocode_text = item["geocode"].get("text")
+        original_text = item.get("original_text", "")
+
+        logging.info(f"\nProcessing location (search):")
+        logging.info(f"Text to geocode: {geocode_text}")
+        logging.info(f"Original context: {original_text}")
+        
+        results = pelias_geocode_search(geocode_text)
+        
+    elif geocode_type == "structured":
+        address_obj = {
+            "address": item["geocode"].get("address"),
+            "locality": item["geocode"].get("locality"),
+            "county": item["geocode"].get("county"),
+            "region": item["geocode"].get("region"),
+            "postalcode": item["geocode"].get("postalcode")
+        }
+        original_text = item.get("original_text", "")
+        
+        results = pelias_geocode_structured(address_obj)
+
+    elif geocode_type == "geocodio":
+        geocode_text = item["geocode"].get("text")
+        original_text = item.get("original_text", "")
+
+        results = geocodio_geocode(geocode_text)
+    else:
+        item["geocode"]["results"] = {}
+        return
+
+    if results:
+        with LLM_SEMAPHORE:
+            best_match = check_candidates(
+                geocode_text if geocode_type in ["search", "geocodio"] else json.dumps(address_obj),
+                original_text,
+                results
+            )
+        if best_match:
+            item["geocode"]["results"] = best_match
+        else:
+            item["geocode"]["results"] = {}
+
+        # Further bespoke cleanup to results. For example, no neighborhoods for street_roads
+        if item["type"] == "street_road":
+            if "boundaries" in item["geocode"]["results"]:
+                item["geocode"]["results"]["boundaries"]["neighborhood"] = {
+                    "id": None,
+                    "name": None
+                }
+    else:
+        logging.info('no results')
+        item["geocode"]["results"] = {}
+        logging.warning("No geocoding results found")
+
+@checkpoint_stage("geocode")
+@instrument_stage("geocode")
 def _geocode_locations(payload):
     """
     Core logic for geocoding locations.
     This function can be called independently for testing or used by the Celery task.
+
+    Locations are geocoded concurrently on a bounded thread pool (GEOCODE_CONCURRENCY
+    threads; 1 geocodes serially). Each location is updated in place, so the output
+    keeps the input order.
     
     Args:
         payload (dict): Dictionary containing locations and metadata
@@ -121,69 +298,28 @@ def _geocode_locations(payload):
     if not locations:
         logging.info("No locations provided, skipping geocoding")
         return payload
-        
-    for item in locations:
-        # Initialize geocode dict if it doesn't exist
-        if 'geocode' not in item:
-            item['geocode'] = {}
-            
-        geocode_type = item["geocode"].get("geocode")            
-        
-        if geocode_type == "search":
-            geocode_text = item["geocode"].get("text")
-            original_text = item.get("original_text", "")
 
-            logging.info(f"\nProcessing location (search):")
-            logging.info(f"Text to geocode: {geocode_text}")
-            logging.info(f"Original context: {original_text}")
-            
-            results = pelias_geocode_search(geocode_text)
-            
-        elif geocode_type == "structured":
-            address_obj = {
-                "address": item["geocode"].get("address"),
-                "locality": item["geocode"].get("locality"),
-                "county": item["geocode"].get("county"),
-                "region": item["geocode"].get("region"),
-                "postalcode": item["geocode"].get("postalcode")
-            }
-            original_text = item.get("original_text", "")
-            
-            results = pelias_geocode_structured(address_obj)
-
-        elif geocode_type == "geocodio":
-            geocode_text = item["geocode"].get("text")
-            original_text = item.get("original_text", "")
+    max_workers = min(GEOCODE_CONCURRENCY, len(locations))
 
-            results = geocodio_geocode(geocode_text)
-        else:
-            item["geocode"]["results"] = {}
-            continue
-
-        if results:
-            best_match = check_candidates(
-                geocode_text if geocode_type in ["search", "geocodio"] else json.dumps(address_obj),
-                original_text,
-                results
-            )
-            if best_match:
-                item["geocode"]["results"] = best_match
-            else:
-                item["geocode"]["results"] = {}
-
-            # Further bespoke cleanup to results. For example, no neighborhoods for street_roads
-            if item["type"] == "street_road":
-                if "boundaries" in item["geocode"]["results"]:
-                    item["geocode"]["results"]["boundaries"]["neighborhood"] = {
-                        "id": None,
-                        "name": None
-                    }
-        else:
-            logging.info('no results')
-            item["geocode"]["results"] = {}
-            logging.warning("No geocoding results found")
+    if max_workers <= 1:
+        for item in locations:
+            _geocode_location(item)
+    else:
+        logging.info(f"Geocoding {len(locations)} locations with {max_workers} threads")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Copy the context into each thread so callbacks tied to the task
+            # (like token tracking) still see the calls made from the pool
+            futures = [
+                executor.submit(contextvars.copy_context().run, _geocode_location, item)
+                for item in locations
+            ]
+            # Surface the first failure so the task retries, as it would serially
+            for future in futures:
+                future.result()
 
-    logging.info("Geocoded locations payload: %s" % json.dumps(payload, indent=2))    
+    logging.info(f"Geocode cache stats: {get_geocode_cache_stats()}")
+    logging.info(f"Candidate selection counters: {get_counters('agate_geocode_candidates_total')}")
+    log_payload("Geocoded locations payload", payload)
     return payload
 
 ########## TASKS ##########
@@ -1,11 +1,15 @@
 import json, os, usaddress, logging, time, traceback
 import usaddress
 from celery import Celery
+from worker.serializers import configure_celery
 from celery.exceptions import MaxRetriesExceededError
-from langchain_openai import ChatOpenAI
+from utils.llm import get_chat_model
 from langchain.prompts import ChatPromptTemplate
 from conf.settings import GEOCODIO_API_KEY
 from utils.slack import post_slack_log_message
+from utils.metrics import instrument_stage
+from utils.checkpoints import checkpoint_stage
+from utils.logs import log_payload
 from utils.geocode import get_city_state
 from utils.search import search_duckduckgo
 
@@ -15,7 +19,7 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-celery = Celery(__name__)
+celery = configure_celery(Celery(__name__))
 
 ########## HELPER FUNCTIONS ##########
 
@@ -32,7 +36,7 @@ def _extract_best_address(query, search_results, max_retries=3):
     Returns:
         str: Best matching address or "No address found"
     """
-    llm = ChatOpenAI(model="gpt-4.1")
+    llm = get_chat_model("gpt-4.1")
     
     template = """Given the following search query and multiple search results, identify and return the single most accurate 
     physical address that best answers the query. Format the address in a standard US format.
@@ -86,7 +90,7 @@ def _check_if_addressable(location_str):
     Returns:
         bool: True if location is likely addressable, False otherwise
     """
-    llm = ChatOpenAI(model="gpt-4.1-mini")
+    llm = get_chat_model("gpt-4.1-mini")
     
     template = """You will be given a JSON object with details about a location and its context within a news story Determine if it is likely a building or landmark with a physical street address. 
 
@@ -130,7 +134,7 @@ def _parse_address(location_str):
     Returns:
         str: The physical address
     """
-    llm = ChatOpenAI(model="gpt-4.1-mini")
+    llm = get_chat_model("gpt-4.1-mini")
     
     template = """The following string contains a physical address, possibly including some additional text, such
     as the name of a place or a business. Extract and return only the physical address, with no additional text.
@@ -349,7 +353,7 @@ def prep_span(location):
         logging.info(f'Processing span: {loc_str}')
         
         # Set up LLM chain
-        llm = ChatOpenAI(model="gpt-4.1-mini")
+        llm = get_chat_model("gpt-4.1-mini")
         # Use single braces for our actual template variable
         template = system_prompt + "\n\nHere is the string:\n\n{input}"
         prompt = ChatPromptTemplate.from_template(template)
@@ -471,7 +475,7 @@ def prep_city(location):
     """
     Prep a city location for geocoding by returning the original text.
     """
-    city_state = get_city_state(location['location'])
+    city_state = get_city_state(location['location']) or {}
     city = city_state.get('city', '')
     state = city_state.get('state', '')
 
@@ -550,6 +554,8 @@ def prep_region_national(location):
 
 ########## CORE FUNCTION ##########
 
+@checkpoint_stage("prep")
+@instrument_stage("prep")
 def _prep_locations(payload):
     """
     Core logic for processing locations through geocoding pipeline.
@@ -643,7 +649,7 @@ def _prep_locations(payload):
 
     # Update payload with processed locations
     payload['locations'] = processed_data
-    logging.info("Prepped locations payload: %s" % json.dumps(payload, indent=2))
+    log_payload("Prepped locations payload", payload)
     return payload
 
 ########## TASKS ##########
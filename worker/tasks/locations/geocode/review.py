@@ -1,21 +1,142 @@
 import json
 import logging
 import traceback
-from langchain_openai import ChatOpenAI
+from utils.llm import get_chat_model, get_json_openai
 from langchain.prompts import ChatPromptTemplate
 from celery import Celery
+from worker.serializers import configure_celery
 from celery.exceptions import MaxRetriesExceededError
 from utils.slack import post_slack_log_message
+from utils.metrics import instrument_stage
+from utils.checkpoints import checkpoint_stage
+from utils.logs import log_payload
+from conf.settings import GEOCODE_VALIDATION_BATCH, GEOCODE_VALIDATION_BATCH_SIZE, GEOCODE_VALIDATION_BATCH_TOKENS
 import time
 import os
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-celery = Celery(__name__)
+celery = configure_celery(Celery(__name__))
 
 ########## HELPER FUNCTIONS ##########
 
+def _format_geocoded_result(geocoded_result):
+    """
+    Formats a geocoding result for inclusion in a validation prompt.
+    """
+    return (
+        f"Label: {geocoded_result.get('label', 'N/A')}\n"
+        f"City: {geocoded_result.get('boundaries', {}).get('city', {}).get('name', 'N/A')}\n"
+        f"County: {geocoded_result.get('boundaries', {}).get('county', {}).get('name', 'N/A')}\n"
+        f"State: {geocoded_result.get('boundaries', {}).get('state', {}).get('name', 'N/A')}\n"
+        f"Confidence Score: {geocoded_result.get('confidence', {}).get('score', 'N/A')}\n"
+        f"Match Type: {geocoded_result.get('confidence', {}).get('match_type', 'N/A')}"
+    )
+
+def _estimate_tokens(text):
+    """
+    Rough token estimate (about four characters per token) for batch sizing.
+    """
+    return len(text) // 4 + 1
+
+def _chunk_validation_items(items):
+    """
+    Splits formatted validation items into batches that stay under both the
+    item and the token budget for a single request.
+    """
+    batches, batch, batch_tokens = [], [], 0
+    for item in items:
+        tokens = _estimate_tokens(item['formatted'])
+        if batch and (len(batch) >= GEOCODE_VALIDATION_BATCH_SIZE or batch_tokens + tokens > GEOCODE_VALIDATION_BATCH_TOKENS):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(item)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _validate_geocoding_batch(items):
+    """
+    Use LLM to validate a batch of geocoded locations in a single request.
+
+    Args:
+        items (list): Dicts with original_text, original_context and geocoded_result
+
+    Returns:
+        list: Validation results in the same order as the items. Entries the LLM
+        left out or returned malformed are validated one at a time instead.
+    """
+    try:
+        with open(os.path.join(os.path.dirname(__file__), 'prompts/review.txt'), 'r') as f:
+            base_prompt = f.read()
+    except FileNotFoundError:
+        logging.error("Geocoding validation prompt not found")
+        raise
+
+    system_prompt = f"""{base_prompt}
+
+You will be given a numbered list of locations rather than a single one. Evaluate each independently.
+
+Return a JSON object with a single field, "results": an array containing one object per location,
+in the same order, each with three fields:
+
+- index: the number of the location in the list
+- validated: boolean indicating if the geocoding is valid
+- rationale: brief explanation of your decision"""
+
+    for item in items:
+        item['formatted'] = (
+            f"Original text: {item['original_text']}\n"
+            f"Original context: {item['original_context']}\n\n"
+            f"Geocoded result:\n{_format_geocoded_result(item['geocoded_result'])}"
+        )
+
+    validations = [None] * len(items)
+
+    offset = 0
+    for batch in _chunk_validation_items(items):
+        user_prompt = "\n\n".join(
+            f"Location {i}:\n{item['formatted']}" for i, item in enumerate(batch)
+        )
+
+        try:
+            logging.info(f"Validating {len(batch)} geocoded locations in one request")
+            response = get_json_openai(system_prompt, user_prompt, force_object=True)
+            results = response.get('results') if isinstance(response, dict) else None
+        except Exception as e:
+            logging.error(f"Error validating geocoding batch: {str(e)}")
+            results = None
+
+        # Match results back to items by index
+        for result in results or []:
+            if not isinstance(result, dict):
+                continue
+            index = result.get('index')
+            if not isinstance(index, int) or not 0 <= index < len(batch):
+                continue
+            if not isinstance(result.get('validated'), bool):
+                continue
+            validations[offset + index] = {
+                "validated": result['validated'],
+                "rationale": result.get('rationale', '')
+            }
+
+        offset += len(batch)
+
+    # Fall back to validating anything the batch didn't cover individually
+    for i, item in enumerate(items):
+        if validations[i] is None:
+            logging.warning(f"No valid batch result for location {i}, validating individually")
+            validations[i] = _validate_geocoding(
+                original_text=item['original_text'],
+                original_context=item['original_context'],
+                geocoded_result=item['geocoded_result']
+            )
+
+    return validations
+
 def _validate_geocoding(original_text, original_context, geocoded_result, max_retries=3):
     """
     Use LLM to validate a geocoded location result.
@@ -40,9 +161,16 @@ def _validate_geocoding(original_text, original_context, geocoded_result, max_re
         with open(os.path.join(os.path.dirname(__file__), 'prompts/review.txt'), 'r') as f:
             base_prompt = f.read()
             
-        # Append the template for the specific location being validated
+        # Append the output format and the template for the specific location
+        # being validated (the shared prompt only has the criteria, since batch
+        # validation asks for a different shape)
         template = f"""{base_prompt}
 
+        Return a JSON object with two fields:
+
+        - validated: boolean indicating if the geocoding is valid
+        - rationale: brief explanation of your decision
+
         Original text: {{original_text}}
         Original context: {{original_context}}
 
@@ -55,17 +183,10 @@ def _validate_geocoding(original_text, original_context, geocoded_result, max_re
         logging.error("Geocoding validation prompt not found")
         raise
         
-    llm = ChatOpenAI(model="gpt-4.1")
+    llm = get_chat_model("gpt-4.1")
     
     # Format the geocoded result
-    formatted_result = (
-        f"Label: {geocoded_result.get('label', 'N/A')}\n"
-        f"City: {geocoded_result.get('boundaries', {}).get('city', {}).get('name', 'N/A')}\n"
-        f"County: {geocoded_result.get('boundaries', {}).get('county', {}).get('name', 'N/A')}\n"
-        f"State: {geocoded_result.get('boundaries', {}).get('state', {}).get('name', 'N/A')}\n"
-        f"Confidence Score: {geocoded_result.get('confidence', {}).get('score', 'N/A')}\n"
-        f"Match Type: {geocoded_result.get('confidence', {}).get('match_type', 'N/A')}"
-    )
+    formatted_result = _format_geocoded_result(geocoded_result)
     
     prompt = ChatPromptTemplate.from_template(template)
     chain = prompt | llm
@@ -103,6 +224,8 @@ def _validate_geocoding(original_text, original_context, geocoded_result, max_re
 
 ########## CORE FUNCTION ##########
 
+@checkpoint_stage("validate")
+@instrument_stage("validate")
 def _validate_locations(payload):
     """
     Core logic for validating geocoded locations using LLM.
@@ -124,6 +247,7 @@ def _validate_locations(payload):
         logging.info("No locations provided, skipping validation")
         return payload
         
+    to_validate = []
     for item in locations:
         # Initialize geocode dict if it doesn't exist
         if 'geocode' not in item:
@@ -134,17 +258,33 @@ def _validate_locations(payload):
             geocode['validated'] = False
             geocode['rationale'] = "No geocoding results to validate"
             continue
-            
-        validation = _validate_geocoding(
-            original_text=item.get('original_text', ''),
-            original_context=item.get('location', ''),
-            geocoded_result=geocode.get('results', {})
-        )
-        
-        geocode['validated'] = validation.get('validated', False)
-        geocode['rationale'] = validation.get('rationale', '')
 
-    logging.info("Validated locations payload: %s" % json.dumps(payload, indent=2))
+        to_validate.append(item)
+
+    if GEOCODE_VALIDATION_BATCH and to_validate:
+        validations = _validate_geocoding_batch([
+            {
+                "original_text": item.get('original_text', ''),
+                "original_context": item.get('location', ''),
+                "geocoded_result": item['geocode'].get('results', {})
+            }
+            for item in to_validate
+        ])
+    else:
+        validations = [
+            _validate_geocoding(
+                original_text=item.get('original_text', ''),
+                original_context=item.get('location', ''),
+                geocoded_result=item['geocode'].get('results', {})
+            )
+            for item in to_validate
+        ]
+
+    for item, validation in zip(to_validate, validations):
+        item['geocode']['validated'] = validation.get('validated', False)
+        item['geocode']['rationale'] = validation.get('rationale', '')
+
+    log_payload("Validated locations payload", payload)
     return payload
 
 ########## TASKS ##########
@@ -1,17 +1,21 @@
-import json
 import logging
 import traceback
 import requests
 from celery import Celery
+from worker.serializers import configure_celery
 from celery.exceptions import MaxRetriesExceededError
 from conf.settings import CONTEXT_API_URL
 from utils.slack import post_slack_log_message
+from utils.metrics import instrument_stage
+from utils.checkpoints import checkpoint_stage
+from utils.logs import log_payload
 from utils.geocode import get_state_abbrev
+from utils import sessions
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-celery = Celery(__name__)
+celery = configure_celery(Celery(__name__))
 
 ########## HELPER FUNCTIONS ##########
 
@@ -35,7 +39,7 @@ def get_region_info(county_name, state_abbrev):
     query = f"{county_name},{state_abbrev}"
     
     try:
-        response = requests.get(f"{base_url}?q={query}")
+        response = sessions.get('context_api', f"{base_url}?q={query}")
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -44,6 +48,8 @@ def get_region_info(county_name, state_abbrev):
 
 ########## CORE FUNCTION ##########
 
+@checkpoint_stage("localize")
+@instrument_stage("localize")
 def _localize_locations(payload):
     """
     Core logic for adding region information to each place's boundaries.
@@ -102,7 +108,7 @@ def _localize_locations(payload):
     # Update payload with modified locations
     payload['locations'] = locations
     
-    logging.info("Localized locations payload: %s" % json.dumps(payload, indent=2))    
+    log_payload("Localized locations payload", payload)
     return payload
 
 ########## TASKS ##########
@@ -1,14 +1,17 @@
-import json
 import logging
 import traceback
 from celery import Celery
+from worker.serializers import configure_celery
 from celery.exceptions import MaxRetriesExceededError
 from utils.slack import post_slack_log_message
+from utils.metrics import instrument_stage
+from utils.checkpoints import checkpoint_stage
+from utils.logs import log_payload
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-celery = Celery(__name__)
+celery = configure_celery(Celery(__name__))
 
 ########## HELPER FUNCTIONS ##########
 
@@ -186,6 +189,8 @@ def _process_boundaries(locations):
 
 ########## CORE FUNCTION ##########
 
+@checkpoint_stage("finalize")
+@instrument_stage("finalize")
 def _finalize_locations(payload):
     """
     Core logic for finalizing locations by filtering invalid ones and organizing boundaries.
@@ -232,7 +237,7 @@ def _finalize_locations(payload):
     payload['places'] = result['places']
     del payload['locations']  # Remove old locations key
     
-    logging.info("Finalized locations payload: %s" % json.dumps(payload, indent=2))    
+    log_payload("Finalized locations payload", payload)
     return payload
 
 ########## TASKS ##########
@@ -3,18 +3,25 @@ import logging
 import traceback
 import os
 from celery import Celery
+from worker.serializers import configure_celery
 from celery.exceptions import MaxRetriesExceededError
 from utils.slack import post_slack_log_message
-from langchain_openai import ChatOpenAI
+from utils.metrics import instrument_stage
+from utils.checkpoints import checkpoint_stage
+from utils.logs import log_payload
+from utils.payload_store import get_text
+from utils.llm import get_chat_model
 from langchain.prompts import ChatPromptTemplate
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-celery = Celery(__name__)
+celery = configure_celery(Celery(__name__))
 
 ########## CORE FUNCTION ##########
 
+@checkpoint_stage("review")
+@instrument_stage("review")
 def _review_locations(payload):
     """
     Core logic for reviewing locations using LLM.
@@ -27,7 +34,7 @@ def _review_locations(payload):
         dict: Updated payload with reviewed locations
     """
     locations = payload.get('locations', [])
-    text = payload.get('text')
+    text = get_text(payload)
     url = payload.get('url')
     
     if not locations:
@@ -45,7 +52,7 @@ def _review_locations(payload):
         raise Exception("Review prompt not found")
         
     # Set up LLM chain
-    llm = ChatOpenAI(model="gpt-4.1")
+    llm = get_chat_model("gpt-4.1")
     
     # Create the template by combining base prompt with additional context
     template = base_prompt + """
@@ -87,7 +94,7 @@ Return only the JSON with no additional text."""
         logging.warning("Preserving original locations due to review failure")
         raise
     
-    logging.info("Review payload: %s" % json.dumps(payload, indent=2))    
+    log_payload("Review payload", payload)
     return payload
 
 ########## TASKS ##########
@@ -1,14 +1,33 @@
-import logging, sys, os, redis, traceback, hashlib
-from celery import Celery
-from worker.tasks.base.scrape import _scrape_article_task
-from worker.tasks.base.classify import _classify_article_task
+import logging, sys, os, redis, traceback, hashlib, time, copy
+from concurrent.futures import ThreadPoolExecutor
+from celery import Celery, chain, group
+from worker.tasks.base.scrape import _scrape_article_task, _scrape_article, _prepare_article
+from worker.tasks.base.classify import _classify_article_task, _classify_article
 from worker.tasks.locations.extract import _location_extraction_chain
+from worker.tasks.locations.extract.extract import _extract_locations_task, _extract_locations
+from worker.tasks.locations.extract.review import extract_locations_review_task, _extract_locations_review
 from worker.tasks.locations.filter import _filter_chain
+from worker.tasks.locations.filter.classify import _classify_locations_task, _classify_locations
+from worker.tasks.locations.filter.consolidate import _consolidate_locations_task, _consolidate_locations
 from worker.tasks.locations.geocode import _geocoding_chain
+from worker.tasks.locations.geocode.prep import _prep_locations_task, _prep_locations
+from worker.tasks.locations.geocode.geocode import _geocode_locations_task, _geocode_locations
+from worker.tasks.locations.geocode.review import _validate_locations_task, _validate_locations
+from worker.tasks.locations.geocode.consolidate import _consolidate_geocoded_locations_task, _consolidate_geocoded_locations
 from worker.tasks.locations.localize import _localization_chain
+from worker.tasks.locations.localize.localize import _localize_locations_task, _localize_locations
 from worker.tasks.locations.review import _review_chain
-from worker.tasks.base.output import _save_to_azure
+from worker.tasks.locations.review.review import _review_locations_task, _review_locations
+from worker.tasks.locations.review.finalize import _finalize_locations_task, _finalize_locations
+from worker.tasks.base.merge import _merge_payloads_task, _merge_payloads
+from worker.tasks.base.output import _save_to_azure, _save_output
 from utils.slack import post_slack_log_message
+from utils.checkpoints import load_checkpoint, restart_timings
+from utils.inflight import claim, record, release, get_processed
+from utils.progress import register_workflow, set_workflow_id
+from worker.serializers import configure_celery
+from worker.routing import apply_priority, task_options
+from conf.settings import PIPELINE_MODE, PRIORITIES, DEFAULT_PRIORITY
 
 ########## CELERY INITIALIZATION ##########
 
@@ -22,12 +41,12 @@ REDIS_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 celery.conf.update(
     broker_url=REDIS_URL,
     result_backend=REDIS_URL,
-    task_serializer='json',
-    accept_content=['json'],
-    result_serializer='json',
     enable_utc=True,
 )
 
+# Serialization (json or orjson_zstd) is shared with the task modules' apps
+configure_celery(celery)
+
 # Test Redis connection
 try:
     # Create Redis client from URL
@@ -51,37 +70,432 @@ logging.basicConfig(
 
 ########## WORKFLOWS ##########
 
+PIPELINE_MODES = ('chained', 'fused')
+
+# Pipeline stages in chain order: name, core function, Celery task, and the backoff (in
+# seconds) before each retry. The fused task runs the core functions with the same retries
+# and backoffs as the tasks. Article classification isn't listed: it runs alongside
+# extraction (see build_locations_workflow and _classify_in_background).
+STAGES = [
+    ('scrape', _scrape_article, _scrape_article_task, lambda retries: 60 * (2 ** retries)),
+    ('extract', _extract_locations, _extract_locations_task, lambda retries: 2 ** retries),
+    ('extract_review', _extract_locations_review, extract_locations_review_task, lambda retries: 2 ** retries),
+    ('classify_locations', _classify_locations, _classify_locations_task, lambda retries: 2 ** retries),
+    ('consolidate_locations', _consolidate_locations, _consolidate_locations_task, lambda retries: 2 ** retries),
+    ('prep', _prep_locations, _prep_locations_task, lambda retries: 2 ** retries),
+    ('geocode', _geocode_locations, _geocode_locations_task, lambda retries: 2 ** retries),
+    ('validate', _validate_locations, _validate_locations_task, lambda retries: 2 ** retries),
+    ('consolidate_geocodes', _consolidate_geocoded_locations, _consolidate_geocoded_locations_task, lambda retries: 2 ** retries),
+    ('localize', _localize_locations, _localize_locations_task, lambda retries: 2 ** retries),
+    ('review', _review_locations, _review_locations_task, lambda retries: 2 ** retries),
+    ('finalize', _finalize_locations, _finalize_locations_task, lambda retries: 2 ** retries),
+    ('save', _save_output, _save_to_azure, lambda retries: 2 ** retries)
+]
+STAGE_NAMES = [name for name, _, _, _ in STAGES]
+FUSED_STAGE_RETRIES = 3
+
+# Classification runs in parallel with extraction, so resuming from it means resuming from extraction
+STAGE_ALIASES = {'classify': 'extract'}
+
+# First stage that needs the article classification
+CLASSIFICATION_NEEDED_BY = STAGE_NAMES.index('classify_locations')
+
+def get_output_filename(url):
+    """
+    Returns the output filename for a URL's results.
+    """
+    return f"{hashlib.sha256(url.encode()).hexdigest()[:20]}.json"
+
+def get_content_filename(headline, text):
+    """
+    Returns the output filename for an article submitted by content.
+    """
+    content = f"{headline}\n{text}"
+    return f"{hashlib.sha256(content.encode()).hexdigest()[:20]}.json"
+
+def build_locations_workflow(url, output_filename=None, start=0):
+    """
+    Builds the chain that processes locations for a URL. Article classification
+    only feeds the filter stage, so it runs in parallel with location extraction
+    and the two are merged before filtering.
+
+    Args:
+        url (str): Normalized article URL
+        output_filename (str): Name of output file, derived from the URL if not given
+        start (int): Index in STAGES to start from. A chain that doesn't start
+            with the scrape must be applied with the stage's input payload as
+            its argument.
+
+    Returns:
+        Celery chain that can be applied directly
+    """
+    output_filename = output_filename or get_output_filename(url)
+
+    # Resuming after the branches have been merged
+    if start > 1:
+        return chain(*[task.s() for _, _, task, _ in STAGES[start:]])
+
+    workflow = (
+        group(
+            _location_extraction_chain(),
+            _classify_article_task.s()
+        ) |
+        _merge_payloads_task.s() |
+        _filter_chain() |
+        _geocoding_chain() |
+        _localization_chain() |
+        _review_chain() |
+        _save_to_azure.s()
+    )
+    if start == 1:
+        return workflow
+
+    return _scrape_article_task.si(url, output_filename) | workflow # Pass filename through chain
+
+def get_stage_index(stage):
+    """
+    Returns a stage's index in STAGES, accepting aliases.
+
+    Raises:
+        ValueError: If the stage is unknown
+    """
+    return STAGE_NAMES.index(STAGE_ALIASES.get(stage, stage))
+
+def load_resume_payload(output_filename, start):
+    """
+    Loads the payload a stage resumes from: the previous stage's checkpoint,
+    merged with the classification's while the branches are still separate.
+
+    Returns:
+        dict: The payload, or None if a checkpoint is missing
+    """
+    names = [STAGE_NAMES[start - 1]]
+    if 1 < start <= CLASSIFICATION_NEEDED_BY:
+        names.append('classify')
+
+    payloads = [load_checkpoint(output_filename, name) for name in names]
+    if None in payloads:
+        return None
+    return restart_timings(_merge_payloads(payloads))
+
+def find_resume_point(output_filename):
+    """
+    Finds the latest stage an article can resume from.
+
+    Returns:
+        tuple: The stage's index in STAGES and its input payload, or (0, None)
+        to start over
+    """
+    for start in range(len(STAGES) - 1, 0, -1):
+        payload = load_resume_payload(output_filename, start)
+        if payload:
+            return start, payload
+    return 0, None
+
+def submit_locations(url, mode=None, from_stage=None, resume=False, producer=None, max_age=None, dedupe=True,
+                     priority=None):
+    """
+    Submits the locations workflow for a URL straight to the broker, without a
+    dispatcher task in between. If the URL is already being processed, returns
+    the running workflow instead of submitting another.
+
+    Args:
+        url (str): Normalized article URL
+        mode (str): "chained" or "fused", defaults to PIPELINE_MODE
+        from_stage (str): Stage to resume from, using the checkpoints of the
+            stages before it
+        resume (bool): Whether to resume from the latest stage that can be,
+            rather than start over
+        producer: Kombu producer to publish with, to share one broker
+            connection across many submissions
+        max_age (float): If the article was saved within this many seconds,
+            return where instead of processing it again
+        dedupe (bool): Whether to attach to a workflow already processing the URL
+        priority (str): One of PRIORITIES, defaults to DEFAULT_PRIORITY
+
+    Returns:
+        dict: The final task's ID (whose result is the saved payload), the root
+        (first) task's ID, the output filename, the mode, the first stage, the
+        priority and whether it was deduplicated. If the article was saved within max_age,
+        just the output filename and the saved output's location ("processed").
+
+    Raises:
+        ValueError: If the mode, stage or priority is unknown
+        LookupError: If there are no checkpoints to resume from_stage from
+    """
+    mode, priority = _validate_options(mode, priority)
+
+    output_filename = get_output_filename(url)
+    if from_stage:
+        get_stage_index(from_stage)
+
+    # Skip articles saved recently enough
+    if max_age:
+        processed = get_processed(output_filename, max_age)
+        if processed:
+            return {"output_filename": output_filename, "processed": processed}
+
+    def get_start():
+        if from_stage:
+            start = get_stage_index(from_stage)
+            if not start:
+                return 0, None
+            payload = load_resume_payload(output_filename, start)
+            if payload is None:
+                raise LookupError(f"No checkpoint to resume {url} from stage {from_stage}")
+            return start, payload
+        if resume:
+            return find_resume_point(output_filename)
+        return 0, None
+
+    return _submit_workflow(url, output_filename, mode, priority, get_start, producer=producer, dedupe=dedupe)
+
+def submit_article(article, mode=None, producer=None, dedupe=True, priority=None):
+    """
+    Submits the locations workflow for an article whose content is already
+    known (e.g. from the CMS), skipping the scrape. The output filename is a
+    hash of the content, so the URL is optional.
+
+    Args:
+        article (dict): headline and text, and optionally url, author and pub_date
+        mode (str): "chained" or "fused", defaults to PIPELINE_MODE
+        producer: Kombu producer to publish with
+        dedupe (bool): Whether to attach to a workflow already processing the article
+        priority (str): One of PRIORITIES, defaults to DEFAULT_PRIORITY
+
+    Returns:
+        dict: As for submit_locations
+
+    Raises:
+        ValueError: If the mode or priority is unknown or the article has no
+            headline or text
+    """
+    mode, priority = _validate_options(mode, priority)
+
+    url = article.get('url') or ''
+    output_filename = get_content_filename(article.get('headline', ''), article.get('text', ''))
+
+    def get_start():
+        payload = _prepare_article(article, output_filename)
+        # The article stands in for the scrape, so later stages can be checkpointed
+        payload['_timings'] = {"stages": [], "resumed": ['scrape']}
+        return STAGE_NAMES.index('extract'), payload
+
+    return _submit_workflow(url, output_filename, mode, priority, get_start, producer=producer, dedupe=dedupe)
+
+def _validate_options(mode, priority):
+    """
+    Fills in the default mode and priority.
+
+    Raises:
+        ValueError: If either is unknown
+    """
+    mode = mode or PIPELINE_MODE
+    if mode not in PIPELINE_MODES:
+        raise ValueError(f"Unknown pipeline mode: {mode}")
+    priority = priority or DEFAULT_PRIORITY
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority: {priority}")
+    return mode, priority
+
+def _submit_workflow(url, output_filename, mode, priority, get_start, producer=None, dedupe=True):
+    """
+    Claims an article and submits its workflow, or returns the workflow that
+    already holds the claim. Every task in the workflow is sent at the
+    request's priority.
+
+    Args:
+        get_start: Called once the article is claimed, returns the index in
+            STAGES to start from and that stage's input payload
+    """
+    # Attach to the workflow already processing this article, if there is one
+    if dedupe:
+        existing = claim(output_filename)
+        if existing:
+            logging.info(f"{url or output_filename} is already being processed by task {existing.get('task_id')}")
+            return {**existing, "deduplicated": True}
+
+    try:
+        start, payload = get_start()
+        if start:
+            logging.info(f"Starting {url or output_filename} from stage {STAGE_NAMES[start]}")
+
+        if mode == 'fused':
+            result = _process_locations_fused.apply_async(
+                args=[url, output_filename],
+                kwargs={"payload": payload, "stage": start} if start else None,
+                producer=producer,
+                **task_options(_process_locations_fused.name, priority)
+            )
+        else:
+            workflow = apply_priority(build_locations_workflow(url, output_filename, start), priority)
+            if dedupe:
+                # A task that fails ends the chain before the save, which would
+                # otherwise leave the claim for duplicate requests to attach to
+                workflow.link_error(_release_failed_workflow.s(output_filename=output_filename))
+            result = workflow.apply_async(args=(payload,) if start else (), producer=producer)
+    except Exception:
+        if dedupe:
+            release(output_filename)
+        raise
+
+    root = result
+    while root.parent is not None:
+        root = root.parent
+
+    submitted = {
+        "task_id": result.id,
+        "root_id": root.id,
+        "output_filename": output_filename,
+        "mode": mode,
+        "from_stage": STAGE_NAMES[start],
+        "priority": priority,
+        "submitted_at": round(time.time(), 3),
+        "deduplicated": False
+    }
+    register_workflow(submitted)
+    if dedupe:
+        record(output_filename, submitted)
+    return submitted
+
 @celery.task(name="process_locations")
 def process_locations(url):
     """
-    Process locations from text
+    Process locations from text. Kept for callers that still enqueue this task;
+    the API submits the workflow directly with submit_locations.
     """
     try:
         logging.info(f"Processing locations from url: {url}")
         
-        # Generate output filename
-        output_filename = f"{hashlib.sha256(url.encode()).hexdigest()[:20]}.json"
-        
-        # Create a chain that executes once
-        workflow = (
-            _scrape_article_task.si(url, output_filename) | # Pass filename through chain
-            _classify_article_task.s() |
-            _location_extraction_chain() |
-            _filter_chain() |
-            _geocoding_chain() |
-            _localization_chain() |
-            _review_chain() |
-            _save_to_azure.s()
-        )
-        
         # Execute the workflow
-        result = workflow.apply_async()
+        submitted = submit_locations(url)
         
-        return {"status": "success", "task_id": result.id}
+        return {"status": "success", "task_id": submitted["task_id"], "root_id": submitted["root_id"]}
     except Exception as e:
         logging.error(f"Error processing locations: {str(e)}")
         post_slack_log_message('Error processing locations %s' % url, {
             'error_message':  str(e.args[0]),
             'traceback':  traceback.format_exc()
         }, 'create_error')
-        return {"status": "error", "error": str(e)}
\ No newline at end of file
+        return {"status": "error", "error": str(e)}
+
+@celery.task(name="release_failed_workflow")
+def _release_failed_workflow(request, exc, tb, output_filename=None):
+    """
+    Errback for the chained workflow. Releases the article's claim when one of
+    its tasks fails for good, so new requests for the URL start over rather
+    than attaching to a workflow that will never save.
+    """
+    logging.error(f"Workflow for {output_filename} failed at task {request.id}: {str(exc)}")
+    release(output_filename, request.root_id or request.id)
+
+def _classify_in_background(payload, workflow_id=None):
+    """
+    Classifies an article for the fused task, on a separate thread while the
+    main one extracts locations. Retries like the classify task does, sleeping
+    through the backoff since it only holds up this thread.
+
+    Args:
+        payload (dict): Scraped article payload
+        workflow_id (str): Workflow the fused task belongs to, for its progress
+
+    Returns:
+        dict: Classification payload, or None if classification failed
+    """
+    set_workflow_id(workflow_id)
+    for retries in range(FUSED_STAGE_RETRIES + 1):
+        try:
+            return _classify_article(payload)
+        except Exception as e:
+            if retries == FUSED_STAGE_RETRIES:
+                logging.error(f"Max retries exceeded for stage classify: {str(e)}")
+                post_slack_log_message(f'Error classifying story {payload.get("url")} (max retries exceeded)', {
+                    'error_message': str(e.args[0]) if e.args else str(e),
+                    'traceback': traceback.format_exc()
+                }, 'create_error')
+                return None
+            logging.error(f"Stage classify failed, retrying in {2 ** retries} seconds. Error: {str(e)}")
+            time.sleep(2 ** retries)
+
+@celery.task(name="process_locations_fused", bind=True, max_retries=FUSED_STAGE_RETRIES * len(STAGES))
+def _process_locations_fused(self, url, output_filename, payload=None, stage=0, stage_retries=0):
+    """
+    Runs every stage of the locations workflow in this task, passing the payload
+    between them in memory rather than through the broker.
+
+    Each stage is retried like its own task would be: up to FUSED_STAGE_RETRIES
+    times with the same backoff. A retry re-queues this task from the failed
+    stage with the payload so far, so earlier stages aren't repeated and the
+    worker isn't blocked while backing off. Once a stage is out of retries the
+    article carries on without locations, as in the chain; if the scrape fails
+    there is nothing to carry on with, so the task fails.
+
+    Article classification runs on a second thread from the end of the scrape
+    until the filter stage needs it, and goes along with the payload if the
+    task is retried in between.
+
+    Args:
+        url (str): Normalized article URL
+        output_filename (str): Name of output file
+        payload (dict): Payload so far, when resuming after a retry
+        stage (int): Index in STAGES to start or resume from
+        stage_retries (int): Retries so far of the stage being resumed
+
+    Returns:
+        dict: The saved payload
+
+    Raises:
+        Exception: The scrape's error, once it is out of retries
+    """
+    logging.info(f"Starting fused workflow [Task ID: {self.request.id}] at stage {STAGE_NAMES[stage]} for URL: {url}")
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        classification = None
+
+        while stage < len(STAGES):
+            name, func, _, backoff = STAGES[stage]
+
+            if 0 < stage < CLASSIFICATION_NEEDED_BY and classification is None and 'story_type' not in payload:
+                # The copy keeps the two threads from appending to the same _timings
+                classification = executor.submit(
+                    _classify_in_background, copy.deepcopy(payload), self.request.root_id or self.request.id
+                )
+            elif stage == CLASSIFICATION_NEEDED_BY and classification is not None:
+                payload = _merge_payloads([payload, classification.result()])
+                classification = None
+
+            try:
+                payload = func(url, output_filename) if name == 'scrape' else func(payload)
+
+            except Exception as e:
+                if stage_retries < FUSED_STAGE_RETRIES:
+                    if classification is not None:
+                        payload = _merge_payloads([payload, classification.result()])
+
+                    countdown = backoff(stage_retries)
+                    logging.error(f"Stage {name} failed, retrying in {countdown} seconds. Error: {str(e)}")
+                    raise self.retry(
+                        exc=e,
+                        countdown=countdown,
+                        kwargs={"payload": payload, "stage": stage, "stage_retries": stage_retries + 1}
+                    )
+
+                logging.error(f"Max retries exceeded for stage {name}: {str(e)}")
+                post_slack_log_message(f'Error in {name} stage {url} (max retries exceeded)', {
+                    'error_message': str(e.args[0]) if e.args else str(e),
+                    'traceback': traceback.format_exc()
+                }, 'create_error')
+
+                if name == 'scrape':
+                    # Fail the task, as the chain does, so it isn't reported
+                    # complete without a saved result
+                    release(output_filename, self.request.id)
+                    raise
+                if name != 'save':
+                    payload['locations'] = None
+
+            stage += 1
+            stage_retries = 0
+
+    release(output_filename, self.request.id)
+    return payload
\ No newline at end of file